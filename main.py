@@ -1,59 +1,55 @@
+import argparse
 import os
 import subprocess
-import argparse
-from tabulate import tabulate
+import sys
+
+from snapshot_manager.cli import main as snapshot_manager
+
+
+VENV_DIR = "snapvenv"
+VENV_PYTHON = os.path.join(VENV_DIR, "bin", "python")
+
 
 def setup_venv():
-    subprocess.run(["python", "-m", "venv", "snapvenv"])
-    subprocess.run(["snapvenv/bin/activate"])
-    subprocess.run(["pip3", "install", "--upgrade", "pip"])
-    subprocess.run(["pip", "install", "-r", "requirements.txt"])
+    subprocess.run([sys.executable, "-m", "venv", VENV_DIR])
+    subprocess.run([os.path.join(VENV_DIR, "bin", "pip"), "install", "--upgrade", "pip"])
+    subprocess.run([os.path.join(VENV_DIR, "bin", "pip"), "install", "-r", "requirements.txt"])
 
-def validate_snapshots():
-    if not os.path.exists("validate_snap/snapshot_list.txt"):
-        print("snapshot_list.txt not found. Creating an empty file.")
-        with open("validate_snap/snapshot_list.txt", "w") as file:
-            pass
-    subprocess.run(["python", "validate_snap/validate-snap.py"])
 
-def create_snapshots():
-    subprocess.run(["python", "create-snap/az_create-snap-promax.py"])
+def in_venv():
+    return os.path.realpath(sys.prefix) == os.path.realpath(VENV_DIR)
 
-def delete_snapshots():
-    subprocess.run(["python", "az-delete-snapshot-BETA.py"])
 
 def main():
     parser = argparse.ArgumentParser(description="Snapshot Management Menu")
     parser.add_argument("operation", choices=["validate", "create", "delete", "exit"], help="Choose an operation")
+    parser.add_argument("file", nargs="?", help="Snapshot ID file for validate/delete")
 
     args = parser.parse_args()
 
-    if not os.path.exists("snapvenv"):
+    if not os.path.exists(VENV_DIR):
         setup_venv()
+    if not in_venv() and os.path.exists(VENV_PYTHON):
+        # Once, so the command runs with the packages installed in the venv rather than whatever this interpreter has
+        os.execv(VENV_PYTHON, [VENV_PYTHON, os.path.abspath(__file__)] + sys.argv[1:])
 
-    if args.operation == "validate":
-        validate_snapshots()
-    elif args.operation == "create":
-        create_snapshots()
-    elif args.operation == "delete":
-        delete_snapshots()
-    elif args.operation == "exit":
+    if args.operation == "exit":
         print("Exiting...")
-        return
+        return 0
 
-    # Add runtime checks before and after the migration
+    # Runs in this process (or the resident daemon, when one is listening) instead of spawning another interpreter
+    argv = [args.operation] + ([args.file] if args.file else [])
+    code = snapshot_manager(argv)
 
-    # Add error handling
+    from tabulate import tabulate
 
-    # Display run summary as a table
     summary = [
         ["Operation", args.operation],
-        ["Status", "Success"],
-        # Add more summary data as needed
+        ["Status", "Success" if code == 0 else f"Failed (exit code {code})"],
     ]
     print(tabulate(summary, headers=["Attribute", "Value"], tablefmt="grid"))
+    return code
 
-    # Add prompt to ask the user if they want to save the log file
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
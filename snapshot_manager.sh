@@ -8,19 +8,32 @@ setup_venv() {
     pip install -r requirements.txt
 }
 
+# Start the resident worker so each menu action skips interpreter start-up and account lookups
+start_daemon() {
+    python -m snapshot_manager serve > snapshot_manager_daemon.log 2>&1 &
+    DAEMON_PID=$!
+}
+
+stop_daemon() {
+    if [ -n "$DAEMON_PID" ]; then
+        python -m snapshot_manager serve --stop > /dev/null 2>&1
+        wait "$DAEMON_PID" 2>/dev/null
+    fi
+}
+
 # Function to validate snapshots
 validate_snapshots() {
-    python validate_snap/validate-snap.py
+    python -m snapshot_manager validate
 }
 
 # Function to create snapshots
 create_snapshots() {
-    python create-snap/az_create-snap-promax.py
+    python -m snapshot_manager create
 }
 
 # Function to delete snapshots
 delete_snapshots() {
-    python az-delete-snapshot-BETA.py
+    python -m snapshot_manager delete
 }
 
 # Setup virtual environment if it doesn't exist
@@ -30,6 +43,9 @@ else
     source snapvenv/bin/activate
 fi
 
+start_daemon
+trap stop_daemon EXIT
+
 # Main menu loop
 while true; do
     echo "Snapshot Management Menu"
@@ -60,4 +76,4 @@ while true; do
     esac
 
     echo
-done
\ No newline at end of file
+done
@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+
+from .auth import HTTP_TIMEOUT, get_credential
+
+ARM_ENDPOINT = os.environ.get('SNAPSHOT_ARM_ENDPOINT', 'https://management.azure.com').rstrip('/')
+SNAPSHOT_API_VERSION = '2023-04-02'
+LOCK_API_VERSION = '2016-09-01'
+BATCH_API_VERSION = '2020-06-01'
+# Requests carried by one POST to /batch
+BATCH_SIZE = 20
+# Long-running deletes are polled until done, like 'az snapshot delete' does without --no-wait
+LRO_TIMEOUT = 600
+LRO_POLL_INTERVAL = 2
+RUNNING_STATES = ('InProgress', 'Running', 'Accepted', 'Creating', 'Deleting', 'Updating')
+# What a DELETE answered with 204 No Content reports when the caller asks to tell that apart: ARM deletes
+# of a resource that does not exist succeed without doing anything
+NOTHING_DELETED = "Error: (ResourceNotFound) Nothing to delete, the resource does not exist (204 No Content)"
+
+
+class ArmError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(f"({code}) {message}")
+        self.status = status
+        self.code = code
+
+
+def subscription_of(path):
+    parts = path.split('/')
+    return parts[2] if len(parts) > 2 and parts[1].lower() == 'subscriptions' else None
+
+
+def with_api_version(url, api_version):
+    return f"{url}{'&' if '?' in url else '?'}api-version={api_version}" if api_version else url
+
+
+def relative_url(url):
+    return url[len(ARM_ENDPOINT):] if url.startswith(ARM_ENDPOINT) else url
+
+
+def arm_request(method, path, api_version=None, body=None, subscription=None):
+    # Returns (status, headers, parsed body); raises ArmError with the ARM error code on failure
+    url = with_api_version(path if path.startswith('http') else f"{ARM_ENDPOINT}{path}", api_version)
+    credential = get_credential()
+    token = credential.get_token(credential.tenant_for(subscription or subscription_of(relative_url(path))))
+    headers = {'Authorization': f"Bearer {token}"}
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers['Content-Type'] = 'application/json'
+    request = urllib.request.Request(url, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT) as response:
+            payload = response.read()
+            return response.status, response.headers, json.loads(payload) if payload else None
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        try:
+            error = json.loads(payload).get('error') or {}
+        except ValueError:
+            error = {}
+        raise ArmError(e.code, error.get('code') or f"HTTP{e.code}", error.get('message') or payload.decode(errors='replace')[:500])
+    except urllib.error.URLError as e:
+        raise ArmError(None, 'ConnectionError', str(e.reason))
+
+
+def item_result(status, content):
+    # Maps one response to the run_az_command contract: the JSON text on success, "Error: (Code) message" otherwise
+    if status and status < 300:
+        return json.dumps(content) if content is not None else ''
+    error = (content or {}).get('error') or {} if isinstance(content, dict) else {}
+    return f"Error: ({error.get('code') or f'HTTP{status}'}) {error.get('message') or content or ''}"
+
+
+def operation_outcome(status, body):
+    # None while a long-running operation is still going, otherwise its item_result
+    state = body.get('status') if isinstance(body, dict) else None
+    if status == 202 or state in RUNNING_STATES:
+        return None
+    if state in ('Failed', 'Canceled'):
+        error = body.get('error') or {}
+        return f"Error: ({error.get('code') or state}) {error.get('message') or f'Operation {state.lower()}'}"
+    return item_result(status, None)
+
+
+def poll_url(headers):
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+    return headers.get('azure-asyncoperation') or headers.get('location')
+
+
+def wait_for_operation(headers):
+    url = poll_url(headers)
+    if not url:
+        return
+    deadline = time.time() + LRO_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(float(headers.get('Retry-After') or LRO_POLL_INTERVAL))
+        status, headers, body = arm_request('GET', url)
+        outcome = operation_outcome(status, body)
+        if outcome is None:
+            continue
+        if outcome.startswith("Error:"):
+            raise RuntimeError(outcome[len("Error: "):])
+        return
+    raise ArmError(None, 'OperationTimeout', f"Operation still running after {LRO_TIMEOUT}s")
+
+
+def arm_batch(requests, subscription=None):
+    # requests are (method, path, api_version); responses come back in the same order as (status, headers, content)
+    body = {'requests': [{'name': str(index), 'httpMethod': method, 'url': with_api_version(relative_url(path), api_version)}
+                         for index, (method, path, api_version) in enumerate(requests)]}
+    status, headers, payload = arm_request('POST', '/batch', BATCH_API_VERSION, body, subscription=subscription)
+    # ARM may answer a batch asynchronously; the Location URL returns the responses once they are all done
+    while status == 202:
+        time.sleep(float(headers.get('Retry-After') or LRO_POLL_INTERVAL))
+        status, headers, payload = arm_request('GET', headers['Location'], subscription=subscription)
+    by_name = {response.get('name'): response for response in (payload or {}).get('responses', [])}
+    results = []
+    for index in range(len(requests)):
+        response = by_name.get(str(index))
+        if response is None:
+            results.append((None, {}, {'error': {'code': 'BatchResponseMissing', 'message': 'No response for this request in the batch'}}))
+        else:
+            results.append((response.get('httpStatusCode'), response.get('headers') or {}, response.get('content')))
+    return results
+
+
+def run_batch(requests, subscription=None):
+    # Same per-item contract as run_arm; a failure of the whole batch becomes every item's error
+    try:
+        return [item_result(status, content) for status, _, content in arm_batch(requests, subscription)]
+    except (ArmError, RuntimeError) as e:
+        logging.error(f"ARM batch of {len(requests)} requests failed: {str(e)}")
+        return [f"Error: {str(e)}"] * len(requests)
+
+
+def run_arm(method, path, api_version, body=None, wait=False, no_content=None):
+    # Same contract as run_az_command: the JSON text on success, "Error: ..." on failure, and
+    # no_content instead of success for a 204 when given
+    try:
+        status, headers, payload = arm_request(method, path, api_version, body)
+        if status == 204 and no_content is not None:
+            return no_content
+        if wait and status == 202:
+            wait_for_operation(headers)
+        return json.dumps(payload) if payload is not None else ''
+    except (ArmError, RuntimeError) as e:
+        logging.error(f"ARM {method} {path} failed: {str(e)}")
+        return f"Error: {str(e)}"
+
+
+def show_snapshot(snapshot_id):
+    return run_arm('GET', snapshot_id, SNAPSHOT_API_VERSION)
+
+
+def delete_snapshot(snapshot_id, no_content=None):
+    return run_arm('DELETE', snapshot_id, SNAPSHOT_API_VERSION, wait=True, no_content=no_content)
+
+
+def show_snapshots(snapshot_ids):
+    return run_batch([('GET', snapshot_id, SNAPSHOT_API_VERSION) for snapshot_id in snapshot_ids],
+                     subscription_of(snapshot_ids[0]))
+
+
+def delete_snapshots(snapshot_ids, no_content=None):
+    subscription = subscription_of(snapshot_ids[0])
+    try:
+        responses = arm_batch([('DELETE', snapshot_id, SNAPSHOT_API_VERSION) for snapshot_id in snapshot_ids], subscription)
+        results = [None] * len(snapshot_ids)
+        pending = {}
+        for index, (status, headers, content) in enumerate(responses):
+            if status == 202 and poll_url(headers):
+                pending[index] = poll_url(headers)
+            elif status == 204 and no_content is not None:
+                results[index] = no_content
+            else:
+                results[index] = item_result(status, content)
+
+        # The operations of one batch are polled together, again through /batch
+        deadline = time.time() + LRO_TIMEOUT
+        while pending and time.time() < deadline:
+            time.sleep(LRO_POLL_INTERVAL)
+            polled = arm_batch([('GET', url, None) for url in pending.values()], subscription)
+            for (index, url), (status, _, content) in zip(list(pending.items()), polled):
+                outcome = operation_outcome(status, content)
+                if outcome is not None:
+                    results[index] = outcome
+                    del pending[index]
+        for index in pending:
+            results[index] = f"Error: (OperationTimeout) Delete still running after {LRO_TIMEOUT}s"
+        return results
+    except (ArmError, RuntimeError) as e:
+        logging.error(f"ARM batch delete of {len(snapshot_ids)} snapshots failed: {str(e)}")
+        return [f"Error: {str(e)}"] * len(snapshot_ids)
+
+
+def copy_snapshot(source_id, target_id, location):
+    # CopyStart is accepted at once and copies in the background; completionPercent on the copy tracks it
+    body = {'location': location,
+            'properties': {'creationData': {'createOption': 'CopyStart', 'sourceResourceId': source_id}, 'incremental': True}}
+    return run_arm('PUT', target_id, SNAPSHOT_API_VERSION, body)
+
+
+def list_resources(path, api_version):
+    # Every item of a paged ARM listing, flattened to the shape of the az listing queries: the properties
+    # next to id, name and the other top-level fields
+    resources = []
+    while path:
+        _, _, page = arm_request('GET', path, None if path.startswith('http') else api_version)
+        for resource in page.get('value', []):
+            item = {key: value for key, value in resource.items() if key != 'properties'}
+            item.update(resource.get('properties', {}))
+            resources.append(item)
+        path = page.get('nextLink')
+    return resources
+
+
+def list_snapshots(subscription_id, resource_group=None):
+    scope = f"/subscriptions/{subscription_id}" + (f"/resourceGroups/{resource_group}" if resource_group else '')
+    return list_resources(f"{scope}/providers/Microsoft.Compute/snapshots", SNAPSHOT_API_VERSION)
+
+
+def list_disks(subscription_id):
+    return list_resources(f"/subscriptions/{subscription_id}/providers/Microsoft.Compute/disks", SNAPSHOT_API_VERSION)
+
+
+def list_locks(subscription_id):
+    # Flattened to the shape 'az lock list' prints so parse_lock handles both
+    return list_resources(f"/subscriptions/{subscription_id}/providers/Microsoft.Authorization/locks", LOCK_API_VERSION)
+
+
+def delete_lock(lock_id):
+    arm_request('DELETE', lock_id, LOCK_API_VERSION)
+
+
+def create_lock(scope, name, level, notes=None):
+    properties = {'level': level}
+    if notes:
+        properties['notes'] = notes
+    arm_request('PUT', f"{scope}/providers/Microsoft.Authorization/locks/{name}", LOCK_API_VERSION, {'properties': properties})
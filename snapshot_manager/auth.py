@@ -0,0 +1,214 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+
+from .az import cached_account_lookup, run_az_json
+
+ARM_RESOURCE = 'https://management.azure.com/'
+AUTHORITY_HOST = 'https://login.microsoftonline.com'
+IMDS_ENDPOINT = 'http://169.254.169.254/metadata/identity/oauth2/token'
+# 'az' keeps every call on the az CLI; the other modes talk to ARM in-process with a shared token
+AUTH_MODES = ('az', 'cli-token', 'service-principal', 'managed-identity')
+# Tokens are renewed this long before they expire; while one thread renews, the others keep
+# using the current token as long as it has at least MIN_VALIDITY seconds left
+REFRESH_MARGIN = 300
+MIN_VALIDITY = 30
+HTTP_TIMEOUT = 30
+
+_auth_mode = os.environ.get('SNAPSHOT_AUTH', 'az')
+_credential = None
+_credential_lock = threading.Lock()
+
+
+class AccessToken(NamedTuple):
+    token: str
+    expires_on: float
+
+
+def http_json(request, timeout=HTTP_TIMEOUT):
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"{request.full_url.split('?')[0]} returned {e.code}: {e.read().decode(errors='replace')[:500]}")
+    except urllib.error.URLError as e:
+        raise RuntimeError(f"{request.full_url.split('?')[0]} unreachable: {e.reason}")
+
+
+class TokenCredential:
+    def __init__(self):
+        self._tokens = {}
+        self._refresh_locks = {}
+        self._lock = threading.Lock()
+
+    def tenant_for(self, subscription_id):
+        return None
+
+    def get_token(self, tenant=None):
+        return self.get_access_token(tenant).token
+
+    def get_access_token(self, tenant=None):
+        cached = self._tokens.get(tenant)
+        if cached and cached.expires_on - time.time() > REFRESH_MARGIN:
+            return cached
+        with self._lock:
+            refresh_lock = self._refresh_locks.setdefault(tenant, threading.Lock())
+        still_usable = cached is not None and cached.expires_on - time.time() > MIN_VALIDITY
+        if refresh_lock.acquire(blocking=not still_usable):
+            try:
+                cached = self._tokens.get(tenant)
+                if not cached or cached.expires_on - time.time() <= REFRESH_MARGIN:
+                    cached = self._acquire(tenant)
+                    self._tokens[tenant] = cached
+                    logging.info(f"Acquired ARM token for tenant {tenant or 'default'} via {type(self).__name__}, "
+                                 f"valid for {cached.expires_on - time.time():.0f}s")
+            finally:
+                refresh_lock.release()
+        return cached
+
+    def _acquire(self, tenant):
+        raise NotImplementedError
+
+
+class AzureCliCredential(TokenCredential):
+    # One 'az account get-access-token' per tenant per token lifetime instead of a token cache read per az call
+    def tenant_for(self, subscription_id):
+        return cached_account_lookup('tenants', lambda: {
+            sub['id'].lower(): sub['tenantId']
+            for sub in run_az_json(['az', 'account', 'list', '--query', '[].{id:id, tenantId:tenantId}', '-o', 'json']) or []
+        }).get((subscription_id or '').lower())
+
+    def _acquire(self, tenant):
+        command = ['az', 'account', 'get-access-token', '--resource', ARM_RESOURCE, '-o', 'json']
+        if tenant:
+            command += ['--tenant', tenant]
+        data = run_az_json(command)
+        if data.get('expires_on'):
+            expires_on = float(data['expires_on'])
+        else:
+            expires_on = datetime.datetime.strptime(data['expiresOn'], '%Y-%m-%d %H:%M:%S.%f').timestamp()
+        return AccessToken(data['accessToken'], expires_on)
+
+
+class ClientSecretCredential(TokenCredential):
+    def __init__(self, tenant_id, client_id, client_secret, authority=None):
+        super().__init__()
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.authority = (authority or os.environ.get('AZURE_AUTHORITY_HOST') or AUTHORITY_HOST).rstrip('/')
+
+    def _acquire(self, tenant):
+        body = urllib.parse.urlencode({
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'scope': ARM_RESOURCE + '.default',
+        }).encode()
+        request = urllib.request.Request(f"{self.authority}/{tenant or self.tenant_id}/oauth2/v2.0/token", data=body)
+        data = http_json(request)
+        return AccessToken(data['access_token'], time.time() + float(data['expires_in']))
+
+
+class ManagedIdentityCredential(TokenCredential):
+    def __init__(self, client_id=None):
+        super().__init__()
+        self.client_id = client_id
+
+    def _acquire(self, tenant):
+        params = {'resource': ARM_RESOURCE}
+        if self.client_id:
+            params['client_id'] = self.client_id
+        # App Service and Functions publish IDENTITY_ENDPOINT/IDENTITY_HEADER; VMs use IMDS
+        if os.environ.get('IDENTITY_ENDPOINT') and os.environ.get('IDENTITY_HEADER'):
+            params['api-version'] = '2019-08-01'
+            request = urllib.request.Request(f"{os.environ['IDENTITY_ENDPOINT']}?{urllib.parse.urlencode(params)}",
+                                             headers={'X-IDENTITY-HEADER': os.environ['IDENTITY_HEADER']})
+        else:
+            params['api-version'] = '2018-02-01'
+            endpoint = os.environ.get('IDENTITY_ENDPOINT') or IMDS_ENDPOINT
+            request = urllib.request.Request(f"{endpoint}?{urllib.parse.urlencode(params)}", headers={'Metadata': 'true'})
+        data = http_json(request)
+        if data.get('expires_on'):
+            expires_on = float(data['expires_on'])
+        else:
+            expires_on = time.time() + float(data['expires_in'])
+        return AccessToken(data['access_token'], expires_on)
+
+
+def auth_mode():
+    return _auth_mode
+
+
+def set_auth_mode(mode):
+    global _auth_mode, _credential
+    if mode not in AUTH_MODES:
+        raise ValueError(f"Unknown auth mode '{mode}', expected one of {', '.join(AUTH_MODES)}")
+    with _credential_lock:
+        if mode != _auth_mode:
+            _credential = None
+        _auth_mode = mode
+
+
+def get_credential():
+    # One credential per process, so every worker thread shares the same cached tokens
+    global _credential
+    with _credential_lock:
+        if _credential is None:
+            if _auth_mode == 'service-principal':
+                missing = [name for name in ('AZURE_TENANT_ID', 'AZURE_CLIENT_ID', 'AZURE_CLIENT_SECRET') if not os.environ.get(name)]
+                if missing:
+                    raise RuntimeError(f"Service principal auth needs {', '.join(missing)} to be set.")
+                _credential = ClientSecretCredential(os.environ['AZURE_TENANT_ID'], os.environ['AZURE_CLIENT_ID'],
+                                                     os.environ['AZURE_CLIENT_SECRET'])
+            elif _auth_mode == 'managed-identity':
+                _credential = ManagedIdentityCredential(os.environ.get('AZURE_CLIENT_ID'))
+            else:
+                _credential = AzureCliCredential()
+        return _credential
+
+
+class StubTokenHandler(BaseHTTPRequestHandler):
+    # Answers both the AAD client-credentials and the managed identity token requests with fake tokens
+    lifetime = 3600
+    issued = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._issue()
+
+    def do_GET(self):
+        self._issue()
+
+    def _issue(self):
+        type(self).issued += 1
+        body = json.dumps({
+            'token_type': 'Bearer',
+            'access_token': f"stub-token-{type(self).issued}",
+            'expires_in': self.lifetime,
+            'expires_on': str(int(time.time() + self.lifetime)),
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Stub token endpoint: {format % args}")
+
+
+def serve_stub_token_endpoint(port=0, lifetime=3600):
+    # Point AZURE_AUTHORITY_HOST or IDENTITY_ENDPOINT at the returned server to exercise the token paths offline
+    handler = type('StubTokenHandler', (StubTokenHandler,), {'lifetime': lifetime})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, name='stub-token-endpoint', daemon=True).start()
+    return server
@@ -0,0 +1,331 @@
+import json
+import logging
+import os
+import shlex
+import queue
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+try:
+    # Several times faster than json on the tenant-wide listings; optional like pyarrow
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Account lookups barely change during a session, so a long-lived process (serve/shell) reuses them
+ACCOUNT_CACHE_TTL = 900
+# Seconds an az command may run before its process group is killed, by kind (the verb, e.g. 'show').
+# Deletes and creates wait for the operation unless --no-wait; a stuck login or network stall hits these
+COMMAND_TIMEOUTS = {'show': 60, 'list': 300, 'get-access-token': 60, 'delete': 900, 'create': 900}
+DEFAULT_COMMAND_TIMEOUT = 300
+# Seconds between SIGTERM and SIGKILL for a timed-out command
+KILL_GRACE = 5
+# Read-only commands that timed out are run again this many times; the others are reported as retryable errors
+TIMEOUT_RETRIES = 1
+READ_ONLY_KINDS = ('show', 'list', 'get-access-token')
+TIMEOUT_CODE = 'CommandTimeout'
+# Failures that a rerun can be expected to get past
+RETRYABLE_CODES = (TIMEOUT_CODE, 'TooManyRequests', 'ServerBusy', 'InternalServerError', 'GatewayTimeout',
+                   'ServiceUnavailable', 'ConnectionError')
+
+# 'process' spawns az for every command; 'workers' keeps azure-cli loaded in a few long-lived Python processes
+# and feeds them commands over a pipe, so a call costs the request instead of interpreter and module start-up
+AZ_BACKENDS = ('process', 'workers')
+AZ_WORKERS = 4
+# Interpreter the workers run under; az installed from the OS packages has its own, e.g. /opt/az/bin/python3
+AZ_PYTHON = os.environ.get('SNAPSHOT_AZ_PYTHON') or sys.executable
+WORKER_START_TIMEOUT = 120
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'azworker.py')
+
+_account_cache = {}
+_account_cache_lock = threading.Lock()
+_timeouts = {}
+# Commands killed on timeout by kind, for the metrics file and the end-of-run warning
+_timed_out = Counter()
+_timed_out_lock = threading.Lock()
+
+
+def load_command_timeouts(overrides=()):
+    # SNAPSHOT_AZ_TIMEOUTS='{"delete": 1200}' first, then --az-timeout (kind, seconds) pairs, where a None
+    # kind replaces the timeout of every kind the pairs do not name
+    timeouts = dict(COMMAND_TIMEOUTS)
+    try:
+        timeouts.update(json.loads(os.environ.get('SNAPSHOT_AZ_TIMEOUTS') or '{}'))
+    except ValueError as e:
+        logging.warning(f"Ignoring unreadable SNAPSHOT_AZ_TIMEOUTS: {str(e)}")
+    overrides = dict(overrides)
+    if None in overrides:
+        timeouts = dict.fromkeys(timeouts, overrides[None])
+    timeouts.update(overrides)
+    return timeouts
+
+
+def set_command_timeouts(overrides=()):
+    global _timeouts
+    _timeouts = load_command_timeouts(overrides)
+
+
+def command_words(command):
+    # The words before the first option, e.g. ['snapshot', 'show'] for 'az snapshot show --ids ...'
+    words = []
+    for word in command[1:]:
+        if word.startswith('-'):
+            break
+        words.append(word)
+    return words
+
+
+def command_kind(command):
+    words = command_words(command)
+    return words[-1] if words else ''
+
+
+def command_timeout(command):
+    return _timeouts.get(command_kind(command), _timeouts.get(None, DEFAULT_COMMAND_TIMEOUT))
+
+
+def record_timeout(kind):
+    with _timed_out_lock:
+        _timed_out[kind] += 1
+
+
+def timeout_counts():
+    with _timed_out_lock:
+        return Counter(_timed_out)
+
+
+def is_retryable(error):
+    return any(code in (error or '') for code in RETRYABLE_CODES)
+
+
+def timeout_error(command, timeout):
+    return f"({TIMEOUT_CODE}) az {' '.join(command_words(command))} did not finish within {timeout:g}s and was killed"
+
+
+def kill_process_group(process):
+    # az runs as a Python process that may have started its own children; the whole session goes,
+    # and communicate() reaps the process and drains its pipes so nothing is left behind
+    for sig, wait in ((signal.SIGTERM, KILL_GRACE), (signal.SIGKILL, None)):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+        try:
+            process.communicate(timeout=wait)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+set_command_timeouts()
+
+
+class AzWorker:
+    def __init__(self, python):
+        self.process = subprocess.Popen([python, WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, start_new_session=True)
+        self.ready = None
+        self._pending = b''
+
+    def read(self, timeout):
+        # One JSON line per message; None when the worker died. Reads go to the raw fd, since select says
+        # nothing about a text wrapper's buffer and readline() would wait forever on a partial line
+        deadline = time.monotonic() + timeout
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self._pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise subprocess.TimeoutExpired(self.process.args, timeout)
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return None
+            self._pending += chunk
+        line, _, self._pending = self._pending.partition(b'\n')
+        return json_loads(line)
+
+    def wait_ready(self):
+        if self.ready is None:
+            try:
+                self.ready = self.read(WORKER_START_TIMEOUT) or {'ready': False, 'error': 'az worker exited while starting'}
+            except subprocess.TimeoutExpired:
+                self.ready = {'ready': False, 'error': f"az worker did not load azure-cli within {WORKER_START_TIMEOUT}s"}
+            if not self.ready.get('ready'):
+                self.close()
+                raise RuntimeError(self.ready.get('error'))
+        return self
+
+    def run(self, args, timeout):
+        # A replacement worker is waited for on its first command, so nobody pays for its load up front
+        self.wait_ready()
+        self.process.stdin.write(json.dumps({'args': args}).encode() + b'\n')
+        self.process.stdin.flush()
+        return self.read(timeout)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=KILL_GRACE)
+        except (OSError, subprocess.TimeoutExpired):
+            kill_process_group(self.process)
+
+
+class AzWorkerPool:
+    def __init__(self, size=AZ_WORKERS, python=AZ_PYTHON):
+        self.size = size
+        self.python = python
+        self._idle = queue.LifoQueue()
+        # Workers load azure-cli side by side; the first one that fails to load fails the pool
+        for worker in [AzWorker(python) for _ in range(size)]:
+            try:
+                self._idle.put(worker.wait_ready())
+            except RuntimeError:
+                self.close()
+                raise
+
+    def run(self, command, timeout):
+        # Same (returncode, stdout, stderr) as run_command; the timeout covers the call, not the wait for a worker
+        worker = self._idle.get()
+        try:
+            reply = worker.run(command[1:], timeout)
+        except subprocess.TimeoutExpired:
+            # A worker stuck in a call cannot be interrupted, only replaced
+            kill_process_group(worker.process)
+            worker = None
+            raise
+        except (OSError, ValueError) as e:
+            reply = None
+            logging.error(f"az worker {worker.process.pid} failed: {str(e)}")
+        finally:
+            if worker is None or not worker.alive() or reply is None:
+                worker = self._replace(worker)
+            self._idle.put(worker)
+        if reply is None:
+            return 1, '', 'az worker exited during the command'
+        return reply['returncode'], reply['stdout'], reply['stderr']
+
+    def _replace(self, worker):
+        if worker is not None:
+            kill_process_group(worker.process)
+        return AzWorker(self.python)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def set_az_backend(backend, workers=AZ_WORKERS, python=AZ_PYTHON):
+    # Returns the backend in use; starting the workers fails over to spawning az, e.g. when azure-cli is not
+    # importable from python
+    global _pool
+    if backend not in AZ_BACKENDS:
+        raise ValueError(f"Unknown az backend '{backend}', expected one of {', '.join(AZ_BACKENDS)}")
+    with _pool_lock:
+        if _pool is not None and (backend != 'workers' or (_pool.size, _pool.python) != (workers, python)):
+            _pool.close()
+            _pool = None
+        if backend == 'workers' and _pool is None:
+            started = time.time()
+            _pool = AzWorkerPool(workers, python)
+            logging.info(f"Started {workers} az workers under {python} in {time.time() - started:.1f}s")
+    return backend
+
+
+def az_backend():
+    return 'workers' if _pool is not None else 'process'
+
+
+def close_az_workers():
+    set_az_backend('process')
+
+
+def cached_account_lookup(key, loader, keep=bool):
+    with _account_cache_lock:
+        entry = _account_cache.get(key)
+        if entry and time.time() - entry[0] < ACCOUNT_CACHE_TTL:
+            return entry[1]
+    value = loader()
+    if keep(value):
+        with _account_cache_lock:
+            _account_cache[key] = (time.time(), value)
+    return value
+
+
+def clear_account_cache():
+    with _account_cache_lock:
+        _account_cache.clear()
+
+
+def run_command(command, timeout):
+    pool = _pool
+    if pool is not None and command[0] == 'az':
+        return pool.run(command, timeout)
+    # Each az call gets its own session so a terminal Ctrl-C does not kill work that is being drained,
+    # and so a timed-out call can be killed together with its children
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        raise
+    return process.returncode, stdout, stderr
+
+
+def run_az_command(command):
+    # Commands run without a shell; string commands are split the way the shell would have
+    if isinstance(command, str):
+        command = shlex.split(command)
+    kind, timeout = command_kind(command), command_timeout(command)
+    attempts = TIMEOUT_RETRIES + 1 if kind in READ_ONLY_KINDS else 1
+    for attempt in range(1, attempts + 1):
+        try:
+            returncode, stdout, stderr = run_command(command, timeout)
+            break
+        except subprocess.TimeoutExpired:
+            record_timeout(kind)
+            logging.error(f"Command timed out after {timeout:g}s and was killed (attempt {attempt} of {attempts}): {command}")
+        except Exception as e:
+            logging.error(f"Error in run_az_command: {str(e)}")
+            return f"Error: {str(e)}"
+    else:
+        return f"Error: {timeout_error(command, timeout)}"
+    if returncode != 0:
+        logging.error(f"Command failed: {command}. Error: {stderr.strip()}")
+        return f"Error: {stderr.strip()}"
+    return stdout.strip()
+
+
+def run_az_json(command):
+    result = run_az_command(command)
+    if result.startswith("Error:"):
+        raise RuntimeError(result[len("Error: "):])
+    return json_loads(result or 'null')
+
+
+def check_az_login():
+    return cached_account_lookup('login', lambda: not run_az_command(['az', 'account', 'show', '-o', 'none']).startswith("Error:"))
+
+
+def list_subscription_names():
+    result = run_az_command(['az', 'account', 'list', '--query', '[].{id:id, name:name}', '-o', 'json'])
+    if result and not result.startswith("Error:"):
+        return {sub['id']: sub['name'] for sub in json.loads(result)}
+    return {}
+
+
+def get_subscription_names():
+    return dict(cached_account_lookup('subscriptions', list_subscription_names))
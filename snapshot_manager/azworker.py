@@ -0,0 +1,67 @@
+import io
+import json
+import os
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+
+# Runs as a script under whichever Python has azure-cli installed, which may be az's own bundled one,
+# so nothing from snapshot_manager is imported here. The protocol is one JSON line each way per command:
+# {"args": [...]} in, {"returncode": ..., "stdout": ..., "stderr": ...} out. The first line out says
+# whether azure.cli.core loaded.
+
+
+def open_protocol():
+    # The protocol keeps its own copies of stdin and stdout; fd 0 and 1 are pointed away so a prompt or a
+    # stray print from az or an extension can neither block on nor corrupt the pipe
+    requests = os.fdopen(os.dup(0), 'r')
+    replies = os.fdopen(os.dup(1), 'w')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    return requests, replies
+
+
+def reply(replies, **fields):
+    replies.write(json.dumps(fields) + '\n')
+    replies.flush()
+
+
+def invoke(cli, args):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    # knack sets up its stderr logging handler on every invoke, so it picks up the redirected stream
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            returncode = cli.invoke(args, out_file=stdout)
+        except SystemExit as e:
+            # argparse errors and --help exit instead of returning
+            returncode = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            stderr.write(f"{type(e).__name__}: {e}\n")
+            returncode = 1
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+
+def main():
+    requests, replies = open_protocol()
+    try:
+        from azure.cli.core import get_default_cli
+    except ImportError as e:
+        reply(replies, ready=False, error=f"azure.cli.core is not importable from {sys.executable}: {e}")
+        return 1
+    cli = get_default_cli()
+    reply(replies, ready=True, pid=os.getpid())
+
+    for line in requests:
+        args = json.loads(line)['args']
+        returncode, stdout, stderr = invoke(cli, args)
+        reply(replies, returncode=returncode, stdout=stdout, stderr=stderr)
+        # A failed invoke can leave the CLI object half set up; the command modules stay imported, so a
+        # fresh one costs little
+        if returncode:
+            cli = get_default_cli()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,828 @@
+import argparse
+import contextlib
+import datetime
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from .console import get_console
+
+LOG_FILE = 'azure_manager.log'
+
+
+def default_socket_path():
+    # Inside a directory only this user can enter, so nobody else can bind the path first
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'snapshot_manager.sock')
+    return os.path.join(tempfile.gettempdir(), f'snapshot_manager-{os.getuid()}', 'daemon.sock')
+
+
+SOCKET_PATH = os.environ.get('SNAPSHOT_MANAGER_SOCKET') or default_socket_path()
+
+
+def setup_logging():
+    logging.basicConfig(filename=LOG_FILE, level=logging.DEBUG,
+                        format='%(asctime)s:%(levelname)s:%(message)s')
+
+
+def parse_deadline(value):
+    # '90m', '2h' or '+45m' from now; '18:30' today (tomorrow once past); or an ISO timestamp
+    value = value.strip()
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    try:
+        if value[-1:].lower() in units and value.lstrip('+')[:-1].replace('.', '', 1).isdigit():
+            return time.time() + float(value.lstrip('+')[:-1]) * units[value[-1].lower()]
+        if len(value) <= 5 and ':' in value:
+            hour, minute = (int(part) for part in value.split(':'))
+            now = datetime.datetime.now()
+            at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if at <= now:
+                at += datetime.timedelta(days=1)
+            return at.timestamp()
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid deadline '{value}', use e.g. 90m, 2h, 18:30 or 2024-05-01T18:30")
+
+
+def read_snapshot_ids(filename):
+    console = get_console()
+    try:
+        with open(filename, 'r') as f:
+            return f.read().splitlines()
+    except Exception as e:
+        console.print(f"[bold red]Error reading file {filename}: {e}[/bold red]")
+        return None
+
+
+def load_retention_candidates(db_path):
+    from .index import MAX_INDEX_AGE, index_age, open_index, retention_candidates, snapshot_details
+
+    console = get_console()
+    conn = open_index(db_path)
+    keep = int(console.input("Keep how many of the newest snapshots per source disk? "))
+    name_like = console.input("Only consider snapshot names matching (SQL LIKE, e.g. RH_PATCH_%, blank for all): ").strip()
+    snapshot_ids = retention_candidates(conn, keep, name_like or None)
+    age = index_age(conn)
+    fresh = age is not None and age <= MAX_INDEX_AGE
+    if not fresh:
+        console.print("[yellow]Snapshot index is older than an hour, existence will be re-checked.[/yellow]")
+    return snapshot_ids, fresh, snapshot_details(conn, snapshot_ids)
+
+
+def seed_from_index(ctx, details):
+    from .results import split_snapshot_id
+
+    # The index listed these moments ago, so the per-snapshot show is unnecessary
+    for snapshot_id in ctx.snapshot_ids:
+        subscription_name, snapshot_name = split_snapshot_id(snapshot_id, ctx.subscription_names)
+        ctx.record(subscription_name, "valid", snapshot_name, details=details.get(snapshot_id))
+        ctx.valid_snapshots.append(snapshot_id)
+    ctx.details.update(details)
+
+
+def prepare_snapshot_ids(snapshot_ids, args, action):
+    from .ids import normalise_snapshot_ids, print_normalisation_report
+
+    console = get_console()
+    normalised = normalise_snapshot_ids(snapshot_ids)
+    print_normalisation_report(normalised, console)
+    snapshot_ids = normalised.ids
+
+    if len(snapshot_ids) > 100 and not args.yes:
+        confirm = console.input(f"[yellow]You are about to {action} {len(snapshot_ids)} snapshots. Are you sure you want to proceed? (y/n): [/yellow]")
+        if confirm.lower() != 'y':
+            console.print("[red]Operation cancelled.[/red]")
+            return None
+    return snapshot_ids
+
+
+def parse_region_workers(value):
+    from .regions import normalise_region
+
+    # 'westus=6' caps one region, a bare '4' every region without its own cap
+    region, _, count = value.rpartition('=')
+    try:
+        count = int(count)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"expected REGION=N or N with N >= 1, got '{value}'")
+    return normalise_region(region) or None, count
+
+
+def parse_az_timeout(value):
+    # 'delete=1200' for one kind of az command, a bare '120' for every kind not given its own
+    kind, _, seconds = value.rpartition('=')
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        seconds = 0
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"expected KIND=SECONDS or SECONDS with SECONDS > 0, got '{value}'")
+    return kind.strip().lower() or None, seconds
+
+
+def use_az_backend(args):
+    from .az import set_az_backend
+
+    try:
+        set_az_backend(args.az_backend, args.az_workers)
+    except RuntimeError as e:
+        logging.warning(f"az workers unavailable, spawning az per command: {str(e)}")
+        get_console().print(f"[yellow]⚠️ az workers could not start ({str(e)}); running az per command. "
+                            f"Set SNAPSHOT_AZ_PYTHON to the Python azure-cli is installed in.[/yellow]")
+        set_az_backend('process')
+
+
+def print_timeouts(before):
+    from .az import timeout_counts
+
+    killed = timeout_counts() - before
+    if killed:
+        kinds = ', '.join(f"{kind or 'az'}: {count}" for kind, count in killed.most_common())
+        get_console().print(f"[yellow]⚠️ {sum(killed.values())} az commands ran past their timeout and were killed "
+                            f"({kinds}). Raise a timeout with --az-timeout KIND=SECONDS.[/yellow]")
+
+
+def record_history(args, command, ctx, source=None):
+    from .history import RunHistory
+
+    if args.no_history:
+        return contextlib.nullcontext()
+    return RunHistory(args.history_db, command, ctx, workers=args.workers, auth=args.auth,
+                      source=os.path.abspath(source) if source else None)
+
+
+def cmd_delete(args):
+    from .az import check_az_login, get_subscription_names
+    from .export import ResultWriter
+    from .pipeline import RunContext, run_pipeline
+    from .shutdown import ShutdownSignal
+    from .stages import build_pipeline
+    from .usage import snapshot_priority
+
+    console = get_console()
+    console.print("[cyan]Azure Snapshot Manager[/cyan]")
+    console.print("=========================")
+
+    try:
+        snapshot_priority(args.priority, {})
+    except ValueError as e:
+        console.print(f"[bold red]{e}[/bold red]")
+        return 1
+
+    # Service principal and managed identity runs authenticate in-process and do not need 'az login'
+    if args.auth in ('az', 'cli-token') and not check_az_login():
+        console.print("[yellow]You are not logged in to Azure. Please run 'az login' to authenticate.[/yellow]")
+        return 1
+
+    filename = args.file or console.input("Enter the filename with snapshot IDs (or a snapshot index .db file): ")
+    if not os.path.isfile(filename):
+        console.print(f"[bold red]File {filename} does not exist.[/bold red]")
+        return 1
+
+    start_time = time.time()
+
+    subscription_names = get_subscription_names()
+    if not subscription_names:
+        console.print("[bold red]Failed to fetch subscription names. Using IDs instead.[/bold red]")
+
+    trusted_index, index_details = False, {}
+    if filename.endswith('.db'):
+        snapshot_ids, trusted_index, index_details = load_retention_candidates(filename)
+    else:
+        snapshot_ids = read_snapshot_ids(filename)
+    if snapshot_ids is None:
+        return 1
+
+    snapshot_ids = prepare_snapshot_ids(snapshot_ids, args, "process")
+    if snapshot_ids is None:
+        return 1
+
+    ctx = RunContext(snapshot_ids, subscription_names, max_workers=args.workers, export=args.export,
+                     rg_parallel=args.rg_parallel, batch_size=args.batch_size, priority=args.priority,
+                     deadline=args.deadline, region_workers=args.region_workers)
+    pipeline, skip = 'delete', ()
+    if args.optimistic:
+        # Existence and sizes come from one listing per resource group; the index sizes stand in for a group
+        # whose listing fails
+        pipeline = 'delete-optimistic'
+        ctx.details.update(index_details)
+    elif trusted_index:
+        seed_from_index(ctx, index_details)
+        skip = ('validate',)
+
+    # Rows are streamed as they complete so a crash keeps everything up to the last batch
+    results_file = args.export or f"snapshot_results_{time.strftime('%Y%m%d%H%M%S')}.csv"
+    # Signals only set a flag during the run, so lock restoration always happens
+    with ResultWriter(results_file) as writer, ShutdownSignal(console=console) as shutdown, \
+            record_history(args, pipeline, ctx, filename):
+        ctx.result_writer = writer
+        ctx.shutdown = shutdown
+        run_pipeline(ctx, build_pipeline(pipeline, skip))
+
+    if ctx.interrupted:
+        return 130
+
+    total_runtime = time.time() - start_time
+    console.print(f"\n[bold green]✔ Total runtime: {total_runtime:.2f} seconds[/bold green]")
+
+    if not args.export:
+        export_csv = 'n' if args.yes else console.input("Do you want to export the results to a CSV file? (y/n): ")
+        if export_csv.lower() == 'y':
+            csv_filename = console.input("Enter the filename to export results (.csv, .jsonl or .parquet): ")
+            writer.save_as(csv_filename)
+            console.print(f"[green]✔ Results exported to {csv_filename}[/green]")
+        elif args.discard_results:
+            os.remove(writer.filename)
+        else:
+            # The streamed file is the record of what was deleted, so it stays unless explicitly discarded
+            console.print(f"[green]✔ Results kept in {writer.filename}[/green]")
+    return 0
+
+
+def cmd_validate(args):
+    from .export import VALIDATION_COLUMNS, ResultWriter
+    from .pipeline import RunContext, run_pipeline
+    from .report import print_invalid_snapshots
+    from .shutdown import ShutdownSignal
+    from .stages import VALIDATION_RESULTS_FILE, build_pipeline
+
+    console = get_console()
+    console.print("[cyan]Azure Snapshot Validator[/cyan]")
+    console.print("==========================")
+
+    filename = args.file or console.input("Enter the filename with snapshot IDs: ")
+    if not os.path.isfile(filename):
+        console.print(f"[bold red]File {filename} does not exist.[/bold red]")
+        return 1
+
+    start_time = time.time()
+
+    snapshot_ids = read_snapshot_ids(filename)
+    if snapshot_ids is None:
+        return 1
+    if not snapshot_ids:
+        console.print("[bold yellow]No snapshot IDs found in the file. Please check the file content.[/bold yellow]")
+        return 1
+
+    snapshot_ids = prepare_snapshot_ids(snapshot_ids, args, "validate")
+    if snapshot_ids is None:
+        return 1
+
+    console.print(f"[green]Found {len(snapshot_ids)} snapshot IDs in the file.[/green]")
+    console.print("[yellow]Starting validation process...[/yellow]")
+
+    ctx = RunContext(snapshot_ids, max_workers=args.workers, export=args.export,
+                     state_file=args.state, full=args.full, batch_size=args.batch_size,
+                     region_workers=args.region_workers)
+    with ResultWriter(args.export or VALIDATION_RESULTS_FILE, VALIDATION_COLUMNS) as writer, \
+            ShutdownSignal(console=console) as shutdown, record_history(args, 'validate', ctx, filename):
+        ctx.validation_writer = writer
+        ctx.shutdown = shutdown
+        run_pipeline(ctx, build_pipeline('validate'))
+
+    # Prompt user if they want to see invalid snapshot details
+    if len(ctx.valid_snapshots) < len(ctx.checked) and not args.yes:
+        show_details = console.input("\nDo you want to see the invalid snapshot details? (y/n): ").lower()
+        if show_details == 'y':
+            console.print("\n[bold red]Invalid Snapshot Details:[/bold red]")
+            print_invalid_snapshots(ctx.checked)
+
+    total_runtime = time.time() - start_time
+    console.print(f"\n[bold green]Total runtime: {total_runtime:.2f} seconds[/bold green]")
+    return 0
+
+
+def run_lock_action(action, config, subscriptions, workers):
+    import asyncio
+
+    from .locks import ScopeLockManager, summarise_outcomes
+    from .report import print_lock_summary
+
+    console = get_console()
+    outcomes = asyncio.run(ScopeLockManager(config, max_concurrency=workers).run(action, subscriptions))
+    summary, detailed_errors, messages = summarise_outcomes(outcomes)
+    for message in messages:
+        console.print(message)
+    print_lock_summary(summary, detailed_errors)
+
+
+def cmd_locks(args):
+    from .locks import LOCK_CONFIG_FILE, load_lock_config
+
+    console = get_console()
+    if args.action:
+        if args.action == 'delete' and args.discover == []:
+            console.print("[red]--discover with delete needs at least one subscription.[/red]")
+            return 1
+        config = None if args.discover is not None else load_lock_config(args.config or LOCK_CONFIG_FILE)
+        run_lock_action(args.action, config, args.discover, args.workers)
+        return 0
+
+    console.print("[cyan]Azure Resource Manager[/cyan]")
+    console.print("=========================")
+    while True:
+        action = console.input("[yellow]Enter 'lock' to manage scope locks or 'quit' to exit: [/yellow]").lower()
+
+        if action == 'lock':
+            lock_action = console.input("[yellow]Enter 'delete' to remove scope locks or 'restore' to add them back: [/yellow]").lower()
+            if lock_action in ['delete', 'restore']:
+                source = console.input(f"[yellow]Enter a lock config file (JSON/YAML) or 'discover' [{LOCK_CONFIG_FILE}]: [/yellow]").strip()
+                if source.lower() == 'discover':
+                    hint = "blank for all previously removed locks" if lock_action == 'restore' else "at least one"
+                    names = console.input(f"[yellow]Enter subscriptions (comma separated, {hint}): [/yellow]")
+                    subscriptions = [name.strip() for name in names.split(',') if name.strip()]
+                    if lock_action == 'delete' and not subscriptions:
+                        # Discovery needs somewhere to look; only restore has the removed-locks file to go by
+                        console.print("[red]Enter the subscriptions to remove locks from.[/red]")
+                        continue
+                    run_lock_action(lock_action, None, subscriptions, args.workers)
+                else:
+                    run_lock_action(lock_action, load_lock_config(source or LOCK_CONFIG_FILE), None, args.workers)
+            else:
+                console.print("[red]Invalid input. Please try again.[/red]")
+        elif action == 'quit':
+            break
+        else:
+            console.print("[red]Invalid input. Please try again.[/red]")
+
+    console.print("[yellow]Operation completed. Check the log file for details.[/yellow]")
+    return 0
+
+
+def cmd_create(args):
+    from .pipeline import RunContext, run_pipeline
+    from .stages import build_pipeline
+
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    log_file = f"snapshot_log_{timestamp}.txt"
+    summary_file = f"snapshot_summary_{timestamp}.txt"
+
+    if args.copy_to and args.no_verify:
+        get_console().print("[bold red]--copy-to copies only verified snapshots and cannot be combined with --no-verify.[/bold red]")
+        return 1
+
+    chg_number = args.chg or get_console().input("Enter the CHG number: ")
+    with open(log_file, "a") as f:
+        f.write(f"CHG Number: {chg_number}\n\n")
+
+    with open(args.vm_list, "r") as file:
+        vms = [tuple(line.split()[:2]) for line in file if line.strip()]
+
+    ctx = RunContext(max_workers=args.workers, chg_number=chg_number, timestamp=timestamp,
+                     log_file=log_file, summary_file=summary_file, no_wait=args.no_wait,
+                     verify_timeout=args.verify_timeout, on_existing=args.on_existing, copy_to=args.copy_to,
+                     copy_parallel=args.copy_parallel, copy_timeout=args.copy_timeout,
+                     copy_resource_group=args.target_resource_group)
+    ctx.vms = vms
+    skip = ('verify-creation',) if args.no_verify else ()
+    with record_history(args, 'create', ctx, args.vm_list):
+        run_pipeline(ctx, build_pipeline('create', skip + (() if args.copy_to else ('copy',))))
+    return 0 if not ctx.create_failures else 1
+
+
+def cmd_copy(args):
+    from .az import check_az_login, get_subscription_names
+    from .export import ResultWriter
+    from .pipeline import RunContext, run_pipeline
+    from .shutdown import ShutdownSignal
+    from .stages import build_pipeline
+
+    console = get_console()
+    console.print("[cyan]Azure Snapshot Copy[/cyan]")
+    console.print("=====================")
+
+    # A simulated run makes no Azure calls at all
+    if args.simulate is None and args.auth in ('az', 'cli-token') and not check_az_login():
+        console.print("[yellow]You are not logged in to Azure. Please run 'az login' to authenticate.[/yellow]")
+        return 1
+
+    filename = args.file or console.input("Enter the filename with snapshot IDs: ")
+    if not os.path.isfile(filename):
+        console.print(f"[bold red]File {filename} does not exist.[/bold red]")
+        return 1
+
+    start_time = time.time()
+    snapshot_ids = read_snapshot_ids(filename)
+    if snapshot_ids is None:
+        return 1
+    snapshot_ids = prepare_snapshot_ids(snapshot_ids, args, f"copy to {args.copy_to}")
+    if snapshot_ids is None:
+        return 1
+
+    subscription_names = get_subscription_names() if args.simulate is None else {}
+    ctx = RunContext(snapshot_ids, subscription_names, max_workers=args.workers, copy_to=args.copy_to,
+                     copy_parallel=args.copy_parallel, copy_timeout=args.copy_timeout,
+                     copy_resource_group=args.target_resource_group, simulate=args.simulate)
+    results_file = args.export or f"snapshot_copies_{time.strftime('%Y%m%d%H%M%S')}.csv"
+    with ResultWriter(results_file) as writer, ShutdownSignal(console=console) as shutdown, \
+            record_history(args, 'copy', ctx, filename):
+        ctx.result_writer = writer
+        ctx.shutdown = shutdown
+        run_pipeline(ctx, build_pipeline('copy'))
+
+    if ctx.interrupted:
+        return 130
+    console.print(f"\n[bold green]✔ Total runtime: {time.time() - start_time:.2f} seconds[/bold green]")
+    return 0 if all(job.status == 'copied' for job in ctx.copies) else 1
+
+
+def cmd_index(args):
+    from tabulate import tabulate
+
+    from .index import build_index, open_index, retention_candidates, snapshots_by_source
+
+    if args.index_command == "build":
+        started = time.time()
+        conn = build_index(args.subscriptions, args.db)
+        total = conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+        print(f"Indexed {total} snapshots from {len(args.subscriptions)} subscriptions in {time.time() - started:.2f}s")
+    elif args.index_command == "disks":
+        conn = open_index(args.db)
+        table = []
+        for source_id, snapshots in snapshots_by_source(conn, args.name_like).items():
+            for snapshot in snapshots:
+                table.append([(source_id or '-').split('/')[-1], (snapshot['vm_id'] or '-').split('/')[-1],
+                              snapshot['name'], snapshot['size_gb'], snapshot['time_created']])
+        print(tabulate(table, headers=["Source Disk", "VM", "Snapshot", "Size (GB)", "Created"], tablefmt="grid"))
+    elif args.index_command == "retain":
+        conn = open_index(args.db)
+        snapshot_ids = retention_candidates(conn, args.keep, args.name_like)
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(snapshot_ids) + ('\n' if snapshot_ids else ''))
+        print(f"{len(snapshot_ids)} snapshots beyond the newest {args.keep} per disk written to {args.output}")
+    return 0
+
+
+def cmd_ids(args):
+    from .idindex import IdIndex, build_id_index
+
+    if args.ids_command == "build":
+        started = time.time()
+        records, keys = build_id_index(args.sources, args.index)
+        print(f"Indexed {records} entries ({keys} keys) from {len(args.sources)} files in {time.time() - started:.2f}s")
+        return 0
+
+    with IdIndex(args.index) as index:
+        if args.ids_command == "lookup":
+            missing = 0
+            for value in args.values:
+                entries = index.lookup(value)
+                if not entries:
+                    missing += 1
+                    print(f"{value}\tnot found")
+                for entry in entries:
+                    print(f"{value}\t{entry.chg or '-'}\t{entry.status or '-'}\t{os.path.basename(entry.source)}:{entry.line}")
+            return 1 if missing else 0
+
+        # join: every ID of a list against the index, without loading either file whole
+        from .export import ResultWriter
+
+        columns = ['Query', 'Snapshot ID', 'Name', 'Subscription', 'Status', 'CHG', 'Source', 'Line']
+        started = time.time()
+        total = matched = 0
+        with open(args.file) as f, ResultWriter(args.output, columns) as writer:
+            for line in f:
+                value = line.strip()
+                if not value:
+                    continue
+                total += 1
+                entries = index.lookup(value)
+                matched += bool(entries)
+                for entry in entries:
+                    writer.write([value, entry.snapshot_id, entry.name, entry.subscription, entry.status,
+                                  entry.chg, entry.source, str(entry.line)])
+        print(f"{matched} of {total} IDs found in {args.index} ({time.time() - started:.2f}s), matches written to {args.output}")
+    return 0
+
+
+def cmd_history(args):
+    from tabulate import tabulate
+
+    from .history import chg_summary, open_history, recent_runs, snapshot_timeline, throughput
+
+    def when(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else '-'
+
+    if not os.path.isfile(args.history_db):
+        print(f"No run history in {args.history_db} yet")
+        return 1
+    conn = open_history(args.history_db)
+    if args.history_command == "runs":
+        table = [[run['id'], when(run['started']), run['command'], run['chg'] or '-', run['status'], run['items'],
+                  f"{run['finished'] - run['started']:.1f}" if run['finished'] else '-', run['outcomes'] or '']
+                 for run in recent_runs(conn, args.last, args.command_name)]
+        print(tabulate(table, headers=["Run", "Started", "Command", "CHG", "Status", "Snapshots", "Seconds", "Outcomes"],
+                       tablefmt="grid"))
+    elif args.history_command == "throughput":
+        table = [[row['subscription'] or row['subscription_id'] or 'Unknown', row['runs'], row['items'], row['failed'], f"{row['seconds']:.1f}",
+                  f"{row['items'] / row['seconds'] * 60:.1f}" if row['seconds'] else '-']
+                 for row in throughput(conn, args.last, args.command_name)]
+        print(tabulate(table, headers=["Subscription", "Runs", "Snapshots", "Failed", "Seconds", "Snapshots/min"],
+                       tablefmt="grid"))
+    elif args.history_command == "snapshot":
+        rows = snapshot_timeline(conn, args.name)
+        created = next((row['time_created'] for row in rows if row['time_created']), None)
+        if created:
+            print(f"Created (as reported by Azure): {created}")
+        table = [[when(row['recorded_at']), row['run_id'], row['command'], row['subscription'] or 'Unknown',
+                  row['status'], row['size_gb'] or '', (row['error'] or '')[:80]] for row in rows]
+        print(tabulate(table, headers=["Recorded", "Run", "Command", "Subscription", "Status", "Size (GB)", "Error"],
+                       tablefmt="grid"))
+    elif args.history_command == "chg":
+        table = [[row['run_id'], row['command'], when(row['started']), row['run_status'], row['status'], row['snapshots']]
+                 for row in chg_summary(conn, args.chg)]
+        print(tabulate(table, headers=["Run", "Command", "Started", "Run Status", "Status", "Snapshots"], tablefmt="grid"))
+    return 0
+
+
+def cmd_token(args):
+    from .auth import get_credential, serve_stub_token_endpoint
+
+    if args.stub is not None:
+        server = serve_stub_token_endpoint(args.stub)
+        print(f"Stub token endpoint on http://127.0.0.1:{server.server_port} "
+              f"(use as AZURE_AUTHORITY_HOST or IDENTITY_ENDPOINT), Ctrl-C to stop")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    credential = get_credential()
+    # Only the lifetime is shown, never the token itself
+    expires_on = credential.get_access_token(args.tenant).expires_on
+    print(f"{type(credential).__name__} ({args.auth}) acquired an ARM token valid for {expires_on - time.time():.0f}s")
+    return 0
+
+
+def cmd_serve(args):
+    from .daemon import forward, serve
+
+    if args.stop:
+        code = forward([], args.socket, stop=True)
+        if code is None:
+            print(f"No snapshot manager daemon is listening on {args.socket}")
+            return 1
+        return code
+    return serve(args.socket)
+
+
+def cmd_shell(args):
+    import shlex
+
+    from .daemon import warm_up
+
+    console = get_console()
+    console.print("[cyan]Snapshot Manager shell[/cyan] (delete, validate, locks, create, copy, index, ids, history; 'quit' to exit)")
+    warm_up()
+    parser = build_parser()
+    while True:
+        try:
+            line = console.input("[bold cyan]snapshot> [/bold cyan]")
+        except (EOFError, KeyboardInterrupt):
+            break
+        argv = shlex.split(line)
+        if not argv:
+            continue
+        if argv[0] in ('quit', 'exit'):
+            break
+        if argv[0] in ('shell', 'serve'):
+            console.print(f"[red]'{argv[0]}' cannot be run from the shell.[/red]")
+            continue
+        try:
+            run(parser.parse_args(argv))
+        except SystemExit:
+            continue
+        except KeyboardInterrupt:
+            console.print("[yellow]Interrupted.[/yellow]")
+    return 0
+
+
+def build_parser():
+    from .auth import AUTH_MODES
+    from .az import AZ_BACKENDS, AZ_WORKERS
+    from .history import HISTORY_DB
+    from .profiling import PROFILE_MODES
+    from .regions import normalise_region
+    from .revalidate import VALIDATION_STATE_FILE
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, default=10, help="Concurrent az operations")
+    common.add_argument("--auth", choices=AUTH_MODES, default=os.environ.get('SNAPSHOT_AUTH', 'az'),
+                        help="az: run az for every call; others call ARM in-process with one shared token per tenant "
+                             "(cli-token from 'az account get-access-token', service-principal from AZURE_TENANT_ID/"
+                             "AZURE_CLIENT_ID/AZURE_CLIENT_SECRET, managed-identity) (SNAPSHOT_AUTH)")
+    common.add_argument("--profile", nargs="?", const="cprofile", choices=PROFILE_MODES,
+                        help="Write per-stage cProfile stats, wall/CPU times and collapsed stacks to profile_<timestamp>/; "
+                             "'py-spy' only records stage times so an attached py-spy sees an unprofiled run")
+    common.add_argument("--history-db", default=HISTORY_DB,
+                        help="SQLite database that delete, validate, create and copy runs are recorded in (SNAPSHOT_HISTORY_DB)")
+    common.add_argument("--no-history", action="store_true", help="Do not record this run in the history database")
+    common.add_argument("--az-timeout", type=parse_az_timeout, action="append", metavar="[KIND=]SECONDS",
+                        help="Kill an az command after this long, e.g. delete=1200 (repeatable); KIND is the verb (show, "
+                             "list, delete, create, get-access-token) and a bare SECONDS applies to every kind not named "
+                             "(SNAPSHOT_AZ_TIMEOUTS)")
+    common.add_argument("--az-backend", choices=AZ_BACKENDS, default=os.environ.get('SNAPSHOT_AZ_BACKEND', 'process'),
+                        help="process: start az for every command; workers: keep azure-cli loaded in --az-workers "
+                             "long-lived processes and send them the commands, with the same output (SNAPSHOT_AZ_BACKEND)")
+    common.add_argument("--az-workers", type=int, default=AZ_WORKERS,
+                        help="Persistent az processes for --az-backend workers; commands beyond these wait for one")
+    # Only the validate and delete parsers take --batch-size, the other commands run one operation per call
+    batching = argparse.ArgumentParser(add_help=False)
+    batching.add_argument("--batch-size", type=int, default=20,
+                          help="Snapshot operations sent per ARM $batch request with in-process auth; 1 disables batching")
+    batching.add_argument("--region-workers", type=parse_region_workers, action="append", metavar="[REGION=]N",
+                          help="Concurrent operations per region, e.g. westus=6 (repeatable); a bare N caps every other "
+                               "region. Regions share the workers evenly either way")
+    # Cross-region copies, for the copy command and create --copy-to
+    copying = argparse.ArgumentParser(add_help=False)
+    copying.add_argument("--copy-parallel", type=int, default=20,
+                         help="CopyStart copies running at once; the next one starts as soon as one completes")
+    copying.add_argument("--copy-timeout", type=int, default=6 * 3600,
+                         help="Seconds to follow the copies; copies still running then carry on in Azure")
+    copying.add_argument("--target-resource-group", help="Resource group for the copies (default: the source's)")
+
+    parser = argparse.ArgumentParser(prog="snapshot_manager", description="Azure snapshot validation, deletion and creation")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    delete = subparsers.add_parser("delete", parents=[common, batching], help="Validate, unlock, delete and relock snapshots from an ID list")
+    delete.add_argument("file", nargs="?", help="File with one snapshot ID per line, or a snapshot index .db")
+    delete.add_argument("--export", help="Stream results to this file (.csv, .jsonl or .parquet)")
+    delete.add_argument("-y", "--yes", action="store_true", help="Do not ask for confirmation")
+    delete.add_argument("--discard-results", action="store_true",
+                        help="Remove the streamed snapshot_results_<timestamp>.csv at the end instead of keeping it "
+                             "(ignored with --export)")
+    delete.add_argument("--rg-parallel", type=int, default=4,
+                        help="Resource groups unlocked at once; each is relocked as soon as its snapshots are done")
+    delete.add_argument("--optimistic", action="store_true",
+                        help="Delete without checking existence first; locks are removed only for resource groups "
+                             "where a delete is refused with ScopeLocked")
+    delete.add_argument("--priority", help="Delete in this order, highest first: size, age, cost, or an expression over "
+                                           "size_gb, age_days, cost, sku, incremental, name, resource_group, subscription")
+    delete.add_argument("--deadline", type=parse_deadline,
+                        help="Start no deletion that would end after this (90m, 2h, 18:30 or an ISO time); "
+                             "time for restoring locks is kept free")
+    delete.set_defaults(handler=cmd_delete)
+
+    validate = subparsers.add_parser("validate", parents=[common, batching], help="Check that snapshot IDs exist")
+    validate.add_argument("file", nargs="?", help="File with one snapshot ID per line")
+    validate.add_argument("--export", help="Validation results file, .csv, .jsonl or .parquet (default snapshot_validation_results.csv)")
+    validate.add_argument("-y", "--yes", action="store_true", help="Do not ask for confirmation")
+    validate.add_argument("--state", default=VALIDATION_STATE_FILE,
+                          help="Previous results reused when the resource group listing shows no change")
+    validate.add_argument("--full", action="store_true", help="Re-check every snapshot, ignoring the previous run")
+    validate.set_defaults(handler=cmd_validate)
+
+    locks = subparsers.add_parser("locks", parents=[common], help="Remove or restore scope locks (interactive without an action)")
+    locks.add_argument("action", nargs="?", choices=["delete", "restore"])
+    locks.add_argument("--config", help="JSON/YAML lock config (default scope_locks.json)")
+    locks.add_argument("--discover", nargs="*", metavar="SUBSCRIPTION",
+                       help="Manage every CanNotDelete lock in these subscriptions instead of a config")
+    locks.set_defaults(handler=cmd_locks)
+
+    create = subparsers.add_parser("create", parents=[common, copying], help="Snapshot the OS disk of every VM in a list")
+    create.add_argument("--vm-list", default="snapshot_vmlist.txt", help="File with '<vm resource id> <vm name>' per line")
+    create.add_argument("--chg", help="CHG number used in the snapshot names")
+    create.add_argument("--no-wait", action="store_true",
+                        help="Return from each create once ARM accepts it; the verification stage confirms them all at the end")
+    create.add_argument("--verify-timeout", type=int, default=900,
+                        help="Seconds to wait for created snapshots to reach provisioningState Succeeded")
+    create.add_argument("--no-verify", action="store_true", help="Trust the create calls and skip the verification listing")
+    create.add_argument("--on-existing", choices=("reuse", "skip", "suffix"), default="reuse",
+                        help="When a VM already has a snapshot for this CHG: count it as created (reuse), leave the VM "
+                             "out (skip), or create another one, suffixing the name if it is taken (suffix)")
+    create.add_argument("--copy-to", type=normalise_region, metavar="REGION",
+                        help="Create incremental snapshots and copy each verified one to this region")
+    create.set_defaults(handler=cmd_create)
+
+    copy = subparsers.add_parser("copy", parents=[common, copying], help="Copy snapshots to another region (CopyStart)")
+    copy.add_argument("file", nargs="?", help="File with one snapshot ID per line; the snapshots must be incremental")
+    copy.add_argument("--to", dest="copy_to", type=normalise_region, required=True, metavar="REGION",
+                      help="Target region, e.g. eastus2")
+    copy.add_argument("--export", help="Results file, .csv, .jsonl or .parquet (default snapshot_copies_<timestamp>.csv)")
+    copy.add_argument("-y", "--yes", action="store_true", help="Do not ask for confirmation")
+    copy.add_argument("--simulate", nargs="?", type=float, const=200, metavar="MB_PER_S",
+                      help="Run against an in-process simulated backend copying MB_PER_S per copy (default 200), "
+                           "without calling Azure")
+    copy.set_defaults(handler=cmd_copy)
+
+    index = subparsers.add_parser("index", parents=[common], help="Snapshot to source disk index")
+    index.add_argument("--db", default="snapshot_index.db", help="SQLite index file")
+    index_commands = index.add_subparsers(dest="index_command", required=True)
+    build = index_commands.add_parser("build", help="Index every snapshot in the given subscriptions")
+    build.add_argument("subscriptions", nargs="+")
+    disks = index_commands.add_parser("disks", help="Show snapshots grouped by source disk, newest first")
+    disks.add_argument("--name-like", help="SQL LIKE filter on snapshot name, e.g. 'RH_PATCH_%%'")
+    retain = index_commands.add_parser("retain", help="Write the IDs to delete when keeping the newest N per disk")
+    retain.add_argument("--keep", type=int, required=True)
+    retain.add_argument("--name-like", help="SQL LIKE filter on snapshot name, e.g. 'RH_PATCH_%%'")
+    retain.add_argument("--output", default="snapshots_to_delete.txt")
+    index.set_defaults(handler=cmd_index)
+
+    ids = subparsers.add_parser("ids", parents=[common], help="Memory-mapped index of ID lists and result files")
+    ids.add_argument("--index", default="snapshot_ids.idx", help="ID index file")
+    ids_commands = ids.add_subparsers(dest="ids_command", required=True)
+    ids_build = ids_commands.add_parser("build", help="Compile ID lists and result/validation exports into the index")
+    ids_build.add_argument("sources", nargs="+", help="ID lists (.txt) and CSV/JSONL/Parquet exports")
+    ids_lookup = ids_commands.add_parser("lookup", help="Show which files, CHGs and statuses an ID or name appears under")
+    ids_lookup.add_argument("values", nargs="+", help="Snapshot IDs or names")
+    ids_join = ids_commands.add_parser("join", help="Match every ID of a list against the index")
+    ids_join.add_argument("file", help="File with one snapshot ID or name per line")
+    ids_join.add_argument("--output", default="id_matches.csv", help="Matches as CSV, JSONL or Parquet")
+    ids.set_defaults(handler=cmd_ids)
+
+    history = subparsers.add_parser("history", parents=[common], help="Query past delete, validate, create and copy runs")
+    history_commands = history.add_subparsers(dest="history_command", required=True)
+    runs = history_commands.add_parser("runs", help="Most recent runs with their outcome counts")
+    throughput = history_commands.add_parser("throughput", help="Snapshots per minute by subscription over recent runs")
+    for query in (runs, throughput):
+        query.add_argument("--last", type=int, default=30, help="Number of most recent runs")
+        query.add_argument("--command", dest="command_name", help="Only runs of this pipeline, e.g. delete or validate")
+    history_snapshot = history_commands.add_parser("snapshot", help="Every run that touched a snapshot, oldest first")
+    history_snapshot.add_argument("name", help="Snapshot name or ID")
+    history_chg = history_commands.add_parser("chg", help="Outcomes per run for the snapshots of one change number")
+    history_chg.add_argument("chg")
+    history.set_defaults(handler=cmd_history)
+
+    token = subparsers.add_parser("token", parents=[common], help="Check that the selected --auth mode can get an ARM token")
+    token.add_argument("--tenant", help="Tenant to request the token for")
+    token.add_argument("--stub", type=int, metavar="PORT", help="Run a local stub token endpoint instead (0 picks a port)")
+    token.set_defaults(handler=cmd_token)
+
+    serve = subparsers.add_parser("serve", help="Run a resident worker that executes commands sent over a Unix socket")
+    serve.add_argument("--socket", default=SOCKET_PATH, help="Unix socket path (SNAPSHOT_MANAGER_SOCKET)")
+    serve.add_argument("--stop", action="store_true", help="Stop a running daemon")
+    serve.set_defaults(handler=cmd_serve)
+
+    shell = subparsers.add_parser("shell", parents=[common], help="Interactive prompt that keeps caches warm between commands")
+    shell.set_defaults(handler=cmd_shell)
+
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = build_parser().parse_args(argv)
+    # Hand the command to a resident daemon when one is listening, skipping imports and account lookups
+    if args.command not in ('serve', 'shell') and not os.environ.get('SNAPSHOT_MANAGER_NO_DAEMON'):
+        from .daemon import forward
+
+        code = forward(argv)
+        if code is not None:
+            return code
+    return run(args)
+
+
+def run_profiled(args):
+    from .profiling import Profiler, profile_directory
+    from .report import print_profile_summary
+
+    # Written next to the run's results: the --export directory, otherwise the working directory
+    export = getattr(args, 'export', None)
+    directory = profile_directory(os.path.dirname(os.path.abspath(export)) if export else None)
+    with Profiler(directory, args.profile) as profiler:
+        if args.profile == 'py-spy':
+            get_console().print(f"[cyan]Attach with: py-spy record --pid {os.getpid()} --format speedscope "
+                                f"-o {os.path.join(directory, 'py-spy.json')}[/cyan]")
+        # Everything outside the pipeline stages: argument handling, input parsing, prompts and commands without stages
+        with profiler.stage('command'):
+            code = args.handler(args)
+    print_profile_summary(profiler.timings, directory)
+    return code
+
+
+def run(args):
+    from .az import set_command_timeouts, timeout_counts
+
+    setup_logging()
+    # Reset on every command, so a timeout given to one shell command does not stick to the next
+    set_command_timeouts(getattr(args, 'az_timeout', None) or ())
+    timeouts_before = timeout_counts()
+    try:
+        if getattr(args, 'auth', None):
+            from .auth import set_auth_mode
+
+            set_auth_mode(args.auth)
+        if getattr(args, 'az_backend', None):
+            use_az_backend(args)
+        if getattr(args, 'profile', None):
+            return run_profiled(args)
+        return args.handler(args)
+    except Exception as e:
+        console = get_console()
+        logging.error(f"An unexpected error occurred: {str(e)}\n{traceback.format_exc()}")
+        console.print(f"[red]An unexpected error occurred: {str(e)}[/red]")
+        console.print(f"[yellow]Please check the {LOG_FILE} file for more details.[/yellow]")
+        return 1
+    finally:
+        print_timeouts(timeouts_before)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
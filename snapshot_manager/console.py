@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+
+_console = None
+
+
+def get_console():
+    # rich is only imported once something is actually printed
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
+
+
+@contextmanager
+def use_console(console):
+    # Commands run one at a time in the daemon, so swapping the shared console is enough to redirect them
+    global _console
+    previous = _console
+    _console = console
+    try:
+        yield console
+    finally:
+        _console = previous
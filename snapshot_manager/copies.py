@@ -0,0 +1,287 @@
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from . import arm
+from .auth import auth_mode
+from .az import run_az_command, run_az_json
+from .ids import resource_group_key, split_id
+from .regions import lane_key, region_of
+
+# CopyStart copies run in the background on the Azure side; this many are started and tracked at a time
+COPIES_IN_FLIGHT = 20
+COPY_TIMEOUT = 6 * 3600
+COPY_POLL_INTERVAL = 15
+# Bandwidth is measured over this many of the most recent polling rounds
+BANDWIDTH_WINDOW = 8
+MAX_NAME_LENGTH = 80
+PROGRESS_QUERY = ('[].{name:name, provisioningState:provisioningState, completionPercent:completionPercent, '
+                  'diskSizeBytes:diskSizeBytes, copyCompletionError:copyCompletionError}')
+
+
+class CopyProgress(NamedTuple):
+    state: str
+    percent: float
+    size_bytes: int
+    error: str
+
+
+class CopyJob:
+    def __init__(self, source_id, target_id, location, lane):
+        self.source_id = source_id
+        self.target_id = target_id
+        self.location = location
+        self.lane = lane
+        # queued, copying, copied, failed or cancelled
+        self.status = 'queued'
+        self.error = None
+        self.percent = 0.0
+        self.size_bytes = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def name(self):
+        return split_id(self.target_id)[2]
+
+    @property
+    def copied_bytes(self):
+        return (self.size_bytes or 0) * self.percent / 100
+
+
+def copy_name(name, location):
+    # The region suffix keeps the CHG in the name, so the copy is found by the same CHG queries as its source
+    suffix = f"_{location}"
+    return f"{name[:MAX_NAME_LENGTH - len(suffix)]}{suffix}"
+
+
+def plan_copies(snapshot_ids, location, resource_group=None, details=None):
+    jobs = []
+    for snapshot_id in snapshot_ids:
+        subscription_id, source_group, name = split_id(snapshot_id)
+        target_id = (f"/subscriptions/{subscription_id}/resourceGroups/{resource_group or source_group}"
+                     f"/providers/Microsoft.Compute/snapshots/{copy_name(name, location)}")
+        # One lane per route, so a slow pair of regions cannot hold the slots of the others
+        route = f"{region_of(snapshot_id, details)}>{location}"
+        jobs.append(CopyJob(snapshot_id, target_id, location, lane_key(route, 'copy')))
+    return jobs
+
+
+class AzureCopies:
+    def start(self, job):
+        # Returns once the copy is accepted, with the run_az_command contract
+        if auth_mode() != 'az':
+            return arm.copy_snapshot(job.source_id, job.target_id, job.location)
+        subscription_id, resource_group, name = split_id(job.target_id)
+        return run_az_command(['az', 'snapshot', 'create', '--name', name, '--resource-group', resource_group,
+                               '--subscription', subscription_id, '--location', job.location, '--source', job.source_id,
+                               '--incremental', 'true', '--copy-start', 'true', '--no-wait', '-o', 'json'])
+
+    def progress(self, subscription_id, resource_group):
+        # {lowercase name: CopyProgress} for every snapshot in the resource group, from one listing
+        if auth_mode() != 'az':
+            snapshots = arm.list_snapshots(subscription_id, resource_group)
+        else:
+            snapshots = run_az_json(['az', 'snapshot', 'list', '--resource-group', resource_group, '--subscription',
+                                     subscription_id, '--query', PROGRESS_QUERY, '-o', 'json'])
+        return {snapshot['name'].lower(): CopyProgress(snapshot.get('provisioningState'), snapshot.get('completionPercent'),
+                                                       snapshot.get('diskSizeBytes'),
+                                                       (snapshot.get('copyCompletionError') or {}).get('errorMessage'))
+                for snapshot in snapshots or []}
+
+
+class SimulatedCopies:
+    # Offline stand-in for Azure with the same interface: every copy moves `mb_per_second`, sources are
+    # 32-1024 GB by name, and a `failure_rate` share of them stops with a copyCompletionError part way
+    def __init__(self, mb_per_second=200, failure_rate=0.02, seed=None):
+        self.rate = mb_per_second * 2 ** 20
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._copies = {}
+        self._lock = threading.Lock()
+
+    def start(self, job):
+        digest = hashlib.blake2b(job.source_id.lower().encode(), digest_size=4).digest()
+        size_bytes = (32 + int.from_bytes(digest, 'little') % 993) * 2 ** 30
+        fails_at = self._random.uniform(5, 95) if self._random.random() < self.failure_rate else None
+        subscription_id, resource_group, name = split_id(job.target_id)
+        with self._lock:
+            self._copies.setdefault(resource_group_key(subscription_id, resource_group), {})[name.lower()] = \
+                (name, time.time(), size_bytes, fails_at)
+        return json.dumps({'name': name, 'location': job.location, 'provisioningState': 'Creating'})
+
+    def progress(self, subscription_id, resource_group):
+        now = time.time()
+        with self._lock:
+            copies = dict(self._copies.get(resource_group_key(subscription_id, resource_group), {}))
+        listing = {}
+        for key, (name, started, size_bytes, fails_at) in copies.items():
+            percent = min(100.0, (now - started) * self.rate * 100 / size_bytes)
+            if fails_at is not None and percent >= fails_at:
+                listing[key] = CopyProgress('Succeeded', round(fails_at, 1), size_bytes, 'Simulated copy failure')
+            else:
+                listing[key] = CopyProgress('Succeeded', round(percent, 1), size_bytes, None)
+        return listing
+
+
+class Bandwidth:
+    # Bytes copied across all copies, sampled once per polling round
+    def __init__(self, window=BANDWIDTH_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def observe(self, copied_bytes):
+        self.samples.append((time.time(), copied_bytes))
+
+    @property
+    def bytes_per_second(self):
+        if len(self.samples) < 2:
+            return None
+        (first_at, first), (last_at, last) = self.samples[0], self.samples[-1]
+        return (last - first) / (last_at - first_at) if last_at > first_at else None
+
+
+def format_bytes(value):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TB"
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def run_copies(jobs, backend, lanes, max_in_flight, max_workers, shutdown=None, timeout=COPY_TIMEOUT,
+               poll_interval=COPY_POLL_INTERVAL, on_done=None, on_round=None):
+    # Starts copies while the caps allow and tracks all of them with one listing per target resource group
+    # per round; a finished copy frees its slot for the next queued one. Copies still running when the run
+    # stops carry on in Azure and are reported as 'copying'.
+    queues = {}
+    for job in jobs:
+        queues.setdefault(job.lane, deque()).append(job)
+    copying = {}
+    finished = []
+    meter = Bandwidth()
+    deadline = time.time() + timeout
+    stopped = None
+
+    def finish(job, status, error=None):
+        job.status, job.error, job.finished = status, error, time.time()
+        if job.started is not None:
+            lanes.finished(job.lane, job.finished - job.started)
+        finished.append(job)
+        if on_done:
+            on_done(job)
+
+    def next_job():
+        # The least busy route with room goes first
+        open_lanes = [lane for lane, queue in queues.items() if queue and lanes.has_room(lane)]
+        if not open_lanes:
+            return None
+        return queues[min(open_lanes, key=lambda lane: lanes.in_flight[lane])].popleft()
+
+    def start(job):
+        job.started = time.time()
+        return job, backend.start(job)
+
+    def poll(group):
+        try:
+            return group, backend.progress(*group)
+        except Exception as e:
+            logging.warning(f"Listing copies in {group[0]}/{group[1]} failed: {str(e)}")
+            return group, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            starting = []
+            while len(copying) + len(starting) < max_in_flight and not (shutdown and shutdown.requested):
+                job = next_job()
+                if job is None:
+                    break
+                lanes.started(job.lane)
+                starting.append(job)
+            for job, result in executor.map(start, starting):
+                if result.startswith("Error:"):
+                    finish(job, 'failed', result[len("Error: "):])
+                else:
+                    job.status = 'copying'
+                    copying[job.target_id.lower()] = job
+
+            if not copying:
+                # Every start of the round was refused; the next ones may still go through
+                if starting and any(queues.values()) and not (shutdown and shutdown.requested):
+                    continue
+                stopped = "shutdown requested" if shutdown and shutdown.requested else None
+                break
+
+            groups = {}
+            for job in copying.values():
+                subscription_id, resource_group, _ = split_id(job.target_id)
+                groups.setdefault(resource_group_key(subscription_id, resource_group), []).append(job)
+            for group, listing in executor.map(poll, list(groups)):
+                # A failed listing, or a copy not listed yet, is looked at again next round
+                for job in groups[group] if listing is not None else ():
+                    progress = listing.get(job.name.lower())
+                    if progress is None:
+                        continue
+                    job.size_bytes = progress.size_bytes or job.size_bytes
+                    job.percent = progress.percent if progress.percent is not None else \
+                        (100.0 if progress.state == 'Succeeded' else job.percent)
+                    if progress.error or progress.state in ('Failed', 'Canceled'):
+                        del copying[job.target_id.lower()]
+                        finish(job, 'failed', progress.error or f"provisioningState {progress.state}")
+                    elif progress.state == 'Succeeded' and job.percent >= 100:
+                        del copying[job.target_id.lower()]
+                        finish(job, 'copied')
+
+            meter.observe(sum(job.copied_bytes for job in finished if job.status == 'copied')
+                          + sum(job.copied_bytes for job in copying.values()))
+            if on_round:
+                on_round(copy_stats(finished, copying.values(), queues, meter))
+
+            if shutdown and shutdown.requested:
+                stopped = "shutdown requested"
+            elif time.time() + poll_interval > deadline:
+                stopped = f"copy timeout of {timeout}s reached"
+            if stopped or not (copying or any(queues.values())):
+                break
+            if copying:
+                if shutdown:
+                    shutdown.event.wait(poll_interval)
+                else:
+                    time.sleep(poll_interval)
+
+    for job in list(copying.values()):
+        job.status, job.error = 'copying', f"Still copying ({job.percent:.0f}%) when tracking stopped: {stopped}"
+        finished.append(job)
+        if on_done:
+            on_done(job)
+    for queue in queues.values():
+        while queue:
+            finish(queue.popleft(), 'cancelled', f"Not started: {stopped}")
+    return finished
+
+
+def copy_stats(finished, copying, queues, meter):
+    # (copied, copying, queued, bytes per second or None, seconds left or None)
+    copying = list(copying)
+    copied = [job for job in finished if job.status == 'copied']
+    queued = sum(len(queue) for queue in queues.values())
+    rate = meter.bytes_per_second
+    eta = None
+    if rate:
+        sizes = [job.size_bytes for job in copied + copying if job.size_bytes]
+        # Queued copies are assumed to be as large as the ones seen so far
+        remaining = sum((job.size_bytes or 0) - job.copied_bytes for job in copying)
+        remaining += queued * (sum(sizes) / len(sizes) if sizes else 0)
+        eta = remaining / rate
+    return len(copied), len(copying), queued, rate, eta
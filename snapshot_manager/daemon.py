@@ -0,0 +1,254 @@
+import contextlib
+import hashlib
+import importlib
+import json
+import logging
+import os
+import queue
+import shutil
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import traceback
+
+from .cli import SOCKET_PATH
+from .console import use_console
+
+# Settings the commands read from the environment, several of them only at import. The daemon runs with the
+# environment it was started with, so a client whose values differ runs its command locally instead
+ENV_PREFIXES = ('SNAPSHOT_', 'AZURE_', 'IDENTITY_', 'MSI_')
+CLIENT_ONLY_ENV = ('SNAPSHOT_MANAGER_SOCKET', 'SNAPSHOT_MANAGER_NO_DAEMON')
+
+
+def environment_digest(environ=None):
+    # Hashed, so secrets such as AZURE_CLIENT_SECRET are compared without being sent
+    environ = os.environ if environ is None else environ
+    return {name: hashlib.sha256(value.encode()).hexdigest() for name, value in environ.items()
+            if name.startswith(ENV_PREFIXES) and name not in CLIENT_ONLY_ENV}
+
+
+def trusted_directory(path):
+    info = os.stat(path)
+    if info.st_uid not in (os.getuid(), 0):
+        return False
+    # Others may write to it only when the sticky bit stops them replacing the socket, as in /tmp
+    return not info.st_mode & 0o022 or bool(info.st_mode & stat.S_ISVTX)
+
+
+def private_socket(path):
+    # A socket this user owns, that nobody else can connect to, in a directory nobody else can swap it in
+    try:
+        info = os.lstat(path)
+        return (stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid() and not info.st_mode & 0o077
+                and trusted_directory(os.path.dirname(os.path.abspath(path))))
+    except OSError:
+        return False
+
+
+class SocketWriter:
+    def __init__(self, send):
+        self.send = send
+
+    def write(self, text):
+        if text:
+            self.send({'out': text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def remote_console(send, answers, request):
+    from rich.console import Console
+
+    class RemoteConsole(Console):
+        def input(self, prompt="", *, markup=True, emoji=True, password=False, stream=None):
+            if prompt:
+                self.print(prompt, markup=markup, emoji=emoji, end="")
+            send({'prompt': True, 'password': password})
+            answer = answers.get()
+            if answer is None:
+                raise EOFError("Client disconnected")
+            return answer
+
+    return RemoteConsole(file=SocketWriter(send), force_terminal=request.get('tty', False),
+                         width=request.get('width'), color_system="auto" if request.get('tty') else None)
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        from .cli import build_parser, run
+
+        request = json.loads(self.rfile.readline() or '{}')
+        write_lock = threading.Lock()
+
+        def send(message):
+            with write_lock:
+                try:
+                    self.wfile.write((json.dumps(message) + '\n').encode())
+                    self.wfile.flush()
+                except OSError:
+                    pass
+
+        if not request.get('stop') and request.get('env') != self.server.environment:
+            names = set(request.get('env') or {}) | set(self.server.environment)
+            send({'env_mismatch': sorted(name for name in names
+                                         if (request.get('env') or {}).get(name) != self.server.environment.get(name))})
+            return
+
+        if request.get('stop'):
+            send({'out': "Snapshot manager daemon stopping.\n"})
+            send({'exit': 0})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+
+        self.finished = False
+        answers = queue.Queue()
+        threading.Thread(target=self.read_client, args=(answers,), daemon=True).start()
+
+        code = 1
+        previous_cwd = os.getcwd()
+        try:
+            os.chdir(request.get('cwd', previous_cwd))
+            # Commands that print plain tables (index, history) go to the client too; one command runs at a time
+            with use_console(remote_console(send, answers, request)), contextlib.redirect_stdout(SocketWriter(send)):
+                code = run(build_parser().parse_args(request['argv']))
+        except KeyboardInterrupt:
+            send({'out': "Interrupted.\n"})
+            code = 130
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            logging.error(f"Daemon command failed: {str(e)}\n{traceback.format_exc()}")
+            send({'out': f"Error: {str(e)}\n"})
+        finally:
+            self.finished = True
+            os.chdir(previous_cwd)
+            send({'exit': code})
+
+    def read_client(self, answers):
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if 'input' in message:
+                    answers.put(message['input'])
+                elif message.get('interrupt') and not self.finished:
+                    # Same path as Ctrl-C in a terminal: the command's ShutdownSignal drains and relocks
+                    os.kill(os.getpid(), signal.SIGINT)
+        except (OSError, ValueError):
+            pass
+        answers.put(None)
+        if not self.finished:
+            # The client went away mid-command; wind it down the same way as Ctrl-C
+            os.kill(os.getpid(), signal.SIGINT)
+
+
+def warm_up():
+    # Pay the import and account lookup costs once for every later command
+    for module in ('rich.console', 'rich.progress', 'rich.table', 'tabulate', f'{__package__}.stages'):
+        importlib.import_module(module)
+
+    from .az import check_az_login, get_subscription_names
+
+    if check_az_login():
+        get_subscription_names()
+
+
+def is_running(socket_path=SOCKET_PATH):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def serve(socket_path=SOCKET_PATH):
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not trusted_directory(directory):
+        print(f"Refusing to listen in {directory}: another user owns it or can write to it")
+        return 1
+    if os.path.lexists(socket_path):
+        if not private_socket(socket_path):
+            print(f"Refusing to replace {socket_path}: it is not a private socket owned by you")
+            return 1
+        if is_running(socket_path):
+            print(f"Snapshot manager daemon already listening on {socket_path}")
+            return 1
+        os.unlink(socket_path)
+
+    warm_up()
+    # Created as 0600 from the start, so there is no window in which another user can connect
+    previous_umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(socket_path, CommandHandler)
+    finally:
+        os.umask(previous_umask)
+    server.environment = environment_digest()
+    with server:
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown, daemon=True).start())
+        print(f"Snapshot manager daemon listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+    return 0
+
+
+def forward(argv, socket_path=SOCKET_PATH, stop=False):
+    # Returns None when no daemon is listening so the caller can run the command itself
+    if not os.path.lexists(socket_path):
+        return None
+    if not private_socket(socket_path):
+        # Someone else's socket would see the arguments and could answer the prompts
+        print(f"Ignoring {socket_path}: it is not a private socket owned by you; running locally.", file=sys.stderr)
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile('r') as reader, sock.makefile('w') as writer:
+        def send(message):
+            writer.write(json.dumps(message) + '\n')
+            writer.flush()
+
+        send({'argv': argv, 'stop': stop, 'cwd': os.getcwd(), 'tty': sys.stdout.isatty(),
+              'width': shutil.get_terminal_size().columns, 'env': environment_digest()})
+        while True:
+            try:
+                line = reader.readline()
+                if not line:
+                    return 1
+                message = json.loads(line)
+                if 'out' in message:
+                    sys.stdout.write(message['out'])
+                    sys.stdout.flush()
+                elif 'prompt' in message:
+                    if message.get('password'):
+                        import getpass
+                        send({'input': getpass.getpass('')})
+                    else:
+                        send({'input': input()})
+                elif 'exit' in message:
+                    return message['exit']
+                elif 'env_mismatch' in message:
+                    print(f"The resident worker was started with different {', '.join(message['env_mismatch'])}; "
+                          f"running locally.", file=sys.stderr)
+                    return None
+            except KeyboardInterrupt:
+                send({'interrupt': True})
+            except EOFError:
+                send({'input': ''})
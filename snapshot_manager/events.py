@@ -0,0 +1,145 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+
+from .az import timeout_counts
+
+# Optional sinks, e.g. SNAPSHOT_METRICS_FILE=/var/lib/node_exporter/snapshot.prom for the textfile collector
+EVENTS_FILE = os.environ.get('SNAPSHOT_EVENTS_FILE')
+METRICS_FILE = os.environ.get('SNAPSHOT_METRICS_FILE')
+REFRESH_PER_SECOND = 4
+
+# SimpleQueue.put never blocks and takes no Python-level lock, so workers pay almost nothing to report
+_events = queue.SimpleQueue()
+
+
+def label_value(value):
+    # Prometheus text format: backslash, double quote and newline are escaped inside label values
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def emit(status, **fields):
+    fields['status'] = status
+    fields['ts'] = time.time()
+    _events.put(fields)
+
+
+class EventStream:
+    def __init__(self, description, total, stage='run', console=None, jsonl_path=EVENTS_FILE,
+                 metrics_path=METRICS_FILE, refresh_per_second=REFRESH_PER_SECOND):
+        self.description = description
+        self.total = total
+        self.stage = stage
+        self.console = console
+        self.jsonl_path = jsonl_path
+        self.metrics_path = metrics_path
+        self.interval = 1.0 / refresh_per_second
+        self.counts = Counter()
+        self.by_subscription = defaultdict(Counter)
+        self.completed = 0
+        self.started = None
+        self._stop = threading.Event()
+        self._jsonl = None
+        self._thread = None
+
+    def __enter__(self):
+        from rich.progress import Progress
+
+        self.started = time.time()
+        # Events emitted before the stream started, e.g. for IDs rejected while planning, or by stragglers of an
+        # earlier stream, are not part of this total; they still go to the events file
+        stale = self._drain()
+        # Rendering is driven only by the consumer thread, so rich never refreshes on its own
+        self.progress = Progress(console=self.console, auto_refresh=False)
+        self.progress.start()
+        self.task = self.progress.add_task(self.description, total=self.total)
+        if self.jsonl_path:
+            self._jsonl = open(self.jsonl_path, 'a')
+            self._write(stale, 'before-' + self.stage)
+        self._thread = threading.Thread(target=self._consume, name=f'{self.stage}-events', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self._flush()
+        self.progress.stop()
+        if self._jsonl:
+            self._jsonl.close()
+        return False
+
+    def describe(self, description):
+        # Shown from the next render on
+        self.progress.update(self.task, description=description)
+
+    def _consume(self):
+        # One render per tick no matter how many events arrived, so output cost stays flat
+        while not self._stop.wait(self.interval):
+            self._flush()
+
+    def _drain(self):
+        events = []
+        while True:
+            try:
+                events.append(_events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _write(self, events, stage):
+        for event in events:
+            event.setdefault('stage', stage)
+            self._jsonl.write(json.dumps(event) + '\n')
+        if events:
+            self._jsonl.flush()
+
+    def _flush(self):
+        events = self._drain()
+        for event in events:
+            self.counts[event['status']] += 1
+            self.by_subscription[event.get('subscription') or 'Unknown'][event['status']] += 1
+        if self._jsonl:
+            self._write(events, self.stage)
+
+        self.completed += len(events)
+        self.progress.update(self.task, completed=self.completed)
+        self.progress.refresh()
+        if self.metrics_path:
+            self.write_metrics()
+
+    def write_metrics(self):
+        elapsed = time.time() - self.started
+        lines = [
+            '# HELP snapshot_items_total Snapshots processed by stage and status.',
+            '# TYPE snapshot_items_total counter',
+        ]
+        stage = label_value(self.stage)
+        for subscription, counts in sorted(self.by_subscription.items()):
+            for status, count in sorted(counts.items()):
+                lines.append(f'snapshot_items_total{{stage="{stage}",subscription="{label_value(subscription)}",'
+                             f'status="{label_value(status)}"}} {count}')
+        lines += [
+            '# HELP snapshot_items_expected Snapshots queued for the stage.',
+            '# TYPE snapshot_items_expected gauge',
+            f'snapshot_items_expected{{stage="{stage}"}} {self.total}',
+            '# HELP snapshot_items_completed Snapshots finished in the stage.',
+            '# TYPE snapshot_items_completed gauge',
+            f'snapshot_items_completed{{stage="{stage}"}} {self.completed}',
+            '# HELP snapshot_stage_elapsed_seconds Wall-clock time spent in the stage so far.',
+            '# TYPE snapshot_stage_elapsed_seconds gauge',
+            f'snapshot_stage_elapsed_seconds{{stage="{stage}"}} {elapsed:.3f}',
+            '# HELP snapshot_items_per_second Completion throughput for the stage.',
+            '# TYPE snapshot_items_per_second gauge',
+            f'snapshot_items_per_second{{stage="{stage}"}} {self.completed / elapsed if elapsed else 0:.3f}',
+            '# HELP snapshot_az_timeouts_total az commands killed after running past their timeout, by command kind.',
+            '# TYPE snapshot_az_timeouts_total counter',
+        ]
+        lines += [f'snapshot_az_timeouts_total{{kind="{label_value(kind)}"}} {count}' for kind, count in sorted(timeout_counts().items())]
+        # Write-then-rename so scrapers never read a half-written file
+        tmp_path = f'{self.metrics_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.metrics_path)
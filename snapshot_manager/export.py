@@ -0,0 +1,158 @@
+import csv
+import json
+import os
+import threading
+import time
+
+from .results import NAME_ONLY_STATUSES
+from .usage import USAGE_COLUMNS, usage_cells
+
+# Same layout as ro2.2.deleted-snaps.csv, followed by the size and cost captured during validation
+RESULT_COLUMNS = ['Subscription', 'Status', 'Snapshot', 'Error'] + USAGE_COLUMNS
+VALIDATION_COLUMNS = ['Snapshot ID', 'Status', 'Error'] + USAGE_COLUMNS
+FLUSH_ROWS = 500
+FLUSH_SECONDS = 2
+# Parquet rows only become readable once the file is closed, so row groups are sized for scanning rather than durability
+PARQUET_ROW_GROUP = 10000
+
+
+def result_row(subscription_name, status, snapshot_name, error=None, details=None):
+    if status == 'non-existent':
+        # As v2/v3-delete-snap.py wrote it; the original delete-snap.py left the column empty
+        error = 'Snapshot not found'
+    elif status in NAME_ONLY_STATUSES:
+        error = ''
+    return [subscription_name or "Unknown", status, snapshot_name, error or ''] + usage_cells(details)
+
+
+def validation_row(snapshot_id, status, error, details=None):
+    return [snapshot_id, 'Valid' if status == 'valid' else 'Invalid', error or ''] + usage_cells(details)
+
+
+def result_rows(results):
+    for subscription_name, data in results.items():
+        for status, snapshots in data.items():
+            for entry in snapshots:
+                snapshot_name, error = (entry, None) if status in NAME_ONLY_STATUSES else entry
+                yield result_row(subscription_name, status, snapshot_name, error)
+
+
+def export_format(filename):
+    if filename.endswith(('.jsonl', '.json', '.ndjson')):
+        return 'jsonl'
+    if filename.endswith('.parquet'):
+        return 'parquet'
+    return 'csv'
+
+
+class ResultWriter:
+    # Appends rows as they are produced, flushing every FLUSH_ROWS rows or FLUSH_SECONDS, so a crash loses at most one batch
+    def __init__(self, filename, columns=RESULT_COLUMNS, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        self.filename = filename
+        self.columns = columns
+        self.format = export_format(filename)
+        self.flush_rows = PARQUET_ROW_GROUP if self.format == 'parquet' else flush_rows
+        self.flush_seconds = None if self.format == 'parquet' else flush_seconds
+        self.rows = 0
+        self._pending = []
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        self._file = None
+        self._parquet = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def open(self):
+        if self.format == 'parquet':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise RuntimeError("pyarrow is required for Parquet export. Run 'pip install pyarrow' or use .csv/.jsonl.")
+            self._schema = pa.schema([(column, pa.string()) for column in self.columns])
+            self._parquet = pq.ParquetWriter(self.filename, self._schema)
+        else:
+            self._file = open(self.filename, 'w', newline='')
+            if self.format == 'csv':
+                self._csv = csv.writer(self._file)
+                self._csv.writerow(self.columns)
+                self._file.flush()
+        return self
+
+    def write(self, row):
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.flush_rows or (
+                    self.flush_seconds is not None and time.time() - self._last_flush >= self.flush_seconds):
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.time()
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        if self._parquet:
+            import pyarrow as pa
+
+            columns = list(zip(*rows))
+            self._parquet.write_table(pa.Table.from_arrays([pa.array(column, pa.string()) for column in columns],
+                                                           schema=self._schema))
+        elif self.format == 'csv':
+            self._csv.writerows(rows)
+            self._file.flush()
+        else:
+            self._file.write(''.join(json.dumps(dict(zip(self.columns, row))) + '\n' for row in rows))
+            self._file.flush()
+        self.rows += len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._file is None and self._parquet is None:
+                return
+            self._flush()
+            if self._parquet:
+                self._parquet.close()
+                self._parquet = None
+            else:
+                self._file.close()
+                self._file = None
+
+    def save_as(self, filename):
+        # Renaming costs nothing when the format matches; otherwise the finished file is converted in batches
+        self.close()
+        if export_format(filename) == self.format:
+            os.replace(self.filename, filename)
+        else:
+            with ResultWriter(filename, self.columns) as target:
+                for row in read_rows(self.filename, self.columns):
+                    target.write(row)
+            os.remove(self.filename)
+        self.filename = filename
+
+
+def read_rows(filename, columns):
+    fmt = export_format(filename)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(filename).iter_batches():
+            yield from (list(row) for row in zip(*(batch.column(column).to_pylist() for column in columns)))
+    elif fmt == 'jsonl':
+        with open(filename) as f:
+            for line in f:
+                record = json.loads(line)
+                yield [record.get(column, '') for column in columns]
+    else:
+        with open(filename, newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            yield from reader
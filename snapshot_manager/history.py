@@ -0,0 +1,186 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .ids import chg_of, split_id
+
+HISTORY_DB = os.environ.get('SNAPSHOT_HISTORY_DB', 'snapshot_history.db')
+# Items are written in batches, like the result files, so a crash loses at most one batch
+FLUSH_ROWS = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    command TEXT NOT NULL,
+    chg TEXT COLLATE NOCASE,
+    started REAL NOT NULL,
+    finished REAL,
+    status TEXT NOT NULL,
+    items INTEGER NOT NULL DEFAULT 0,
+    workers INTEGER,
+    auth TEXT,
+    input TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS idx_runs_chg ON runs (chg COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS run_items (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    recorded_at REAL NOT NULL,
+    subscription_id TEXT COLLATE NOCASE,
+    subscription TEXT COLLATE NOCASE,
+    name TEXT NOT NULL COLLATE NOCASE,
+    chg TEXT COLLATE NOCASE,
+    status TEXT NOT NULL,
+    error TEXT,
+    size_gb INTEGER,
+    time_created TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_items_chg ON run_items (chg COLLATE NOCASE, run_id);
+CREATE INDEX IF NOT EXISTS idx_items_subscription ON run_items (subscription_id COLLATE NOCASE, run_id);
+CREATE INDEX IF NOT EXISTS idx_items_name ON run_items (name COLLATE NOCASE, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_items_run ON run_items (run_id, subscription_id);
+CREATE TABLE IF NOT EXISTS run_stages (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run_id, stage)
+);
+"""
+
+
+def open_history(db_path=HISTORY_DB):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class RunHistory:
+    # Records one run and its items; a history database that cannot be written never fails the run itself
+    def __init__(self, db_path, command, ctx, workers=None, auth=None, source=None):
+        self.db_path = db_path
+        self.command = command
+        self.ctx = ctx
+        self.workers = workers
+        self.auth = auth
+        self.source = source
+        self.run_id = None
+        self.conn = None
+        self._pending = []
+        self._names = set()
+        self._lock = threading.Lock()
+        # Items carry the subscription name when the run resolved one; the ID keeps runs with and without names together
+        self._subscription_ids = {name: subscription_id for subscription_id, name in ctx.subscription_names.items()}
+
+    def __enter__(self):
+        try:
+            self.conn = open_history(self.db_path)
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO runs (command, chg, started, status, workers, auth, input) VALUES (?, ?, ?, 'running', ?, ?, ?)",
+                    (self.command, self.ctx.options.get('chg_number'), time.time(), self.workers, self.auth, self.source))
+            self.run_id = cursor.lastrowid
+            self.ctx.history = self
+        except sqlite3.Error as e:
+            logging.warning(f"Run history disabled, {self.db_path} could not be opened: {str(e)}")
+            self.conn = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.conn is None:
+            return False
+        self.ctx.history = None
+        if exc_type is not None or self.ctx.failed_stage:
+            status = 'failed'
+        elif self.ctx.interrupted:
+            status = 'interrupted'
+        else:
+            status = 'completed'
+        try:
+            with self._lock:
+                self._flush()
+            # Without a --chg the run is attributed to the change number most of its snapshots carry
+            chg = self.ctx.options.get('chg_number')
+            if not chg:
+                row = self.conn.execute("SELECT chg FROM run_items WHERE run_id = ? AND chg != '' "
+                                        "GROUP BY chg ORDER BY COUNT(*) DESC LIMIT 1", (self.run_id,)).fetchone()
+                chg = row['chg'] if row else None
+            with self.conn:
+                self.conn.execute("UPDATE runs SET finished = ?, status = ?, items = ?, chg = ? WHERE id = ?",
+                                  (time.time(), status, len(self._names), chg, self.run_id))
+                self.conn.executemany("INSERT OR REPLACE INTO run_stages (run_id, stage, seconds) VALUES (?, ?, ?)",
+                                      [(self.run_id, stage, seconds) for stage, seconds in self.ctx.timings.items()])
+        except sqlite3.Error as e:
+            logging.warning(f"Could not finish run {self.run_id} in {self.db_path}: {str(e)}")
+        finally:
+            self.conn.close()
+        return False
+
+    def add(self, subscription_name, status, snapshot_name, error=None, details=None):
+        # Invalid entries are recorded under their full text, which still ends in the name
+        name = split_id(snapshot_name)[2]
+        # Failed creates are recorded under the VM name, so they fall back to the run's --chg
+        chg = chg_of(name) or self.ctx.options.get('chg_number') or ''
+        row = (self.run_id, time.time(), self._subscription_ids.get(subscription_name, subscription_name), subscription_name,
+               name, chg.upper(), status, error or None, details.size_gb if details else None,
+               details.time_created if details else None)
+        with self._lock:
+            self._names.add((subscription_name, name.lower()))
+            self._pending.append(row)
+            if len(self._pending) >= FLUSH_ROWS:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            with self.conn:
+                self.conn.executemany("INSERT INTO run_items (run_id, recorded_at, subscription_id, subscription, name, chg, status, "
+                                      "error, size_gb, time_created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logging.warning(f"Dropped {len(rows)} run history items: {str(e)}")
+
+
+def recent_runs(conn, limit=20, command=None):
+    return conn.execute(
+        """SELECT r.*, (SELECT GROUP_CONCAT(status || '=' || n, ' ') FROM
+               (SELECT status, COUNT(*) AS n FROM run_items WHERE run_id = r.id GROUP BY status ORDER BY n DESC)) AS outcomes
+           FROM runs r WHERE ? IS NULL OR r.command = ? ORDER BY r.started DESC LIMIT ?""",
+        (command, command, limit)).fetchall()
+
+
+def throughput(conn, last=30, command=None):
+    # Per subscription over the last runs: distinct snapshots handled, and the wall time from each run's start
+    # to that subscription's last item, which includes validation and lock handling
+    return conn.execute(
+        """WITH recent AS (SELECT id, started FROM runs WHERE ? IS NULL OR command = ? ORDER BY started DESC LIMIT ?)
+           SELECT subscription_id, MAX(subscription) AS subscription, COUNT(*) AS runs, SUM(items) AS items,
+                  SUM(seconds) AS seconds, SUM(failed) AS failed
+           FROM (SELECT i.run_id, i.subscription_id,
+                        MAX(CASE WHEN i.subscription != i.subscription_id THEN i.subscription END) AS subscription,
+                        COUNT(DISTINCT i.name) AS items,
+                        MAX(i.recorded_at) - r.started AS seconds,
+                        COUNT(DISTINCT CASE WHEN i.status IN ('failed', 'error') THEN i.name END) AS failed
+                 FROM run_items i JOIN recent r ON r.id = i.run_id
+                 GROUP BY i.run_id, i.subscription_id)
+           GROUP BY subscription_id ORDER BY items DESC""",
+        (command, command, last)).fetchall()
+
+
+def snapshot_timeline(conn, name):
+    return conn.execute(
+        """SELECT i.recorded_at, i.run_id, r.command, i.subscription, i.status, i.error, i.size_gb, i.time_created
+           FROM run_items i JOIN runs r ON r.id = i.run_id
+           WHERE i.name = ? COLLATE NOCASE ORDER BY i.recorded_at""",
+        (split_id(name)[2],)).fetchall()
+
+
+def chg_summary(conn, chg):
+    return conn.execute(
+        """SELECT i.run_id, r.command, r.started, r.status AS run_status, i.status, COUNT(DISTINCT i.name) AS snapshots
+           FROM run_items i JOIN runs r ON r.id = i.run_id
+           WHERE i.chg = ? COLLATE NOCASE GROUP BY i.run_id, i.status ORDER BY r.started, i.status""",
+        (chg.upper(),)).fetchall()
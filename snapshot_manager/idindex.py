@@ -0,0 +1,166 @@
+import bisect
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from typing import NamedTuple
+
+from .export import export_format
+from .ids import canonical_id, chg_of, split_id
+
+ID_INDEX_FILE = 'snapshot_ids.idx'
+MAGIC = b'SNAPIDX1'
+# magic, version, key count, metadata offset and size, keys offset
+HEADER = struct.Struct('<8sIQQQQ')
+# The keys section is the sorted 64-bit hashes of the lookup keys, then the record offset of each
+KEY = struct.Struct('<Q')
+VERSION = 1
+
+
+class IndexEntry(NamedTuple):
+    snapshot_id: str
+    name: str
+    subscription: str
+    status: str
+    chg: str
+    source: str
+    line: int
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+
+
+def lookup_keys(value):
+    # Full IDs are looked up by canonical ID; bare names, as in ro2.2.deleted-snaps.csv, by lowercase name
+    value = value.strip()
+    keys = []
+    if '/' in value:
+        keys.append(f"id:{canonical_id(value)}")
+    keys.append(f"name:{split_id(value)[2].lower()}")
+    return keys
+
+
+def source_rows(path):
+    # Yields (line, snapshot, subscription, status) from ID lists and from result/validation files
+    fmt = export_format(path) if path.endswith(('.csv', '.jsonl', '.json', '.ndjson', '.parquet')) else 'text'
+    if fmt == 'text':
+        with open(path) as f:
+            for line, value in enumerate(f, 1):
+                if value.strip():
+                    yield line, value.strip(), '', ''
+        return
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        records = (record for batch in pq.ParquetFile(path).iter_batches() for record in batch.to_pylist())
+    elif fmt == 'jsonl':
+        records = (json.loads(value) for value in open(path) if value.strip())
+    else:
+        records = csv.DictReader(open(path, newline=''))
+    # Data rows start on line 2 of a CSV, after the header
+    first = 2 if fmt == 'csv' else 1
+    for line, record in enumerate(records, first):
+        snapshot = record.get('Snapshot ID') or record.get('Snapshot') or ''
+        if snapshot:
+            yield line, snapshot, record.get('Subscription') or '', record.get('Status') or ''
+
+
+def build_id_index(sources, path=ID_INDEX_FILE):
+    keys = []
+    records = []
+    offset = 0
+    for source_index, source in enumerate(sources):
+        for line, snapshot, subscription, status in source_rows(source):
+            snapshot_id = canonical_id(snapshot) if '/' in snapshot else ''
+            subscription_id, _, name = split_id(snapshot)
+            record = '\t'.join([snapshot_id, name, subscription or subscription_id, status,
+                                chg_of(name), str(source_index), str(line)]).encode() + b'\n'
+            records.append(record)
+            if snapshot_id:
+                keys.append((key_hash(f"id:{snapshot_id}"), offset))
+            keys.append((key_hash(f"name:{name.lower()}"), offset))
+            offset += len(record)
+    keys.sort()
+
+    metadata = json.dumps({'sources': [os.path.abspath(source) for source in sources], 'created': time.time()}).encode()
+    records_offset = HEADER.size
+    metadata_offset = records_offset + offset
+    # Aligned so the hash array can be viewed as native integers
+    padding = -(metadata_offset + len(metadata)) % KEY.size
+    keys_offset = metadata_offset + len(metadata) + padding
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(keys), metadata_offset, len(metadata), keys_offset))
+        f.writelines(records)
+        f.write(metadata + b'\0' * padding)
+        f.write(struct.pack(f'<{len(keys)}Q', *(hash_value for hash_value, _ in keys)))
+        f.write(struct.pack(f'<{len(keys)}Q', *(records_offset + record_offset for _, record_offset in keys)))
+    os.replace(tmp_path, path)
+    return len(records), len(keys)
+
+
+class IdIndex:
+    def __init__(self, path=ID_INDEX_FILE):
+        self.path = path
+        self._hashes = self._offsets = None
+        self._file = open(path, 'rb')
+        self.map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.map, 0) if len(self.map) >= HEADER.size else (b'', 0, 0, 0, 0, 0)
+        magic, version, self.count, metadata_offset, metadata_size, self.keys_offset = header
+        if magic != MAGIC or version != VERSION or len(self.map) < self.keys_offset + 2 * self.count * KEY.size:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot ID index (version {VERSION})")
+        self.metadata = json.loads(self.map[metadata_offset:metadata_offset + metadata_size])
+        self.sources = self.metadata['sources']
+        # Views over the mapping: bisect reads only the ~log2(count) hashes it compares, nothing is loaded up front
+        # (the index is little-endian, as are the platforms this runs on)
+        section = memoryview(self.map)[self.keys_offset:self.keys_offset + 2 * self.count * KEY.size]
+        self._hashes = section[:self.count * KEY.size].cast('Q')
+        self._offsets = section[self.count * KEY.size:].cast('Q')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        for view in (self._hashes, self._offsets):
+            if view is not None:
+                view.release()
+        self.map.close()
+        self._file.close()
+
+    def _record(self, offset):
+        end = self.map.find(b'\n', offset)
+        snapshot_id, name, subscription, status, chg, source, line = self.map[offset:end].decode().split('\t')
+        return IndexEntry(snapshot_id, name, subscription, status, chg, self.sources[int(source)], int(line))
+
+    def _find(self, key):
+        hash_value = key_hash(key)
+        position = bisect.bisect_left(self._hashes, hash_value)
+        entries = []
+        while position < self.count and self._hashes[position] == hash_value:
+            entry = self._record(self._offsets[position])
+            # The hash only narrows the search; the record itself confirms the match
+            kind, _, value = key.partition(':')
+            if (entry.snapshot_id if kind == 'id' else entry.name.lower()) == value:
+                entries.append(entry)
+            position += 1
+        return entries
+
+    def lookup(self, value):
+        keys = lookup_keys(value)
+        entries = self._find(keys[0])
+        if len(keys) > 1:
+            # Records without a full ID (name-only CSVs) still match an ID query by name
+            entries += [entry for entry in self._find(keys[1]) if not entry.snapshot_id]
+        return entries
+
+    def __contains__(self, value):
+        return bool(self.lookup(value))
@@ -0,0 +1,72 @@
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+
+class NormalisedIds(NamedTuple):
+    ids: List[str]
+    duplicates: Dict[str, List[str]]
+    conflicts: Dict[str, List[str]]
+
+
+# Change numbers as they appear in snapshot names, e.g. RH_PATCH_CHG0633563_dgm010ccc
+CHG_NUMBER = re.compile(r'CHG\d+', re.IGNORECASE)
+
+
+def chg_of(name: str) -> str:
+    match = CHG_NUMBER.search(name or '')
+    return match.group(0).upper() if match else ''
+
+
+def canonical_id(snapshot_id: str) -> str:
+    # ARM resource IDs are case-insensitive, so the lowercase form is the identity
+    return snapshot_id.strip().rstrip('/').lower()
+
+
+def split_id(snapshot_id: str) -> Tuple[str, str, str]:
+    parts = snapshot_id.strip().rstrip('/').split('/')
+    if len(parts) < 9:
+        return '', '', parts[-1]
+    return parts[2], parts[4], parts[-1]
+
+
+def normalise_snapshot_ids(snapshot_ids: Iterable[str]) -> NormalisedIds:
+    first_seen: Dict[str, str] = {}
+    duplicates: Dict[str, List[str]] = defaultdict(list)
+    by_name: Dict[str, List[str]] = defaultdict(list)
+
+    for raw in snapshot_ids:
+        snapshot_id = raw.strip().rstrip('/')
+        if not snapshot_id:
+            continue
+        key = canonical_id(snapshot_id)
+        if key in first_seen:
+            duplicates[first_seen[key]].append(raw)
+            continue
+        first_seen[key] = snapshot_id
+        subscription_id, _, name = split_id(snapshot_id)
+        if subscription_id:
+            by_name[name.lower()].append(snapshot_id)
+
+    # The same snapshot name under different subscriptions/RGs is legal but usually a copy-paste mistake
+    conflicts = {ids[0].split('/')[-1]: ids for ids in by_name.values() if len(ids) > 1}
+    return NormalisedIds(list(first_seen.values()), dict(duplicates), conflicts)
+
+
+def print_normalisation_report(normalised: NormalisedIds, console) -> None:
+    if normalised.duplicates:
+        extra = sum(len(copies) for copies in normalised.duplicates.values())
+        console.print(f"[yellow]⚠️ Skipped {extra} duplicate snapshot IDs (ARM IDs are case-insensitive):[/yellow]")
+        for snapshot_id, copies in normalised.duplicates.items():
+            console.print(f"  [yellow]• {snapshot_id} (+{len(copies)} more)[/yellow]")
+    if normalised.conflicts:
+        console.print(f"[yellow]⚠️ {len(normalised.conflicts)} snapshot names appear in more than one resource group:[/yellow]")
+        for name, ids in normalised.conflicts.items():
+            console.print(f"  [yellow]• {name}[/yellow]")
+            for snapshot_id in ids:
+                subscription_id, resource_group, _ = split_id(snapshot_id)
+                console.print(f"      {subscription_id} / {resource_group}")
+
+
+def resource_group_key(subscription_id: str, resource_group: str) -> Tuple[str, str]:
+    return subscription_id.lower(), resource_group.lower()
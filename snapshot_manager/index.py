@@ -0,0 +1,149 @@
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import arm
+from .auth import auth_mode
+from .az import run_az_json
+from .usage import SnapshotDetails
+
+INDEX_DB = 'snapshot_index.db'
+# An index older than this is not trusted to skip existence checks
+MAX_INDEX_AGE = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id TEXT PRIMARY KEY COLLATE NOCASE,
+    name TEXT NOT NULL,
+    subscription TEXT NOT NULL COLLATE NOCASE,
+    listed_as TEXT NOT NULL COLLATE NOCASE,
+    resource_group TEXT NOT NULL COLLATE NOCASE,
+    location TEXT,
+    source_id TEXT COLLATE NOCASE,
+    vm_id TEXT COLLATE NOCASE,
+    size_gb INTEGER,
+    sku TEXT,
+    incremental INTEGER,
+    time_created TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_source ON snapshots (source_id, time_created);
+CREATE INDEX IF NOT EXISTS idx_snapshots_name ON snapshots (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS indexed_subscriptions (
+    subscription TEXT PRIMARY KEY COLLATE NOCASE,
+    indexed_at REAL NOT NULL
+);
+"""
+
+
+# Only the fields snapshot_row reads, in the same shape, so az serialises and we decode a fraction of each snapshot
+SNAPSHOT_LIST_QUERY = ('[].{id:id, name:name, resourceGroup:resourceGroup, location:location, '
+                       'creationData:{sourceResourceId:creationData.sourceResourceId}, diskSizeGb:diskSizeGb, '
+                       'sku:{name:sku.name}, incremental:incremental, timeCreated:timeCreated}')
+
+
+def list_subscription(subscription):
+    # One listing for snapshots and one for disks per subscription, instead of a show per snapshot
+    if auth_mode() != 'az':
+        from .locks import subscription_id_for
+
+        subscription_id = subscription_id_for(subscription)
+        snapshots, disks = arm.list_snapshots(subscription_id), arm.list_disks(subscription_id)
+    else:
+        snapshots = run_az_json(['az', 'snapshot', 'list', '--subscription', subscription,
+                                 '--query', SNAPSHOT_LIST_QUERY, '-o', 'json'])
+        disks = run_az_json(['az', 'disk', 'list', '--subscription', subscription,
+                             '--query', '[].{id:id, managedBy:managedBy}', '-o', 'json'])
+    # Reduced to rows on the listing thread, so the main thread only writes them
+    vm_by_disk = {disk['id'].lower(): disk.get('managedBy') for disk in disks or []}
+    return subscription, [snapshot_row(subscription, snapshot, vm_by_disk) for snapshot in snapshots or []]
+
+
+def open_index(db_path=INDEX_DB):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def snapshot_row(subscription, snapshot, vm_by_disk):
+    source_id = (snapshot.get('creationData') or {}).get('sourceResourceId')
+    parts = snapshot['id'].split('/')
+    return (
+        snapshot['id'],
+        snapshot['name'],
+        parts[2],
+        subscription,
+        snapshot.get('resourceGroup') or parts[4],
+        snapshot.get('location'),
+        source_id,
+        vm_by_disk.get(source_id.lower()) if source_id else None,
+        snapshot.get('diskSizeGb') or snapshot.get('diskSizeGB'),
+        (snapshot.get('sku') or {}).get('name'),
+        int(bool(snapshot.get('incremental'))),
+        snapshot.get('timeCreated'),
+    )
+
+
+def build_index(subscriptions, db_path=INDEX_DB, max_workers=10):
+    conn = open_index(db_path)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = list(executor.map(list_subscription, subscriptions))
+
+    for subscription, rows in listings:
+        with conn:
+            # A fresh listing replaces whatever was indexed before, so deleted snapshots drop out
+            conn.execute("DELETE FROM snapshots WHERE listed_as = ?", (subscription,))
+            conn.executemany("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO indexed_subscriptions VALUES (?, ?)", (subscription, time.time()))
+        logging.info(f"Indexed {len(rows)} snapshots in subscription {subscription}")
+    return conn
+
+
+def index_age(conn):
+    row = conn.execute("SELECT MIN(indexed_at) FROM indexed_subscriptions").fetchone()
+    return time.time() - row[0] if row[0] else None
+
+
+def snapshots_by_source(conn, name_like=None):
+    query = "SELECT * FROM snapshots"
+    params = ()
+    if name_like:
+        query += " WHERE name LIKE ?"
+        params = (name_like,)
+    query += " ORDER BY source_id, time_created DESC"
+    grouped = {}
+    for row in conn.execute(query, params):
+        grouped.setdefault(row['source_id'], []).append(dict(row))
+    return grouped
+
+
+def retention_candidates(conn, keep, name_like=None):
+    # Everything except the newest `keep` snapshots of each source disk
+    where = "WHERE source_id IS NOT NULL"
+    params = []
+    if name_like:
+        where += " AND name LIKE ?"
+        params.append(name_like)
+    query = f"""
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY source_id ORDER BY time_created DESC) AS position
+            FROM snapshots
+            {where}
+        )
+        WHERE position > ?
+        ORDER BY id
+    """
+    return [row['id'] for row in conn.execute(query, params + [keep])]
+
+
+def snapshot_details(conn, snapshot_ids):
+    # The listing already carried size and SKU, so index-driven runs get cost figures without a show
+    details = {}
+    for snapshot_id in snapshot_ids:
+        row = conn.execute("SELECT size_gb, sku, incremental, time_created, location FROM snapshots WHERE id = ?",
+                           (snapshot_id,)).fetchone()
+        if row:
+            details[snapshot_id] = SnapshotDetails(row['size_gb'] or 0, row['sku'], bool(row['incremental']),
+                                                   row['time_created'], row['location'])
+    return details
@@ -0,0 +1,399 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import weakref
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from . import arm
+from .auth import auth_mode
+from .az import (KILL_GRACE, az_backend, command_kind, command_timeout, get_subscription_names, json_loads,
+                 record_timeout, run_command, timeout_error)
+
+LOCK_CONFIG_FILE = 'scope_locks.json'
+REMOVED_LOCKS_FILE = 'removed_scope_locks.json'
+MAX_CONCURRENT_COMMANDS = 10
+
+LOCK_PROVIDER = '/providers/microsoft.authorization/locks/'
+SUBSCRIPTION_ID = re.compile(r'^[0-9a-fA-F]{8}-([0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}$')
+
+# Every read-merge-write of the removed-locks file holds this, since the batch hooks of a delete record
+# their locks from several threads at once
+_state_lock = threading.RLock()
+
+
+class ScopeLock(NamedTuple):
+    subscription: str
+    name: str
+    resource_group: Optional[str] = None
+    resource: Optional[str] = None
+    level: str = 'CanNotDelete'
+    notes: Optional[str] = None
+    id: Optional[str] = None
+
+    @property
+    def scope(self) -> str:
+        if self.resource:
+            return 'resource'
+        if self.resource_group:
+            return 'resource group'
+        return 'subscription'
+
+    @property
+    def target(self) -> str:
+        return self.resource or self.resource_group or self.subscription
+
+    def key(self) -> Tuple[str, str, str]:
+        # ARM names are case-insensitive, and subscription-level locks are matched by name
+        # only since the config may use the subscription name while ARM reports its ID
+        target = '' if self.scope == 'subscription' else self.target.lower()
+        return self.scope, target, self.name.lower()
+
+    def describe(self) -> str:
+        return f"{self.scope} '{self.target}'"
+
+
+def _lock_entry(value) -> Tuple[str, str]:
+    if isinstance(value, dict):
+        return value['name'], value.get('level', 'CanNotDelete')
+    return value, 'CanNotDelete'
+
+
+def load_lock_config(path: str = LOCK_CONFIG_FILE) -> Dict[str, List[ScopeLock]]:
+    with open(path, 'r') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("PyYAML is required for YAML lock configs. Run 'pip install pyyaml' or use JSON.")
+            data = yaml.safe_load(f) or {}
+        else:
+            data = json.load(f)
+
+    config: Dict[str, List[ScopeLock]] = {}
+    for subscription, scopes in data.items():
+        locks = []
+        for rg, value in (scopes.get('resource_groups') or {}).items():
+            name, level = _lock_entry(value)
+            locks.append(ScopeLock(subscription, name, resource_group=rg, level=level))
+        for resource_id, value in (scopes.get('resources') or {}).items():
+            name, level = _lock_entry(value)
+            locks.append(ScopeLock(subscription, name, resource_group=resource_id.split('/')[4],
+                                   resource=resource_id, level=level))
+        if scopes.get('subscription'):
+            name, level = _lock_entry(scopes['subscription'])
+            locks.append(ScopeLock(subscription, name, level=level))
+        config[subscription] = locks
+    return config
+
+
+def parse_lock(subscription: str, raw: dict) -> ScopeLock:
+    lock_id = raw['id']
+    index = lock_id.lower().rfind(LOCK_PROVIDER)
+    scope_id = lock_id[:index] if index >= 0 else ''
+    parts = scope_id.split('/')
+    resource_group = parts[4] if len(parts) >= 5 else None
+    resource = scope_id if len(parts) > 5 else None
+    return ScopeLock(subscription, raw['name'], resource_group=resource_group, resource=resource,
+                     level=raw.get('level', 'CanNotDelete'), notes=raw.get('notes'), id=lock_id)
+
+
+def subscription_id_for(subscription: str) -> str:
+    # ARM paths need the subscription ID, while configs may use the display name
+    if SUBSCRIPTION_ID.match(subscription):
+        return subscription
+    for subscription_id, name in get_subscription_names().items():
+        if name.lower() == subscription.lower():
+            return subscription_id
+    return subscription
+
+
+def lock_scope_id(lock: ScopeLock) -> str:
+    if lock.resource:
+        return lock.resource
+    scope = f"/subscriptions/{subscription_id_for(lock.subscription)}"
+    if lock.resource_group:
+        scope += f"/resourceGroups/{lock.resource_group}"
+    return scope
+
+
+def write_removed_locks(locks: List[ScopeLock], path: str = REMOVED_LOCKS_FILE) -> None:
+    # Write-then-rename, so a crash mid-write never leaves a truncated file behind
+    if not locks:
+        if os.path.isfile(path):
+            os.remove(path)
+        return
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump([lock._asdict() for lock in locks], f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_removed_locks(locks: List[ScopeLock], path: str = REMOVED_LOCKS_FILE) -> None:
+    with _state_lock:
+        existing = load_removed_locks(path) if os.path.isfile(path) else []
+        seen = {(lock.subscription, lock.key()) for lock in existing}
+        write_removed_locks(existing + [lock for lock in locks if (lock.subscription, lock.key()) not in seen], path)
+
+
+def forget_removed_locks(locks: List[ScopeLock], path: str = REMOVED_LOCKS_FILE) -> None:
+    # Keeps anything not in `locks` so a later 'restore' can retry it
+    with _state_lock:
+        if not os.path.isfile(path):
+            return
+        restored = {(lock.subscription, lock.key()) for lock in locks}
+        write_removed_locks([lock for lock in load_removed_locks(path)
+                             if (lock.subscription, lock.key()) not in restored], path)
+
+
+def load_removed_locks(path: str = REMOVED_LOCKS_FILE) -> List[ScopeLock]:
+    with _state_lock, open(path, 'r') as f:
+        return [ScopeLock(**entry) for entry in json.load(f)]
+
+
+def group_by_subscription(locks: List[ScopeLock]) -> Dict[str, List[ScopeLock]]:
+    grouped: Dict[str, List[ScopeLock]] = {}
+    for lock in locks:
+        grouped.setdefault(lock.subscription, []).append(lock)
+    return grouped
+
+
+class ScopeLockManager:
+    def __init__(self, config: Optional[Dict[str, List[ScopeLock]]] = None,
+                 max_concurrency: int = MAX_CONCURRENT_COMMANDS,
+                 state_file: str = REMOVED_LOCKS_FILE,
+                 resource_groups: Optional[Dict[str, Set[str]]] = None):
+        # Without a config every CanNotDelete lock found in the subscription is managed (discovery mode),
+        # optionally narrowed to the locks on the given lowercase resource groups per subscription
+        self.config = config
+        self.resource_groups = resource_groups
+        self.max_concurrency = max_concurrency
+        self.state_file = state_file
+        # One semaphore per event loop: every asyncio.run starts a new one, and the batch hooks of a
+        # delete run several loops of the same manager on different threads at once
+        self._slots = weakref.WeakKeyDictionary()
+
+    def _limit(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._slots:
+            self._slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._slots[loop]
+
+    async def run_az_command(self, command: List[str]) -> str:
+        timeout = command_timeout(command)
+        if az_backend() == 'workers':
+            return await self._run_on_worker(command, timeout)
+        async with self._limit():
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                await self._kill(process)
+                record_timeout(command_kind(command))
+                logging.error(f"Command timed out after {timeout:g}s and was killed: {command}")
+                raise RuntimeError(timeout_error(command, timeout))
+        if process.returncode != 0:
+            logging.error(f"Command failed: {command}. Error: {stderr.decode().strip()}")
+            raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr.decode().strip())
+        return stdout.decode().strip()
+
+    async def _run_on_worker(self, command, timeout):
+        # The az worker pool blocks like run_arm does, and kills a timed-out worker itself
+        async with self._limit():
+            try:
+                returncode, stdout, stderr = await asyncio.to_thread(run_command, command, timeout)
+            except subprocess.TimeoutExpired:
+                record_timeout(command_kind(command))
+                logging.error(f"Command timed out after {timeout:g}s and was killed: {command}")
+                raise RuntimeError(timeout_error(command, timeout))
+        if returncode != 0:
+            logging.error(f"Command failed: {command}. Error: {stderr.strip()}")
+            raise subprocess.CalledProcessError(returncode, command, stdout, stderr.strip())
+        return stdout.strip()
+
+    @staticmethod
+    async def _kill(process):
+        # Same escalation as az.kill_process_group, without blocking the event loop
+        for sig, wait in ((signal.SIGTERM, KILL_GRACE), (signal.SIGKILL, None)):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                pass
+            try:
+                await asyncio.wait_for(process.wait(), wait)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+    async def run_arm(self, fn, *args):
+        # In-process ARM calls block, so they run on worker threads under the same concurrency limit
+        async with self._limit():
+            return await asyncio.to_thread(fn, *args)
+
+    async def list_locks(self, subscription: str) -> List[ScopeLock]:
+        # One call returns the subscription, resource group and resource level locks together
+        if auth_mode() != 'az':
+            return [parse_lock(subscription, raw) for raw in await self.run_arm(arm.list_locks, subscription_id_for(subscription))]
+        output = await self.run_az_command(['az', 'lock', 'list', '--subscription', subscription, '-o', 'json'])
+        return [parse_lock(subscription, raw) for raw in json_loads(output or '[]')]
+
+    async def delete_lock(self, lock: ScopeLock) -> Tuple[ScopeLock, bool, str]:
+        try:
+            if auth_mode() != 'az':
+                await self.run_arm(arm.delete_lock, lock.id)
+            else:
+                await self.run_az_command(['az', 'lock', 'delete', '--ids', lock.id])
+            return lock, True, f"[green]✅ Deleted scope lock '{lock.name}' for {lock.describe()}[/green]"
+        except Exception as e:
+            return lock, False, f"[red]❌ Failed to delete scope lock '{lock.name}' for {lock.describe()}: {str(e)}[/red]"
+
+    async def create_lock(self, lock: ScopeLock) -> Tuple[ScopeLock, bool, str]:
+        command = ['az', 'lock', 'create', '--name', lock.name, '--lock-type', lock.level,
+                   '--subscription', lock.subscription]
+        if lock.resource:
+            command += ['--resource', lock.resource]
+        elif lock.resource_group:
+            command += ['--resource-group', lock.resource_group]
+        if lock.notes:
+            command += ['--notes', lock.notes]
+        try:
+            if auth_mode() != 'az':
+                await self.run_arm(arm.create_lock, lock_scope_id(lock), lock.name, lock.level, lock.notes)
+            else:
+                await self.run_az_command(command)
+            return lock, True, f"[green]✅ Restored scope lock '{lock.name}' for {lock.describe()}[/green]"
+        except Exception as e:
+            return lock, False, f"[red]❌ Failed to restore scope lock '{lock.name}' for {lock.describe()}: {str(e)}[/red]"
+
+    async def remove_subscription_locks(self, subscription: str,
+                                        wanted: Optional[List[ScopeLock]]) -> List[Tuple[ScopeLock, bool, str]]:
+        existing = await self.list_locks(subscription)
+        results = []
+        if wanted is None:
+            targets = [lock for lock in existing if self._discoverable(subscription, lock)]
+        else:
+            by_key = {lock.key(): lock for lock in existing}
+            targets = []
+            for lock in wanted:
+                if lock.key() in by_key:
+                    targets.append(by_key[lock.key()])
+                else:
+                    results.append((lock, True, f"[yellow]⚠️ Scope lock '{lock.name}' does not exist for {lock.describe()}[/yellow]"))
+        results.extend(await asyncio.gather(*(self.delete_lock(lock) for lock in targets)))
+        return results
+
+    def _covers(self, subscription: str, lock: ScopeLock) -> bool:
+        if self.resource_groups is None:
+            return True
+        # Locks on the group itself and on resources inside it, such as one on a snapshot, both block its deletes
+        return lock.scope != 'subscription' and lock.resource_group.lower() in self.resource_groups.get(subscription, set())
+
+    def _discoverable(self, subscription: str, lock: ScopeLock) -> bool:
+        return lock.level == 'CanNotDelete' and self._covers(subscription, lock)
+
+    async def find_locks(self, subscriptions: List[str]) -> List[Tuple[str, List[ScopeLock], Optional[str]]]:
+        # Lists without removing anything, so callers can unlock one scope at a time later
+        async def find(subscription):
+            try:
+                return subscription, [lock for lock in await self.list_locks(subscription)
+                                      if self._discoverable(subscription, lock)], None
+            except Exception as e:
+                logging.error(f"Failed to list scope locks in subscription {subscription}: {str(e)}")
+                return subscription, [], str(e)
+
+        return await asyncio.gather(*(find(subscription) for subscription in subscriptions))
+
+    async def remove_locks(self, locks: List[ScopeLock]) -> List[Tuple[ScopeLock, bool, str]]:
+        results = await asyncio.gather(*(self.delete_lock(lock) for lock in locks))
+        self.record_state('delete', results)
+        return results
+
+    async def restore_locks(self, locks: List[ScopeLock]) -> List[Tuple[ScopeLock, bool, str]]:
+        # The locks were removed by this process moments ago, so they are recreated without re-listing
+        results = await asyncio.gather(*(self.create_lock(lock) for lock in locks))
+        self.record_state('restore', results)
+        return results
+
+    async def restore_subscription_locks(self, subscription: str,
+                                         wanted: List[ScopeLock]) -> List[Tuple[ScopeLock, bool, str]]:
+        existing = {lock.key() for lock in await self.list_locks(subscription)}
+        results = []
+        missing = []
+        for lock in wanted:
+            if lock.key() in existing:
+                results.append((lock, True, f"[yellow]⚠️ Scope lock '{lock.name}' already exists for {lock.describe()}[/yellow]"))
+            else:
+                missing.append(lock)
+        results.extend(await asyncio.gather(*(self.create_lock(lock) for lock in missing)))
+        return results
+
+    async def _process_subscription(self, subscription: str, action: str,
+                                    wanted: Optional[List[ScopeLock]]) -> Tuple[str, List[Tuple[ScopeLock, bool, str]], Optional[str]]:
+        try:
+            if action == 'delete':
+                return subscription, await self.remove_subscription_locks(subscription, wanted), None
+            return subscription, await self.restore_subscription_locks(subscription, wanted or []), None
+        except Exception as e:
+            logging.error(f"Failed to {action} scope locks in subscription {subscription}: {str(e)}")
+            return subscription, [], str(e)
+
+    async def run(self, action: str, subscriptions: Optional[List[str]] = None):
+        if action not in ('delete', 'restore'):
+            raise ValueError(f"Invalid scope lock action '{action}'")
+
+        if self.config is not None:
+            plan = {sub: locks for sub, locks in self.config.items() if not subscriptions or sub in subscriptions}
+        elif action == 'restore':
+            with _state_lock:
+                plan = group_by_subscription(load_removed_locks(self.state_file)) if os.path.isfile(self.state_file) else {}
+            if subscriptions:
+                plan = {sub: locks for sub, locks in plan.items() if sub in subscriptions}
+        else:
+            plan = {sub: None for sub in subscriptions or []}
+        return await self.apply(action, plan)
+
+    async def apply(self, action: str, plan: Dict[str, Optional[List[ScopeLock]]]):
+        # All subscriptions run at once; every command carries --subscription so no global 'az account set' is needed
+        outcomes = await asyncio.gather(*(self._process_subscription(sub, action, wanted) for sub, wanted in plan.items()))
+        self.record_state(action, [result for _, results, _ in outcomes for result in results])
+        return outcomes
+
+    def record_state(self, action: str, results: List[Tuple[ScopeLock, bool, str]]) -> None:
+        if action == 'delete':
+            removed = [lock for lock, success, _ in results if success and lock.id]
+            if removed:
+                save_removed_locks(removed, self.state_file)
+        else:
+            forget_removed_locks([lock for lock, success, _ in results if success], self.state_file)
+
+
+def summarise_outcomes(outcomes):
+    summary: Dict[str, Dict[str, int]] = {}
+    detailed_errors: Dict[str, List[Tuple[str, str, str]]] = {}
+    messages: List[str] = []
+    for subscription, results, error in outcomes:
+        summary[subscription] = {"Processed": 0, "Succeeded": 0, "Failed": 0}
+        if error:
+            messages.append(f"[red]❌ Failed to process subscription '{subscription}': {error}[/red]")
+            summary[subscription]["Failed"] += 1
+            detailed_errors.setdefault(subscription, []).append((subscription, "-", error))
+            continue
+
+        for lock, success, message in results:
+            summary[subscription]["Processed"] += 1
+            messages.append(message)
+            if success:
+                summary[subscription]["Succeeded"] += 1
+            else:
+                summary[subscription]["Failed"] += 1
+                detailed_errors.setdefault(subscription, []).append((lock.target, lock.name, message))
+    return summary, detailed_errors, messages
@@ -0,0 +1,110 @@
+import logging
+import time
+import traceback
+from typing import Callable, List, NamedTuple
+
+from .export import result_row, validation_row
+from .profiling import stage_profile
+from .results import new_results, record
+
+MAX_WORKERS = 10
+
+
+class Stage(NamedTuple):
+    name: str
+    run: Callable
+    # Stages marked always still run after an earlier stage failed or a shutdown was requested
+    always: bool = False
+
+
+class RunContext:
+    def __init__(self, snapshot_ids=None, subscription_names=None, max_workers=MAX_WORKERS, shutdown=None, **options):
+        self.snapshot_ids = list(snapshot_ids or [])
+        self.subscription_names = subscription_names or {}
+        self.max_workers = max_workers
+        self.shutdown = shutdown
+        self.options = options
+        self.results = new_results()
+        self.checked = []
+        self.valid_snapshots = []
+        self.removed_locks = []
+        self.vms = []
+        self.created = []
+        self.create_failures = []
+        self.create_skipped = []
+        self.create_reused = []
+        # (vm, snapshot name) pairs left to create after the naming planner, None when it did not run
+        self.create_plan = None
+        # Snapshot name -> (subscription ID, resource group, submit time) of each accepted create, and
+        # seconds until it was seen Succeeded
+        self.create_started = {}
+        self.ready_times = {}
+        # CopyJobs of the copy stage once it has run, and the per-route lanes they ran in
+        self.copies = []
+        self.copy_lanes = None
+        self.timings = {}
+        self.failed_stage = None
+        # Previous validation results and per-RG listings used to skip unchanged snapshots
+        self.validation_state = None
+        self.listings = {}
+        # SnapshotDetails by snapshot ID, captured by the existence check
+        self.details = {}
+        # Optional ResultWriters that receive each row as soon as it is recorded
+        self.result_writer = None
+        self.validation_writer = None
+        # Optional RunHistory that receives every recorded item
+        self.history = None
+
+    @property
+    def interrupted(self):
+        return bool(self.shutdown and self.shutdown.requested)
+
+    def record(self, subscription_name, status, snapshot_name, error=None, details=None):
+        record(self.results, subscription_name, status, snapshot_name, error)
+        if self.result_writer:
+            self.result_writer.write(result_row(subscription_name, status, snapshot_name, error, details))
+        if self.history:
+            self.history.add(subscription_name, status, snapshot_name, error, details)
+
+    def record_create(self, subscription_name, vm_name, snapshot_name, failure, status=None):
+        # 'reused' and 'skipped' are existing snapshots the naming planner found for this VM and CHG
+        status = status or ("created" if snapshot_name else "failed")
+        if status == "skipped":
+            self.create_skipped.append(f"{vm_name}: {failure}")
+        elif snapshot_name:
+            self.created.append(snapshot_name)
+            if status == "reused":
+                self.create_reused.append(snapshot_name)
+        else:
+            self.create_failures.append(failure)
+        if self.history:
+            self.history.add(subscription_name, status, snapshot_name or vm_name, failure)
+
+    def record_check(self, snapshot_id, status, error, details=None):
+        self.checked.append((snapshot_id, status, error))
+        if details is not None:
+            self.details[snapshot_id] = details
+        if self.validation_writer:
+            self.validation_writer.write(validation_row(snapshot_id, status, error, details))
+
+
+def run_pipeline(ctx: RunContext, stages: List[Stage]) -> RunContext:
+    error = None
+    for stage in stages:
+        if (error or ctx.interrupted) and not stage.always:
+            logging.info(f"Skipping stage '{stage.name}'")
+            continue
+        started = time.time()
+        try:
+            with stage_profile(stage.name):
+                stage.run(ctx)
+        except Exception as e:
+            logging.error(f"Stage '{stage.name}' failed: {str(e)}\n{traceback.format_exc()}")
+            if error is None:
+                error = e
+                ctx.failed_stage = stage.name
+        finally:
+            ctx.timings[stage.name] = time.time() - started
+    if error is not None:
+        raise error
+    return ctx
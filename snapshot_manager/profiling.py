@@ -0,0 +1,168 @@
+import cProfile
+import contextlib
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_MODES = ('cprofile', 'py-spy')
+# Seconds between samples of every thread's stack for the collapsed flamegraph output
+SAMPLE_INTERVAL = 0.005
+# Frames kept per sampled stack, counted from the outermost one
+MAX_STACK_DEPTH = 80
+
+_active = None
+
+
+class StageTiming:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.wall = 0.0
+        self.cpu = 0.0
+        # CPU of reaped child processes, i.e. the az commands
+        self.children_cpu = 0.0
+
+
+def process_times():
+    times = os.times()
+    return time.process_time(), times.children_user + times.children_system
+
+
+def frame_label(frame):
+    code = frame.f_code
+    # ';' separates frames in the collapsed format; the count follows the last space, so spaces are fine
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+def collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels[-MAX_STACK_DEPTH:]))
+
+
+class Profiler:
+    # cProfile per stage for the thread that runs the pipeline, plus an all-thread stack sampler,
+    # because the az calls, rendering and lock handling happen on worker threads cProfile cannot see
+    def __init__(self, directory, mode='cprofile'):
+        self.directory = directory
+        self.mode = mode
+        self.timings = []
+        self.stack = []
+        self.samples = {}
+        self._profiles = {}
+        self._stop = threading.Event()
+        self._sampler = None
+        self.thread = None
+
+    def __enter__(self):
+        global _active
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.get_ident()
+        if self.mode == 'cprofile':
+            self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+            self._sampler.start()
+        else:
+            logging.info(f"Profiling with py-spy: attach with 'py-spy record --pid {os.getpid()}'")
+        _active = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _active
+        _active = None
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join()
+        self.write()
+        return False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        timing = StageTiming(name)
+        cpu, children_cpu = process_times()
+        started = time.perf_counter()
+        # Nested stages pause the outer profile, so every pstats file holds only its own stage
+        if self.stack and self.stack[-1].name in self._profiles:
+            self._profiles[self.stack[-1].name].disable()
+        profile = None
+        if self.mode == 'cprofile':
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        self.stack.append(timing)
+        try:
+            yield timing
+        finally:
+            if profile:
+                profile.disable()
+            self.stack.pop()
+            if self.stack and self.stack[-1].name in self._profiles:
+                self._profiles[self.stack[-1].name].enable()
+            timing.wall = time.perf_counter() - started
+            end_cpu, end_children_cpu = process_times()
+            timing.cpu = end_cpu - cpu
+            timing.children_cpu = end_children_cpu - children_cpu
+            self.timings.append(timing)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        # Wall time only, for stages that run on other threads while the pipeline thread goes on;
+        # process CPU would mix in everything else running at the time
+        timing = StageTiming(name)
+        started = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.wall = time.perf_counter() - started
+            self.timings.append(timing)
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            stage = self.stack[-1] if self.stack else None
+            label = stage.name if stage else 'outside-stages'
+            counts = self.samples.setdefault(label, Counter())
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                counts[f"{names.get(thread_id, thread_id)};{collapse(frame)}"] += 1
+
+    def write(self):
+        for name, profile in self._profiles.items():
+            profile.dump_stats(os.path.join(self.directory, f"{name}.pstats"))
+            with open(os.path.join(self.directory, f"{name}.txt"), 'w') as f:
+                stats = pstats.Stats(profile, stream=f)
+                stats.sort_stats('cumulative').print_stats(40)
+        if self.samples:
+            with open(os.path.join(self.directory, 'run.collapsed'), 'w') as combined:
+                for stage, counts in self.samples.items():
+                    with open(os.path.join(self.directory, f"{stage}.collapsed"), 'w') as f:
+                        for stack, count in counts.most_common():
+                            f.write(f"{stack} {count}\n")
+                            combined.write(f"{stage};{stack} {count}\n")
+        # Stage boundaries, also for lining up a py-spy recording of the same process
+        with open(os.path.join(self.directory, 'stages.tsv'), 'w') as f:
+            f.write("stage\tstarted\twall_s\tcpu_s\tsubprocess_cpu_s\n")
+            for timing in self.timings:
+                f.write(f"{timing.name}\t{timing.started:.3f}\t{timing.wall:.3f}\t{timing.cpu:.3f}\t{timing.children_cpu:.3f}\n")
+
+
+def stage_profile(name):
+    # Stages nest on the thread that started the profiler; on other threads, such as the lock hooks of
+    # run_batches, only their wall time is recorded and the sampler covers the rest
+    if _active and _active.thread == threading.get_ident():
+        return _active.stage(name)
+    if _active:
+        return _active.timed(name)
+    return contextlib.nullcontext()
+
+
+def profile_directory(base=None):
+    return os.path.join(base or os.getcwd(), f"profile_{time.strftime('%Y%m%d%H%M%S')}")
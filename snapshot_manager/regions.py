@@ -0,0 +1,40 @@
+import re
+
+from .ids import split_id
+
+# Public Azure regions, recognised as a token of a resource group name such as az-core-nonprod-01-esns-dev-eastus-rg-01
+AZURE_REGIONS = frozenset((
+    'eastus', 'eastus2', 'westus', 'westus2', 'westus3', 'centralus', 'northcentralus', 'southcentralus',
+    'westcentralus', 'canadacentral', 'canadaeast', 'brazilsouth', 'mexicocentral', 'northeurope', 'westeurope',
+    'uksouth', 'ukwest', 'francecentral', 'germanywestcentral', 'italynorth', 'norwayeast', 'polandcentral',
+    'spaincentral', 'swedencentral', 'switzerlandnorth', 'eastasia', 'southeastasia', 'japaneast', 'japanwest',
+    'koreacentral', 'australiaeast', 'australiasoutheast', 'centralindia', 'southindia', 'uaenorth',
+    'qatarcentral', 'israelcentral', 'southafricanorth',
+))
+UNKNOWN_REGION = 'unknown'
+
+
+def normalise_region(region):
+    # 'East US 2' as shown by the portal is eastus2 to ARM
+    return region.strip().lower().replace(' ', '')
+
+
+def region_from_name(resource_group):
+    for token in re.split(r'[-_.]', resource_group.lower()):
+        if token in AZURE_REGIONS:
+            return token
+    return None
+
+
+def region_of(snapshot_id, details=None):
+    # The location from the snapshot's show wins; before validation the resource group name is all there is
+    snapshot = details.get(snapshot_id) if details else None
+    if snapshot is not None and snapshot.location:
+        return normalise_region(snapshot.location)
+    return region_from_name(split_id(snapshot_id)[1]) or UNKNOWN_REGION
+
+
+def lane_key(region, operation=None):
+    # Operations other than the command's own, such as cross-region copies, get lanes of their own
+    # ('copy:westus>eastus'), so they never share a cap with the deletes of either region
+    return f"{operation}:{region}" if operation else region
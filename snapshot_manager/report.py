@@ -0,0 +1,256 @@
+import re
+from collections import Counter
+
+from .console import get_console
+from .export import VALIDATION_COLUMNS, ResultWriter, result_rows, validation_row
+
+# Sections longer than this are summarised by error code instead of printed row by row; the results file has every row
+DETAIL_ROWS_LIMIT = 200
+ERROR_CODE = re.compile(r'\((\w+)\)')
+
+
+def error_kind(error):
+    match = ERROR_CODE.search(error or '')
+    return match.group(1) if match else (error or 'Unknown error')[:80]
+
+
+def print_entries(console, entries, style):
+    # entries are bare names or (name, error) pairs
+    if len(entries) <= DETAIL_ROWS_LIMIT:
+        for entry in entries:
+            console.print(f"  [{style}]• {entry if isinstance(entry, str) else ': '.join(entry)}[/{style}]")
+        return
+    kinds = Counter(error_kind(entry[1]) for entry in entries if not isinstance(entry, str))
+    named = sum(1 for entry in entries if isinstance(entry, str))
+    if named:
+        console.print(f"  [{style}]• {named} snapshots[/{style}]")
+    for kind, count in kinds.most_common():
+        console.print(f"  [{style}]• {count} × {kind}[/{style}]")
+
+
+def print_summary(results, usage=None):
+    from rich.table import Table
+
+    table = Table(title="Summary")
+    table.add_column("Subscription", style="cyan")
+    table.add_column("Valid Snapshots", style="green")
+    table.add_column("Non-existent Snapshots", style="yellow")
+    table.add_column("Deleted Snapshots", style="blue")
+    table.add_column("Failed Deletions", style="red")
+    if usage is not None:
+        table.add_column("Reclaimable GB", style="magenta")
+        table.add_column("Est. Monthly Cost", style="magenta")
+
+    total_valid = 0
+    total_non_existent = 0
+    total_deleted = 0
+    total_failed = 0
+    total_gb = 0
+    total_cost = 0.0
+
+    for subscription_name, data in results.items():
+        valid_count = len(data['valid'])
+        non_existent_count = len(data['non-existent'])
+        deleted_count = len(data['deleted'])
+        failed_count = len(data['failed'])
+        row = [subscription_name, str(valid_count), str(non_existent_count), str(deleted_count), str(failed_count)]
+        if usage is not None:
+            _, size_gb, cost = usage.get(subscription_name, (0, 0, 0.0))
+            row += [str(size_gb), f"${cost:,.2f}"]
+            total_gb += size_gb
+            total_cost += cost
+        table.add_row(*row)
+
+        total_valid += valid_count
+        total_non_existent += non_existent_count
+        total_deleted += deleted_count
+        total_failed += failed_count
+
+    totals = ["Total", str(total_valid), str(total_non_existent), str(total_deleted), str(total_failed)]
+    if usage is not None:
+        totals += [str(total_gb), f"${total_cost:,.2f}"]
+    table.add_row(*totals, style="bold")
+
+    get_console().print(table)
+
+
+def print_usage_by_resource_group(usage, limit=10):
+    from rich.table import Table
+
+    if not usage:
+        return
+    # Largest cost first, so cleanup can start where it saves the most
+    ranked = sorted(usage.items(), key=lambda entry: -entry[1][2])
+    table = Table(title="Reclaimable by Resource Group")
+    table.add_column("Subscription", style="cyan")
+    table.add_column("Resource Group", style="cyan")
+    table.add_column("Snapshots", style="green")
+    table.add_column("GB", style="magenta")
+    table.add_column("Est. Monthly Cost", style="magenta")
+    for (subscription_name, resource_group), (count, size_gb, cost) in ranked[:limit]:
+        table.add_row(subscription_name, resource_group, str(count), str(size_gb), f"${cost:,.2f}")
+    if len(ranked) > limit:
+        rest = ranked[limit:]
+        table.add_row("…", f"{len(rest)} more", str(sum(entry[1][0] for entry in rest)),
+                      str(sum(entry[1][1] for entry in rest)), f"${sum(entry[1][2] for entry in rest):,.2f}", style="dim")
+    get_console().print(table)
+
+
+def print_lane_latency(lanes, title="Requests by Region", label="Region", minimum=2):
+    from rich.table import Table
+
+    latency = lanes.latency()
+    # A single region needs no breakdown; the caps are what matters with several
+    if len(latency) < minimum:
+        return
+    table = Table(title=title)
+    table.add_column(label, style="cyan")
+    table.add_column("Requests", style="green")
+    table.add_column("Cap")
+    table.add_column("p50 s", style="magenta")
+    table.add_column("p90 s", style="magenta")
+    table.add_column("Max s", style="magenta")
+    for lane, (requests, p50, p90, slowest) in latency.items():
+        limit = lanes.limit(lane)
+        table.add_row(lane, str(requests), str(limit) if limit else '-', f"{p50:.2f}", f"{p90:.2f}", f"{slowest:.2f}")
+    get_console().print(table)
+
+
+def print_copy_summary(results, jobs, location):
+    from rich.table import Table
+
+    from .copies import format_bytes, format_duration
+
+    console = get_console()
+    statuses = ('copied', 'copying', 'failed', 'cancelled')
+    table = Table(title=f"Copies to {location}")
+    table.add_column("Subscription", style="cyan")
+    table.add_column("Copied", style="green")
+    table.add_column("Still Copying", style="yellow")
+    table.add_column("Failed", style="red")
+    table.add_column("Not Started", style="yellow")
+    for subscription_name, data in results.items():
+        table.add_row(subscription_name, *(str(len(data[status])) for status in statuses))
+    table.add_row("Total", *(str(sum(len(data[status]) for data in results.values())) for status in statuses), style="bold")
+    console.print(table)
+
+    copied = [job for job in jobs if job.status == 'copied']
+    if copied:
+        # Disk size, as reported on the copies; an incremental copy moves only the used blocks
+        total = sum(job.size_bytes or 0 for job in copied)
+        elapsed = max(job.finished for job in copied) - min(job.started for job in copied)
+        console.print(f"[magenta]{format_bytes(total)} copied in {format_duration(elapsed)} "
+                      f"({format_bytes(total / max(elapsed, 1))}/s)[/magenta]")
+    for status, title, style in (('failed', "Failed Copies", "red"), ('copying', "Still Copying in Azure", "yellow"),
+                                 ('cancelled', "Not Started", "yellow")):
+        entries = [(job.name, job.error or '') for job in jobs if job.status == status]
+        if entries:
+            console.print(f"\n[bold]{title}:[/bold]")
+            print_entries(console, entries, style)
+
+
+def print_detailed_errors(results):
+    console = get_console()
+    console.print("\n[bold red]Detailed Error Information:[/bold red]")
+
+    for subscription_name, data in results.items():
+        if data['non-existent'] or data['invalid'] or data['failed'] or data['error'] or data['cancelled'] or data['unknown']:
+            console.print(f"\n[cyan]Subscription: {subscription_name}[/cyan]")
+
+            if data['non-existent']:
+                console.print("\n[bold]Non-existent Snapshots:[/bold]")
+                print_entries(console, data['non-existent'], "yellow")
+
+            if data['invalid']:
+                console.print("\n[bold]Invalid Snapshots:[/bold]")
+                print_entries(console, data['invalid'], "red")
+
+            if data['failed']:
+                console.print("\n[bold]Failed Deletions:[/bold]")
+                print_entries(console, data['failed'], "red")
+
+            if data['error']:
+                console.print("\n[bold]Errors:[/bold]")
+                print_entries(console, data['error'], "red")
+
+            if data['cancelled'] or data['unknown']:
+                console.print("\n[bold]Interrupted:[/bold]")
+                print_entries(console, data['cancelled'] + data['unknown'], "yellow")
+
+
+def export_to_csv(results, filename):
+    with ResultWriter(filename) as writer:
+        for row in result_rows(results):
+            writer.write(row)
+    get_console().print(f"[green]✔ Results exported to {filename}[/green]")
+
+
+def write_validation_csv(checked, filename, details=None):
+    with ResultWriter(filename, VALIDATION_COLUMNS) as writer:
+        for snapshot_id, status, error in checked:
+            writer.write(validation_row(snapshot_id, status, error, (details or {}).get(snapshot_id)))
+    get_console().print(f"[green]Results saved to {filename}[/green]")
+
+
+def print_invalid_snapshots(checked):
+    from rich.table import Table
+
+    invalid = [(snapshot_id, error) for snapshot_id, status, error in checked if status != 'valid']
+    if len(invalid) > DETAIL_ROWS_LIMIT:
+        # A table of thousands of rows takes longer to lay out than the run took; the validation file has them all
+        print_entries(get_console(), invalid, "dim")
+        return
+    table = Table(show_header=True, header_style="bold yellow")
+    table.add_column("Snapshot ID", style="dim")
+    table.add_column("Error", style="dim")
+    for snapshot_id, error in invalid:
+        table.add_row(snapshot_id, error)
+    get_console().print(table)
+
+
+def print_lock_summary(summary, detailed_errors):
+    from tabulate import tabulate
+
+    console = get_console()
+    console.print("\nSummary")
+    console.print("-------")
+    table_data = [
+        [sub, data["Processed"], data["Succeeded"], data["Failed"]]
+        for sub, data in summary.items()
+    ]
+    console.print(tabulate(table_data, headers=["Subscription", "Processed", "Succeeded", "Failed"], tablefmt="grid"))
+
+    if detailed_errors:
+        console.print("\nDetailed Error Information:")
+        for sub, errors in detailed_errors.items():
+            console.print(f"\nSubscription: {sub}")
+            console.print("Failed Operations:")
+            for target, lock, error in errors:
+                console.print(f"  • {target} - {lock}: {error}")
+
+
+def print_profile_summary(timings, directory):
+    from rich.table import Table
+
+    # Repeated stages, such as the per resource group lock removal, are summed
+    totals = {}
+    for timing in timings:
+        entry = totals.setdefault(timing.name, [0, 0.0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += timing.wall
+        entry[2] += timing.cpu
+        entry[3] += timing.children_cpu
+    table = Table(title="Profile")
+    table.add_column("Stage", style="cyan")
+    table.add_column("Runs")
+    table.add_column("Wall s", style="green")
+    table.add_column("Python CPU s", style="yellow")
+    table.add_column("az CPU s", style="blue")
+    table.add_column("Waiting", style="magenta")
+    for name, (runs, wall, cpu, children_cpu) in totals.items():
+        # Time neither this process nor its children spent on a CPU: ARM latency, lock waits, sleeps
+        waiting = max(wall - cpu - children_cpu, 0) / wall if wall else 0
+        table.add_row(name, str(runs), f"{wall:.2f}", f"{cpu:.2f}", f"{children_cpu:.2f}", f"{waiting:.0%}")
+    console = get_console()
+    console.print(table)
+    console.print(f"[green]✔ Profile written to {directory}[/green]")
@@ -0,0 +1,27 @@
+from collections import defaultdict
+
+# Statuses recorded as a bare snapshot name; every other status carries (snapshot_name, error)
+NAME_ONLY_STATUSES = ('valid', 'deleted', 'non-existent')
+
+
+def new_results():
+    return defaultdict(lambda: defaultdict(list))
+
+
+def record(results, subscription_name, status, snapshot_name, error=None):
+    entry = snapshot_name if status in NAME_ONLY_STATUSES else (snapshot_name, error or '')
+    results[subscription_name or "Unknown"][status].append(entry)
+
+
+def merge_results(results, other):
+    for subscription_name, data in other.items():
+        for status, entries in data.items():
+            results[subscription_name][status].extend(entries)
+    return results
+
+
+def split_snapshot_id(snapshot_id, subscription_names):
+    parts = snapshot_id.split('/')
+    if len(parts) < 3:
+        return "Unknown", parts[-1]
+    return subscription_names.get(parts[2], parts[2]), parts[-1]
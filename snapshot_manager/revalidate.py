@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import arm
+from .auth import auth_mode
+from .az import run_az_json
+from .ids import canonical_id, resource_group_key, split_id
+
+VALIDATION_STATE_FILE = 'snapshot_validation_state.json'
+STATE_MAX_AGE = 7 * 24 * 3600
+# Only outcomes a listing can confirm are reused; errors and malformed IDs are always re-checked
+REUSABLE_STATUSES = ('valid', 'non-existent')
+
+
+def load_validation_state(path=VALIDATION_STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable validation state {path}: {str(e)}")
+        return {}
+    cutoff = time.time() - STATE_MAX_AGE
+    return {key: entry for key, entry in state.items() if entry.get('checked_at', 0) >= cutoff}
+
+
+def save_validation_state(state, path=VALIDATION_STATE_FILE):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def list_resource_group(subscription_id, resource_group):
+    # uniqueId changes when a snapshot is deleted and recreated under the same name, timeCreated catches the rest
+    if auth_mode() != 'az':
+        snapshots = arm.list_snapshots(subscription_id, resource_group)
+    else:
+        snapshots = run_az_json(['az', 'snapshot', 'list', '--resource-group', resource_group, '--subscription', subscription_id,
+                                 '--query', '[].{id:id, uniqueId:uniqueId, timeCreated:timeCreated}', '-o', 'json'])
+    return {canonical_id(snapshot['id']): [snapshot.get('uniqueId'), snapshot.get('timeCreated')]
+            for snapshot in snapshots or []}
+
+
+def list_resource_groups(snapshot_ids, max_workers):
+    groups = set()
+    for snapshot_id in snapshot_ids:
+        subscription_id, resource_group, _ = split_id(snapshot_id)
+        if subscription_id:
+            groups.add(resource_group_key(subscription_id, resource_group))
+
+    def list_group(group):
+        try:
+            return group, list_resource_group(*group)
+        except (RuntimeError, arm.ArmError) as e:
+            logging.warning(f"Listing snapshots in {group[0]}/{group[1]} failed: {str(e)}")
+            return group, None
+
+    # A resource group whose listing failed is left out, so its snapshots get a full check
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return {group: listed for group, listed in executor.map(list_group, groups) if listed is not None}
+
+
+def fingerprint(snapshot_id, listings):
+    # Returns (listed, fingerprint); a listed RG without the snapshot gives fingerprint None
+    subscription_id, resource_group, _ = split_id(snapshot_id)
+    listing = listings.get(resource_group_key(subscription_id, resource_group)) if subscription_id else None
+    if listing is None:
+        return False, None
+    return True, listing.get(canonical_id(snapshot_id))
+
+
+def plan_revalidation(snapshot_ids, state, listings):
+    reuse, recheck = [], []
+    for snapshot_id in snapshot_ids:
+        listed, current = fingerprint(snapshot_id, listings)
+        previous = state.get(canonical_id(snapshot_id))
+        if listed and previous and previous['status'] in REUSABLE_STATUSES and previous.get('fingerprint') == current:
+            reuse.append((snapshot_id, previous))
+        else:
+            recheck.append(snapshot_id)
+    return reuse, recheck
+
+
+def update_validation_state(state, checked, listings, details=None):
+    now = time.time()
+    for snapshot_id, status, error in checked:
+        key = canonical_id(snapshot_id)
+        listed, current = fingerprint(snapshot_id, listings)
+        if listed and status in REUSABLE_STATUSES:
+            # Size and cost details are kept so a reused result still counts towards the reclaimable totals
+            snapshot = (details or {}).get(snapshot_id)
+            state[key] = {'status': status, 'error': error, 'fingerprint': current, 'checked_at': now,
+                          'details': list(snapshot) if snapshot else None}
+        else:
+            state.pop(key, None)
+    return state
@@ -0,0 +1,241 @@
+import logging
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from statistics import median
+
+from .shutdown import DRAIN_TIMEOUT
+
+# Assumed duration of one item until the first ones have finished
+DEFAULT_ITEM_SECONDS = 30
+# Threads for the batch start/done hooks (lock removal and restore), which run beside the dispatch loop
+HOOK_WORKERS = 8
+
+
+def percentile(values, pct):
+    # Nearest rank, so every reported value is one that was measured
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+
+class Batch:
+    def __init__(self, key, items, context=None, lane=None):
+        self.key = key
+        self.items = list(items)
+        self.context = context
+        self.lane = lane
+        self.pending = deque(self.items)
+        self.in_flight = 0
+        self.priority = None
+        # False while the start hook runs; nothing of the batch is dispatched before it is done
+        self.ready = True
+
+    @property
+    def finished(self):
+        return not self.pending and not self.in_flight
+
+    def prioritise(self, priority):
+        # Highest priority first; the batch itself ranks by its best item
+        ranked = sorted(self.pending, key=priority, reverse=True)
+        self.pending = deque(ranked)
+        self.priority = priority(ranked[0]) if ranked else None
+
+
+class Deadline:
+    # Projects the finish of a new dispatch from the median duration of recent items, keeping `reserve`
+    # seconds free for the work that has to happen after the last one; `reserve` may be a callable, so it
+    # can follow how much of that work is pending
+    def __init__(self, at, reserve=0, estimate=DEFAULT_ITEM_SECONDS):
+        self.at = at
+        self.reserve = reserve
+        self.estimate = estimate
+        self.durations = deque(maxlen=50)
+        self.reached = False
+
+    def observe(self, seconds):
+        self.durations.append(seconds)
+
+    def expected_duration(self):
+        return median(self.durations) if self.durations else self.estimate
+
+    def reserved(self):
+        return self.reserve() if callable(self.reserve) else self.reserve
+
+    def allows_dispatch(self):
+        if not self.reached and time.time() + self.expected_duration() + self.reserved() > self.at:
+            self.reached = True
+        return not self.reached
+
+
+class Lanes:
+    # In-flight caps and latencies per lane (a region, or an operation between regions); free slots go to
+    # the lane with the least in flight, so a slow region cannot take the workers of a fast one
+    def __init__(self, limits=None, default_limit=None):
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.in_flight = Counter()
+        self.durations = defaultdict(list)
+
+    def limit(self, lane):
+        return self.limits.get(lane, self.default_limit)
+
+    def has_room(self, lane):
+        limit = self.limit(lane)
+        return limit is None or self.in_flight[lane] < limit
+
+    def started(self, lane):
+        self.in_flight[lane] += 1
+
+    def finished(self, lane, seconds):
+        self.in_flight[lane] -= 1
+        self.durations[lane].append(seconds)
+
+    def latency(self):
+        # {lane: (requests, p50, p90, max)} in seconds
+        return {lane: (len(durations), percentile(durations, 50), percentile(durations, 90), max(durations))
+                for lane, durations in sorted(self.durations.items()) if durations}
+
+
+def run_batches(executor, fn, batches, on_result, shutdown, max_in_flight, max_batches,
+                on_batch_start=None, on_batch_done=None, drain_timeout=DRAIN_TIMEOUT, priority=None, deadline=None,
+                lanes=None):
+    # Keeps at most max_batches batches open and closes each one as soon as its last item finishes.
+    # Once shutdown is requested nothing new is dispatched, in-flight work gets drain_timeout to finish, and
+    # (undispatched, unfinished) is returned.
+    # on_batch_start and on_batch_done run on their own threads, so unlocking or relocking one batch never
+    # holds up dispatch to the others; a batch's items wait for its start hook, and every done hook has
+    # finished when this returns.
+    # With a priority, batches open in order of their best item and the best pending item of the open
+    # batches is dispatched next; with a deadline, nothing new starts once it would finish too late.
+    # With lanes, max_batches applies to each lane and dispatch respects the lanes' caps.
+    if priority:
+        for batch in batches:
+            batch.prioritise(priority)
+        batches = sorted(batches, key=lambda batch: batch.priority, reverse=True)
+    waiting = deque(batches)
+    active = []
+    in_flight = {}
+    started = {}
+    opening = {}
+    closing = {}
+    hooks = ThreadPoolExecutor(max_workers=HOOK_WORKERS, thread_name_prefix='batch-hooks') \
+        if on_batch_start or on_batch_done else None
+
+    def can_dispatch():
+        return not shutdown.requested and (deadline is None or deadline.allows_dispatch())
+
+    def hook_done(future, batch, name):
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(f"Batch {name} hook failed for {batch.key}: {str(e)}")
+
+    def close(batch):
+        active.remove(batch)
+        if on_batch_done:
+            closing[hooks.submit(on_batch_done, batch)] = batch
+
+    def opened(future):
+        batch = opening.pop(future)
+        hook_done(future, batch, 'start')
+        batch.ready = True
+
+    def finish(future):
+        batch, item = in_flight.pop(future)
+        batch.in_flight -= 1
+        duration = time.time() - started.pop(future)
+        if deadline:
+            deadline.observe(duration)
+        if lanes:
+            lanes.finished(batch.lane, duration)
+        on_result(item, future)
+        if batch.finished:
+            close(batch)
+
+    def submit(batch):
+        item = batch.pending.popleft()
+        batch.in_flight += 1
+        future = executor.submit(fn, item)
+        in_flight[future] = (batch, item)
+        started[future] = time.time()
+        if lanes:
+            lanes.started(batch.lane)
+
+    def open_batches():
+        if not lanes:
+            while len(active) < max_batches and waiting and can_dispatch():
+                yield waiting.popleft()
+            return
+        open_per_lane = Counter(batch.lane for batch in active)
+        for batch in list(waiting):
+            if not can_dispatch():
+                return
+            if open_per_lane[batch.lane] < max_batches:
+                open_per_lane[batch.lane] += 1
+                waiting.remove(batch)
+                yield batch
+
+    def dispatchable(batch):
+        return batch.ready and batch.pending and (lanes is None or lanes.has_room(batch.lane))
+
+    try:
+        while True:
+            for batch in open_batches():
+                active.append(batch)
+                if on_batch_start:
+                    batch.ready = False
+                    opening[hooks.submit(on_batch_start, batch)] = batch
+
+            if priority:
+                while len(in_flight) < max_in_flight and can_dispatch():
+                    ready = [batch for batch in active if dispatchable(batch)]
+                    if not ready:
+                        break
+                    submit(max(ready, key=lambda batch: priority(batch.pending[0])))
+            else:
+                # Round-robin over the open batches so every one of them gets a share of the workers,
+                # least busy lanes first so a slot freed in a fast region goes back to it
+                dispatched = True
+                while dispatched and len(in_flight) < max_in_flight and can_dispatch():
+                    dispatched = False
+                    for batch in sorted(active, key=lambda batch: lanes.in_flight[batch.lane]) if lanes else active:
+                        if dispatchable(batch) and len(in_flight) < max_in_flight:
+                            submit(batch)
+                            dispatched = True
+
+            if not in_flight and not opening:
+                if not can_dispatch() or not waiting:
+                    break
+                continue
+
+            if shutdown.requested:
+                done, not_done = wait(in_flight, timeout=drain_timeout)
+                for future in done:
+                    finish(future)
+                for future in not_done:
+                    future.cancel()
+                break
+
+            done, _ = wait(list(in_flight) + list(opening), timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in opening:
+                    opened(future)
+                else:
+                    finish(future)
+
+        undispatched = [item for batch in active + list(waiting) for item in batch.pending]
+        unfinished = [item for _, item in in_flight.values()]
+        # Batches cut short by a shutdown are still closed, once their start hook is through;
+        # batches never opened need no closing
+        wait(opening)
+        for future in list(opening):
+            opened(future)
+        for batch in list(active):
+            close(batch)
+        wait(closing)
+        for future, batch in closing.items():
+            hook_done(future, batch, 'done')
+        return undispatched, unfinished
+    finally:
+        if hooks:
+            hooks.shutdown(wait=True)
@@ -0,0 +1,41 @@
+import logging
+import signal
+import threading
+
+DRAIN_TIMEOUT = 60
+
+
+class ShutdownSignal:
+    def __init__(self, console=None, signals=(signal.SIGINT, signal.SIGTERM)):
+        self.console = console
+        self.signals = signals
+        self.event = threading.Event()
+        self._previous = {}
+
+    @property
+    def requested(self):
+        return self.event.is_set()
+
+    def __enter__(self):
+        for signum in self.signals:
+            self._previous[signum] = signal.signal(signum, self._handle)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for signum, handler in self._previous.items():
+            signal.signal(signum, handler)
+        self._previous = {}
+        return False
+
+    def _handle(self, signum, frame):
+        name = signal.Signals(signum).name
+        logging.warning(f"Received {name}; stopping dispatch of new work")
+        # A second signal gets the previous handler, so a drain or relock that hangs can still be force-quit
+        for restored, handler in self._previous.items():
+            signal.signal(restored, handler)
+        if self.console:
+            self.console.print(f"[yellow]{name} received. No new deletions will be started; "
+                               f"waiting up to {DRAIN_TIMEOUT}s for in-flight work before restoring locks. "
+                               f"Press Ctrl-C again to quit at once, leaving removed locks in "
+                               f"removed_scope_locks.json for 'locks restore'.[/yellow]")
+        self.event.set()
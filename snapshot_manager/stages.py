@@ -0,0 +1,966 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from . import arm
+from .auth import auth_mode
+from .az import is_retryable, run_az_command, run_az_json
+from .console import get_console
+from .copies import (COPIES_IN_FLIGHT, COPY_POLL_INTERVAL, COPY_TIMEOUT, AzureCopies, SimulatedCopies, format_bytes,
+                     format_duration, plan_copies, run_copies)
+from .events import EventStream, emit
+from .ids import canonical_id, resource_group_key, split_id
+from .locks import ScopeLockManager, group_by_subscription
+from .pipeline import Stage
+from .profiling import stage_profile
+from .regions import region_of
+from .report import (export_to_csv, print_copy_summary, print_detailed_errors, print_lane_latency, print_summary,
+                     print_usage_by_resource_group, write_validation_csv)
+from .results import split_snapshot_id
+from .scheduler import Batch, Deadline, Lanes, percentile, run_batches
+from .shutdown import ShutdownSignal
+from .usage import (DETAILS_LIST_QUERY, DETAILS_QUERY, SnapshotDetails, aggregate_usage, parse_details, snapshot_priority,
+                    usage_by_subscription)
+
+VALIDATION_RESULTS_FILE = "snapshot_validation_results.csv"
+# Resource groups whose locks are removed at the same time during deletion
+RGS_IN_FLIGHT = 4
+# Seconds kept free before --deadline for restoring the locks still removed: a fixed part for the relock
+# stage and report, plus one round per max_workers locks, since they are restored that many at a time
+RELOCK_BASE_SECONDS = 30
+RELOCK_ROUND_SECONDS = 20
+# Created snapshots are listed once per resource group per round until they settle or this many seconds pass
+VERIFY_TIMEOUT = 900
+VERIFY_POLL_INTERVAL = 10
+SETTLED_STATES = ('Succeeded', 'Failed', 'Canceled')
+# What follows the CHG in a name this tool created: the timestamp and the number --on-existing suffix may add,
+# so region copies (<name>_eastus2) are never taken for a VM's own snapshot
+PLANNED_SUFFIX = re.compile(r'\d{14}(_\d+)?')
+
+
+def is_not_found(error):
+    # ResourceGroupNotFound says "could not be found" rather than "was not found"
+    return any(marker in error for marker in ("ResourceNotFound", "ResourceGroupNotFound", "was not found",
+                                              "could not be found"))
+
+
+def is_scope_locked(error):
+    return "ScopeLocked" in error
+
+
+def names_existing(error):
+    # Answers ARM only gives for a snapshot that is there; a 403 or a throttled call says nothing either way
+    return any(code in error for code in ("ScopeLocked", "Conflict", "OperationNotAllowed"))
+
+
+def invalid_snapshot(snapshot_id):
+    logging.error(f"Invalid snapshot ID format: {snapshot_id}")
+    emit("invalid", snapshot=snapshot_id)
+    return None, "invalid", "Invalid snapshot ID format", None
+
+
+def check_result(snapshot_id, result, subscription_names):
+    subscription_name, snapshot_name = split_snapshot_id(snapshot_id, subscription_names)
+    details = None
+    if not result.startswith("Error:"):
+        status, error = "valid", ""
+        details = parse_details(result)
+    elif is_not_found(result):
+        status, error = "non-existent", result
+    else:
+        status, error = "error", result
+    emit(status, subscription=subscription_name, snapshot=snapshot_name)
+    return subscription_name, status, error, details
+
+
+def check_snapshot(snapshot_id, subscription_names):
+    try:
+        if len(snapshot_id.split('/')) < 9:
+            return invalid_snapshot(snapshot_id)
+        if auth_mode() != 'az':
+            result = arm.show_snapshot(snapshot_id)
+        else:
+            # Only the size and cost fields are requested back, which keeps az from serialising the whole resource
+            result = run_az_command(['az', 'snapshot', 'show', '--ids', snapshot_id, '--query', DETAILS_QUERY, '-o', 'json'])
+        return check_result(snapshot_id, result, subscription_names)
+    except Exception as e:
+        logging.error(f"Error processing snapshot {snapshot_id}: {str(e)}")
+        emit("error", snapshot=snapshot_id)
+        return None, "error", str(e), None
+
+
+def check_snapshots(snapshot_ids, subscription_names):
+    # One ARM $batch call for the whole chunk; malformed IDs never leave the process
+    well_formed = [snapshot_id for snapshot_id in snapshot_ids if len(snapshot_id.split('/')) >= 9]
+    results = dict(zip(well_formed, arm.show_snapshots(well_formed))) if well_formed else {}
+    return [check_result(snapshot_id, results[snapshot_id], subscription_names) if snapshot_id in results
+            else invalid_snapshot(snapshot_id) for snapshot_id in snapshot_ids]
+
+
+def delete_outcome(snapshot_id, subscription_name, result):
+    success = not result.startswith("Error:")
+    emit("deleted" if success else "failed", subscription=subscription_name, snapshot=snapshot_id.split('/')[-1])
+    return success, "" if success else result
+
+
+def delete_snapshot(snapshot_id, subscription_name=None):
+    if auth_mode() != 'az':
+        result = arm.delete_snapshot(snapshot_id)
+    else:
+        result = run_az_command(['az', 'snapshot', 'delete', '--ids', snapshot_id])
+    return delete_outcome(snapshot_id, subscription_name, result)
+
+
+def delete_snapshots(snapshot_ids, subscription_names):
+    return [delete_outcome(snapshot_id, split_snapshot_id(snapshot_id, subscription_names)[0], result)
+            for snapshot_id, result in zip(snapshot_ids, arm.delete_snapshots(list(snapshot_ids)))]
+
+
+def delete_directly(snapshot_ids):
+    # One raw result per snapshot, without emitting anything. A 204 comes back as a not-found error, since
+    # nothing else tells a missing snapshot apart here
+    if auth_mode() != 'az':
+        if len(snapshot_ids) > 1:
+            return arm.delete_snapshots(list(snapshot_ids), no_content=arm.NOTHING_DELETED)
+        return [arm.delete_snapshot(snapshot_ids[0], no_content=arm.NOTHING_DELETED)]
+    return [run_az_command(['az', 'snapshot', 'delete', '--ids', snapshot_id]) for snapshot_id in snapshot_ids]
+
+
+def optimistic_outcome(snapshot_id, result, subscription_names):
+    # 'failed' is a snapshot known to exist that could not be deleted; 'error' leaves its existence
+    # unknown, as a failed show does in the regular pipeline
+    subscription_name, snapshot_name = split_snapshot_id(snapshot_id, subscription_names)
+    if not result.startswith("Error:"):
+        status, error = "deleted", ""
+    elif is_not_found(result):
+        status, error = "non-existent", result
+    elif names_existing(result):
+        status, error = "failed", result
+    else:
+        status, error = "error", result
+    emit(status, subscription=subscription_name, snapshot=snapshot_name)
+    return status, error
+
+
+def relock_reserve(ctx):
+    return lambda: RELOCK_BASE_SECONDS + RELOCK_ROUND_SECONDS * -(-len(ctx.removed_locks) // max(1, ctx.max_workers))
+
+
+def batch_size(ctx):
+    # ARM $batch is only reachable from the in-process backends; az runs one operation per process
+    if auth_mode() == 'az':
+        return 1
+    return max(1, ctx.options.get('batch_size') or arm.BATCH_SIZE)
+
+
+def subscription_key(snapshot_id):
+    parts = snapshot_id.split('/')
+    return parts[2].lower() if len(parts) > 2 else ''
+
+
+def chunked(items, size, key=lambda item: None):
+    # Chunks never mix keys, e.g. subscriptions, since one batch call is made with one tenant's token
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return [tuple(group[index:index + size]) for group in groups.values() for index in range(0, len(group), size)]
+
+
+def per_item(on_result):
+    # Fans a chunk's future back out into one completed future per item, so on_result stays per snapshot
+    def on_chunk(chunk, future):
+        try:
+            results, error = future.result(), None
+        except Exception as e:
+            results, error = None, e
+        for index, item in enumerate(chunk):
+            item_future = Future()
+            if error is not None:
+                item_future.set_exception(error)
+            else:
+                item_future.set_result(results[index])
+            on_result(item, item_future)
+    return on_chunk
+
+
+def flatten(items):
+    return [item for entry in items for item in (entry if isinstance(entry, tuple) else (entry,))]
+
+
+def plan_resource_group_batches(snapshot_ids, size=1, priority=None, details=None):
+    if priority:
+        # Ranked before chunking so each $batch request carries snapshots of similar priority
+        snapshot_ids = sorted(snapshot_ids, key=priority, reverse=True)
+    batches = {}
+    for snapshot_id in snapshot_ids:
+        parts = snapshot_id.split('/')
+        # Keyed case-insensitively so one RG spelled two ways is only unlocked once
+        batches.setdefault(resource_group_key(parts[2], parts[4]), []).append(snapshot_id)
+    # Largest first, so the long batches are not the ones left running alone at the end
+    return [Batch(key, chunked(snapshot_ids, size) if size > 1 else snapshot_ids, lane=region_of(snapshot_ids[0], details))
+            for key, snapshot_ids in sorted(batches.items(), key=lambda entry: -len(entry[1]))]
+
+
+def plan_region_batches(snapshot_ids, size=1, details=None):
+    regions = {}
+    for snapshot_id in snapshot_ids:
+        regions.setdefault(region_of(snapshot_id, details), []).append(snapshot_id)
+    return [Batch(region, chunked(snapshot_ids, size, subscription_key) if size > 1 else snapshot_ids, lane=region)
+            for region, snapshot_ids in regions.items()]
+
+
+def region_lanes(ctx):
+    # Caps from --region-workers; without them the regions still share the workers evenly
+    limits = dict(ctx.options.get('region_workers') or [])
+    return Lanes(limits, limits.pop(None, None))
+
+
+def max_in_flight(ctx, batches):
+    # The executor runs queued work in submission order whatever its region, so with several regions
+    # only as much is dispatched as there are workers and a slow region cannot queue ahead of a fast one
+    return ctx.max_workers if len({batch.lane for batch in batches}) > 1 else ctx.max_workers * 2
+
+
+def record_leftovers(ctx, undispatched, unfinished, reason="shutdown requested"):
+    # Leftovers may be $batch chunks, which are recorded per snapshot
+    undispatched, unfinished = flatten(undispatched), flatten(unfinished)
+    for snapshot_id in undispatched:
+        subscription_name, snapshot_name = split_snapshot_id(snapshot_id, ctx.subscription_names)
+        ctx.record(subscription_name, "cancelled", snapshot_name, f"Not started: {reason}")
+    for snapshot_id in unfinished:
+        subscription_name, snapshot_name = split_snapshot_id(snapshot_id, ctx.subscription_names)
+        ctx.record(subscription_name, "unknown", snapshot_name, "Still running when shutdown drain timed out")
+
+
+def shutdown_executor(ctx, executor):
+    # Threads stuck past the drain timeout are abandoned rather than joined
+    executor.shutdown(wait=not ctx.interrupted, cancel_futures=True)
+
+
+def validate(ctx):
+    def on_result(snapshot_id, future):
+        try:
+            subscription_name, status, error, details = future.result()
+        except Exception as e:
+            # A $batch chunk that raised as a whole; each of its snapshots still counts towards the progress
+            logging.error(f"Error processing snapshot {snapshot_id}: {str(e)}")
+            emit("error", snapshot=snapshot_id)
+            subscription_name, status, error, details = None, "error", str(e), None
+        ctx.record_check(snapshot_id, status, error, details)
+        if status == "invalid" or subscription_name is None:
+            ctx.record("Unknown", status, snapshot_id, error)
+            return
+        ctx.record(subscription_name, status, snapshot_id.split('/')[-1], error, details)
+        if status == "valid":
+            ctx.valid_snapshots.append(snapshot_id)
+
+    size = batch_size(ctx)
+    batches = plan_region_batches(ctx.snapshot_ids, size, ctx.details)
+    lanes = region_lanes(ctx)
+    with EventStream("[cyan]Pre-validating snapshots...", len(ctx.snapshot_ids), stage="pre-validation", console=get_console()):
+        executor = ThreadPoolExecutor(max_workers=ctx.max_workers)
+        try:
+            if size > 1:
+                fn, handler = (lambda chunk: check_snapshots(chunk, ctx.subscription_names)), per_item(on_result)
+            else:
+                fn, handler = (lambda snapshot_id: check_snapshot(snapshot_id, ctx.subscription_names)), on_result
+            record_leftovers(ctx, *run_batches(executor, fn, batches, handler, ctx.shutdown or ShutdownSignal(),
+                                               max_in_flight(ctx, batches), len(batches), lanes=lanes))
+        finally:
+            shutdown_executor(ctx, executor)
+    print_lane_latency(lanes)
+
+
+def revalidate(ctx):
+    from .revalidate import list_resource_groups, load_validation_state, plan_revalidation
+
+    state_file = ctx.options.get('state_file')
+    if not state_file:
+        return
+    console = get_console()
+    ctx.validation_state = load_validation_state(state_file)
+    ctx.listings = list_resource_groups(ctx.snapshot_ids, ctx.max_workers)
+    reuse, recheck = plan_revalidation(ctx.snapshot_ids, {} if ctx.options.get('full') else ctx.validation_state,
+                                       ctx.listings)
+    for snapshot_id, previous in reuse:
+        subscription_name, snapshot_name = split_snapshot_id(snapshot_id, ctx.subscription_names)
+        details = SnapshotDetails(*previous['details']) if previous.get('details') else None
+        ctx.record_check(snapshot_id, previous['status'], previous['error'], details)
+        ctx.record(subscription_name, previous['status'], snapshot_name, previous['error'], details)
+        if previous['status'] == "valid":
+            ctx.valid_snapshots.append(snapshot_id)
+    if reuse:
+        console.print(f"[green]✔ {len(reuse)} snapshots unchanged since the last run, re-checking {len(recheck)}.[/green]")
+    ctx.snapshot_ids = recheck
+
+
+def persist_validation_state(ctx):
+    from .revalidate import save_validation_state, update_validation_state
+
+    if ctx.validation_state is None:
+        return
+    update_validation_state(ctx.validation_state, ctx.checked, ctx.listings, ctx.details)
+    save_validation_state(ctx.validation_state, ctx.options['state_file'])
+
+
+def delete(ctx):
+    console = get_console()
+    if not ctx.valid_snapshots:
+        console.print("[yellow]No valid snapshots found. Skipping scope lock removal and deletion process.[/yellow]")
+        return
+
+    size = batch_size(ctx)
+    priority = snapshot_priority(ctx.options.get('priority'), ctx.details)
+    deadline = Deadline(ctx.options['deadline'], relock_reserve(ctx)) if ctx.options.get('deadline') else None
+    batches = plan_resource_group_batches(ctx.valid_snapshots, size, priority, ctx.details)
+    lanes = region_lanes(ctx)
+    console.print(f"[green]✔ Found {len(batches)} resource groups from valid snapshot list.[/green]")
+    resource_groups = {}
+    for subscription_id, resource_group in (batch.key for batch in batches):
+        resource_groups.setdefault(subscription_id, set()).add(resource_group)
+
+    # One lock listing per subscription up front; each batch then only touches its own resource group's locks
+    manager = ScopeLockManager(resource_groups=resource_groups, max_concurrency=ctx.max_workers)
+    locks_by_group = {}
+    for subscription_id, locks, error in asyncio.run(manager.find_locks(list(resource_groups))):
+        if error:
+            console.print(f"[red]Failed to list scope locks in subscription '{subscription_id}': {error}[/red]")
+        for lock in locks:
+            locks_by_group.setdefault(resource_group_key(subscription_id, lock.resource_group), []).append(lock)
+    for batch in batches:
+        batch.context = locks_by_group.get(batch.key, [])
+
+    # The unlock and relock hooks run on their own threads, several at a time
+    counts = {'removed': 0, 'restored': 0}
+    counts_lock = threading.Lock()
+
+    def unlock_batch(batch):
+        if not batch.context:
+            return
+        with stage_profile('lock-removal'):
+            outcomes = asyncio.run(manager.remove_locks(batch.context))
+        for lock, success, message in outcomes:
+            console.print(message)
+            if success:
+                ctx.removed_locks.append(lock)
+                with counts_lock:
+                    counts['removed'] += 1
+
+    def relock_batch(batch):
+        # Anything that fails here stays in ctx.removed_locks for the relock stage to retry
+        removed = [lock for lock in batch.context if lock in ctx.removed_locks]
+        if not removed:
+            return
+        with stage_profile('lock-restore'):
+            outcomes = asyncio.run(manager.restore_locks(removed))
+        for lock, success, message in outcomes:
+            console.print(message)
+            if success:
+                ctx.removed_locks.remove(lock)
+                with counts_lock:
+                    counts['restored'] += 1
+
+    def delete_one(snapshot_id):
+        return delete_snapshot(snapshot_id, split_snapshot_id(snapshot_id, ctx.subscription_names)[0])
+
+    def delete_chunk(chunk):
+        return delete_snapshots(chunk, ctx.subscription_names)
+
+    def on_result(snapshot_id, future):
+        subscription_name, snapshot_name = split_snapshot_id(snapshot_id, ctx.subscription_names)
+        try:
+            success, error = future.result()
+            if success:
+                ctx.record(subscription_name, "deleted", snapshot_name, details=ctx.details.get(snapshot_id))
+            else:
+                ctx.record(subscription_name, "failed", snapshot_name, error or "Deletion failed", ctx.details.get(snapshot_id))
+        except Exception as e:
+            logging.error(f"Error deleting snapshot {snapshot_id}: {str(e)}")
+            emit("error", subscription=subscription_name, snapshot=snapshot_name)
+            ctx.record("Unknown", "error", snapshot_id, str(e))
+
+    with EventStream("[cyan]Deleting valid snapshots...", len(ctx.valid_snapshots), stage="deletion", console=console):
+        executor = ThreadPoolExecutor(max_workers=ctx.max_workers)
+        try:
+            fn, handler = (delete_chunk, per_item(on_result)) if size > 1 else (delete_one, on_result)
+            undispatched, unfinished = run_batches(executor, fn, batches, handler, ctx.shutdown or ShutdownSignal(),
+                                                   max_in_flight(ctx, batches), ctx.options.get('rg_parallel') or RGS_IN_FLIGHT,
+                                                   unlock_batch, relock_batch, priority=priority, deadline=deadline,
+                                                   lanes=lanes)
+        finally:
+            shutdown_executor(ctx, executor)
+    print_lane_latency(lanes)
+    if deadline and deadline.reached and not ctx.interrupted:
+        record_leftovers(ctx, undispatched, unfinished, "deadline reached")
+        console.print(f"[yellow]⚠️ Deadline reached: {len(flatten(undispatched))} snapshots were not started.[/yellow]")
+    else:
+        record_leftovers(ctx, undispatched, unfinished)
+    console.print(f"[green]✔ Removed {counts['removed']} scope locks and restored {counts['restored']} as their resource groups finished.[/green]")
+
+
+def list_snapshot_details(subscription_id, resource_group):
+    # {canonical ID: SnapshotDetails} for every snapshot in the resource group, from one listing
+    if auth_mode() != 'az':
+        snapshots = arm.list_snapshots(subscription_id, resource_group)
+    else:
+        snapshots = run_az_json(['az', 'snapshot', 'list', '--resource-group', resource_group, '--subscription', subscription_id,
+                                 '--query', DETAILS_LIST_QUERY, '-o', 'json'])
+    return {canonical_id(snapshot['id']): parse_details(snapshot) for snapshot in snapshots or []}
+
+
+def check_listings(ctx, snapshot_ids):
+    # One listing per resource group stands in for the shows: what a group lacks is recorded as non-existent
+    # without a delete, which az needs since its delete succeeds on a missing snapshot, and the rest get the
+    # sizes --priority and the summary work from
+    console = get_console()
+    groups = {resource_group_key(*split_id(snapshot_id)[:2]) for snapshot_id in snapshot_ids}
+    listings = list_groups(groups, ctx.max_workers, list_snapshot_details)
+    present = []
+    for snapshot_id in snapshot_ids:
+        listing = listings.get(resource_group_key(*split_id(snapshot_id)[:2]))
+        if listing is None:
+            present.append(snapshot_id)
+        elif canonical_id(snapshot_id) in listing:
+            ctx.details[snapshot_id] = listing[canonical_id(snapshot_id)]
+            present.append(snapshot_id)
+        else:
+            subscription_name, snapshot_name = split_snapshot_id(snapshot_id, ctx.subscription_names)
+            ctx.record(subscription_name, "non-existent", snapshot_name, "Not in its resource group's snapshot listing")
+    unlisted = sum(listing is None for listing in listings.values())
+    if unlisted:
+        console.print(f"[yellow]⚠️ {unlisted} resource groups could not be listed; their snapshots are deleted without "
+                      f"sizes, so they count as size 0 for --priority and the summary.[/yellow]")
+    return present
+
+
+def optimistic_delete(ctx):
+    # Deletes without a show per snapshot: a 404 or 204 means non-existent, and a ScopeLocked answer unlocks
+    # that resource group on demand and retries, so only the groups that are actually locked get unlocked
+    console = get_console()
+    snapshot_ids = []
+    for snapshot_id in ctx.snapshot_ids:
+        if len(snapshot_id.split('/')) < 9:
+            _, status, error, _ = invalid_snapshot(snapshot_id)
+            ctx.record("Unknown", status, snapshot_id, error)
+        else:
+            snapshot_ids.append(snapshot_id)
+    if snapshot_ids:
+        snapshot_ids = check_listings(ctx, snapshot_ids)
+    if not snapshot_ids:
+        return
+
+    size = batch_size(ctx)
+    priority = snapshot_priority(ctx.options.get('priority'), ctx.details)
+    deadline = Deadline(ctx.options['deadline'], relock_reserve(ctx)) if ctx.options.get('deadline') else None
+    batches = plan_resource_group_batches(snapshot_ids, size, priority, ctx.details)
+    lanes = region_lanes(ctx)
+    unlocked = {}
+    subscription_locks = {}
+    guards = {}
+    guards_lock = threading.Lock()
+
+    def guard(key):
+        with guards_lock:
+            return guards.setdefault(key, threading.Lock())
+
+    def locks_in(subscription_id):
+        # Listed once per subscription, on the first ScopeLocked answer from it
+        with guard(('subscription', subscription_id)):
+            if subscription_id not in subscription_locks:
+                manager = ScopeLockManager(max_concurrency=ctx.max_workers)
+                [(_, locks, error)] = asyncio.run(manager.find_locks([subscription_id]))
+                if error:
+                    console.print(f"[red]Failed to list scope locks in subscription '{subscription_id}': {error}[/red]")
+                subscription_locks[subscription_id] = locks
+            return subscription_locks[subscription_id]
+
+    def unlock_group(key):
+        # The first locked delete of a group removes its locks, the others wait for it and retry
+        with guard(key):
+            if key in unlocked:
+                return
+            # Resource-level locks inside the group block the delete as well
+            locks = [lock for lock in locks_in(key[0])
+                     if lock.scope != 'subscription' and resource_group_key(key[0], lock.resource_group) == key]
+            removed = []
+            if locks:
+                manager = ScopeLockManager(max_concurrency=ctx.max_workers)
+                for lock, success, message in asyncio.run(manager.remove_locks(locks)):
+                    console.print(message)
+                    if success:
+                        removed.append(lock)
+                        ctx.removed_locks.append(lock)
+            unlocked[key] = removed
+
+    def delete_item(item):
+        chunk = item if isinstance(item, tuple) else (item,)
+        results = delete_directly(chunk)
+        locked = [index for index, result in enumerate(results) if is_scope_locked(result)]
+        if locked:
+            parts = chunk[0].split('/')
+            unlock_group(resource_group_key(parts[2], parts[4]))
+            for index, result in zip(locked, delete_directly([chunk[index] for index in locked])):
+                results[index] = result
+        outcomes = [optimistic_outcome(snapshot_id, result, ctx.subscription_names)
+                    for snapshot_id, result in zip(chunk, results)]
+        return outcomes if isinstance(item, tuple) else outcomes[0]
+
+    def relock_batch(batch):
+        # Anything that fails here stays in ctx.removed_locks for the relock stage to retry
+        removed = [lock for lock in unlocked.get(batch.key, []) if lock in ctx.removed_locks]
+        if not removed:
+            return
+        manager = ScopeLockManager(max_concurrency=ctx.max_workers)
+        for lock, success, message in asyncio.run(manager.restore_locks(removed)):
+            console.print(message)
+            if success:
+                ctx.removed_locks.remove(lock)
+
+    def on_result(snapshot_id, future):
+        subscription_name, snapshot_name = split_snapshot_id(snapshot_id, ctx.subscription_names)
+        details = ctx.details.get(snapshot_id)
+        try:
+            status, error = future.result()
+        except Exception as e:
+            logging.error(f"Error deleting snapshot {snapshot_id}: {str(e)}")
+            emit("error", subscription=subscription_name, snapshot=snapshot_name)
+            ctx.record("Unknown", "error", snapshot_id, str(e))
+            return
+        if status in ("non-existent", "error"):
+            ctx.record(subscription_name, status, snapshot_name, error)
+            return
+        # Deleted, or refused in a way only an existing snapshot is; recorded like a validated one
+        ctx.valid_snapshots.append(snapshot_id)
+        ctx.record(subscription_name, "valid", snapshot_name, details=details)
+        ctx.record(subscription_name, status, snapshot_name, error, details)
+
+    with EventStream("[cyan]Deleting snapshots...", len(snapshot_ids), stage="deletion", console=console):
+        executor = ThreadPoolExecutor(max_workers=ctx.max_workers)
+        try:
+            undispatched, unfinished = run_batches(executor, delete_item, batches, per_item(on_result) if size > 1 else on_result,
+                                                   ctx.shutdown or ShutdownSignal(), max_in_flight(ctx, batches), len(batches),
+                                                   on_batch_done=relock_batch, priority=priority, deadline=deadline,
+                                                   lanes=lanes)
+        finally:
+            shutdown_executor(ctx, executor)
+    print_lane_latency(lanes)
+    if deadline and deadline.reached and not ctx.interrupted:
+        record_leftovers(ctx, undispatched, unfinished, "deadline reached")
+        console.print(f"[yellow]⚠️ Deadline reached: {len(flatten(undispatched))} snapshots were not started.[/yellow]")
+    else:
+        record_leftovers(ctx, undispatched, unfinished)
+    locked_groups = sum(1 for removed in unlocked.values() if removed)
+    console.print(f"[green]✔ {locked_groups} of {len(batches)} resource groups needed unlocking.[/green]")
+
+
+def relock(ctx):
+    if not ctx.removed_locks:
+        return
+    console = get_console()
+    console.print("[yellow]Restoring removed scope locks...[/yellow]")
+    manager = ScopeLockManager(max_concurrency=ctx.max_workers)
+    outcomes = asyncio.run(manager.apply('restore', group_by_subscription(ctx.removed_locks)))
+    restored_locks = 0
+    for subscription_id, results, error in outcomes:
+        if error:
+            console.print(f"[red]Failed to restore scope locks in subscription '{subscription_id}': {error}[/red]")
+        for lock, success, message in results:
+            console.print(message)
+            restored_locks += success
+    console.print(f"[green]✔ Restored {restored_locks} scope locks.[/green]")
+
+
+def report(ctx):
+    console = get_console()
+    # Reclaimable means found to exist, whether or not this run went on to delete it
+    usage = aggregate_usage(ctx.valid_snapshots, ctx.details, ctx.subscription_names)
+    if ctx.interrupted:
+        if ctx.result_writer:
+            ctx.result_writer.flush()
+            partial_filename = ctx.result_writer.filename
+        else:
+            partial_filename = f"partial_results_{time.strftime('%Y%m%d%H%M%S')}.csv"
+            export_to_csv(ctx.results, partial_filename)
+        print_summary(ctx.results, usage_by_subscription(usage) if usage else None)
+        console.print(f"[yellow]Run interrupted. Partial results written to {partial_filename}.[/yellow]")
+        return
+
+    print_summary(ctx.results, usage_by_subscription(usage) if usage else None)
+    print_usage_by_resource_group(usage)
+    print_detailed_errors(ctx.results)
+    retryable = sum(is_retryable(entry[1]) for data in ctx.results.values() for entry in data['failed'] + data['error'])
+    if retryable:
+        console.print(f"[yellow]⚠️ {retryable} failures were timeouts or throttling. Running the same list again "
+                      f"retries them; snapshots already deleted show as non-existent.[/yellow]")
+    if ctx.result_writer:
+        ctx.result_writer.flush()
+        if ctx.options.get('export'):
+            console.print(f"[green]✔ Results exported to {ctx.result_writer.filename}[/green]")
+    elif ctx.options.get('export'):
+        export_to_csv(ctx.results, ctx.options['export'])
+
+
+def validation_report(ctx):
+    console = get_console()
+    invalid_count = len(ctx.checked) - len(ctx.valid_snapshots)
+    console.print("\n[bold green]Validation Results:[/bold green]")
+    console.print(f"[green]Valid Snapshots: {len(ctx.valid_snapshots)}[/green]")
+    console.print(f"[red]Invalid Snapshots: {invalid_count}[/red]")
+    usage = aggregate_usage(ctx.valid_snapshots, ctx.details, ctx.subscription_names)
+    if usage:
+        size_gb = sum(totals[1] for totals in usage.values())
+        cost = sum(totals[2] for totals in usage.values())
+        console.print(f"[magenta]Reclaimable: {size_gb} GB, est. ${cost:,.2f}/month[/magenta]")
+        print_usage_by_resource_group(usage)
+    if ctx.validation_writer:
+        ctx.validation_writer.flush()
+        console.print(f"[green]Results saved to {ctx.validation_writer.filename}[/green]")
+    else:
+        write_validation_csv(ctx.checked, ctx.options.get('export') or VALIDATION_RESULTS_FILE, ctx.details)
+
+
+def snapshot_name_for(vm_name, chg_number, timestamp):
+    return f"RH_{vm_name}_{chg_number}_{timestamp}"
+
+
+def create_snapshot(vm, snapshot_name, log, no_wait=False, incremental=False):
+    # Returns (snapshot name, failure, resource group); no_wait returns once ARM accepts the create
+    resource_id, vm_name = vm
+    lines = [f"Processing VM: {vm_name}", f"Resource ID: {resource_id}"]
+    try:
+        parts = resource_id.split('/')
+        if len(parts) < 9:
+            lines.append(f"Failed to get subscription ID for VM: {vm_name}")
+            return None, f"{vm_name}: Failed to get subscription ID", None
+        lines.append(f"Subscription ID: {parts[2]}")
+
+        # One show returns both values, and --ids already pins the subscription
+        result = run_az_command(['az', 'vm', 'show', '--ids', resource_id, '--query',
+                                 '{resourceGroup:resourceGroup, diskId:storageProfile.osDisk.managedDisk.id}', '-o', 'json'])
+        if result.startswith("Error:"):
+            lines.append(f"Failed to get VM details: {result}")
+            return None, f"{vm_name}: Failed to get VM details", None
+        details = json.loads(result)
+        resource_group, disk_id = details.get('resourceGroup'), details.get('diskId')
+        lines.append(f"Resource group name: {resource_group}")
+        if not disk_id:
+            lines.append(f"Failed to get disk ID for VM: {vm_name}")
+            return None, f"{vm_name}: Failed to get disk ID", None
+
+        result = run_az_command(['az', 'snapshot', 'create', '--name', snapshot_name, '--resource-group', resource_group,
+                                 '--source', disk_id, '--subscription', parts[2], '-o', 'json']
+                                + (['--no-wait'] if no_wait else []) + (['--incremental', 'true'] if incremental else []))
+        if result.startswith("Error:"):
+            lines.append(f"Failed to create snapshot for VM: {vm_name}")
+            lines.append(result)
+            return None, f"{vm_name}: Failed to create snapshot", None
+
+        lines.append(f"Snapshot {'requested' if no_wait else 'created'}: {snapshot_name}")
+        lines.append(result)
+        return snapshot_name, None, (parts[2], resource_group)
+    finally:
+        log("\n".join(lines))
+
+
+def create(ctx):
+    log_lock = threading.Lock()
+
+    def log(message):
+        with log_lock, open(ctx.options['log_file'], "a") as f:
+            f.write(f"{message}\n")
+
+    def create_one(planned):
+        vm, snapshot_name = planned
+        started = time.time()
+        # CopyStart only copies incremental snapshots
+        snapshot_name, failure, resource_group = create_snapshot(vm, snapshot_name, log, ctx.options.get('no_wait'),
+                                                                 bool(ctx.options.get('copy_to')))
+        emit("created" if snapshot_name else "failed", vm=vm[1])
+        return snapshot_name, failure, resource_group, started
+
+    plan = ctx.create_plan
+    if plan is None:
+        plan = [(vm, snapshot_name_for(vm[1], ctx.options['chg_number'], ctx.options['timestamp'])) for vm in ctx.vms]
+    with EventStream("[cyan]Processing VMs...", len(plan), stage="create", console=get_console()):
+        with ThreadPoolExecutor(max_workers=ctx.max_workers) as executor:
+            for (vm, _), (snapshot_name, failure, resource_group, started) in zip(plan, executor.map(create_one, plan)):
+                ctx.record_create(split_snapshot_id(vm[0], ctx.subscription_names)[0], vm[1], snapshot_name, failure)
+                if snapshot_name:
+                    ctx.create_started[snapshot_name] = (*resource_group, started)
+
+
+def list_provisioning_states(subscription_id, resource_group):
+    # {lowercase name: (name, provisioningState)} for every snapshot in the resource group, from one listing
+    if auth_mode() != 'az':
+        snapshots = arm.list_snapshots(subscription_id, resource_group)
+    else:
+        snapshots = run_az_json(['az', 'snapshot', 'list', '--resource-group', resource_group, '--subscription', subscription_id,
+                                 '--query', '[].{name:name, provisioningState:provisioningState}', '-o', 'json'])
+    return {snapshot['name'].lower(): (snapshot['name'], snapshot.get('provisioningState')) for snapshot in snapshots or []}
+
+
+def list_groups(groups, max_workers, lister=None):
+    # {group: listing}, with None for a resource group whose listing failed
+    def list_group(group):
+        try:
+            return group, (lister or list_provisioning_states)(*group)
+        except Exception as e:
+            logging.warning(f"Listing snapshots in {group[0]}/{group[1]} failed: {str(e)}")
+            return group, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(list_group, groups))
+
+
+def plan_names(ctx):
+    # Existing names come from one listing per resource group instead of a failed create per collision;
+    # a VM that already has a snapshot for this CHG is handled by --on-existing, so reruns are idempotent
+    console = get_console()
+    policy = ctx.options.get('on_existing') or 'reuse'
+    chg_number, timestamp = ctx.options['chg_number'], ctx.options['timestamp']
+    groups = {resource_group_key(*split_id(vm[0])[:2]) for vm in ctx.vms if split_id(vm[0])[0]}
+    listings = list_groups(groups, ctx.max_workers)
+    planned = {}
+    ctx.create_plan = []
+    counts = {'reused': 0, 'skipped': 0, 'renamed': 0}
+    for vm in ctx.vms:
+        resource_id, vm_name = vm
+        snapshot_name = snapshot_name_for(vm_name, chg_number, timestamp)
+        subscription_id, resource_group, _ = split_id(resource_id)
+        group = resource_group_key(subscription_id, resource_group) if subscription_id else None
+        listing = listings.get(group)
+        if listing is None:
+            # Unlisted, so the create itself finds out about a collision as before
+            ctx.create_plan.append((vm, snapshot_name))
+            continue
+        taken = planned.setdefault(group, set())
+        prefix = snapshot_name_for(vm_name, chg_number, '').lower()
+        if policy == 'suffix':
+            base, number = snapshot_name, 2
+            while snapshot_name.lower() in listing or snapshot_name.lower() in taken:
+                snapshot_name, number = f"{base}_{number}", number + 1
+            counts['renamed'] += snapshot_name != base
+        else:
+            subscription_name = ctx.subscription_names.get(subscription_id, subscription_id)
+            existing = sorted(name for key, (name, _) in listing.items()
+                              if key.startswith(prefix) and PLANNED_SUFFIX.fullmatch(key[len(prefix):]))
+            if any(key.startswith(prefix) for key in taken):
+                # The same VM twice in the list: its snapshot is already planned
+                ctx.record_create(subscription_name, vm_name, snapshot_name, "Listed twice in the VM list", "skipped")
+                counts['skipped'] += 1
+                continue
+            if existing and policy == 'reuse':
+                # The newest one; the timestamp suffix sorts chronologically
+                ctx.record_create(subscription_name, vm_name, existing[-1], None, "reused")
+                ctx.create_started[existing[-1]] = (subscription_id, resource_group, None)
+                taken.add(existing[-1].lower())
+                counts['reused'] += 1
+                continue
+            if existing:
+                ctx.record_create(subscription_name, vm_name, existing[-1], f"Existing snapshot {existing[-1]}", "skipped")
+                counts['skipped'] += 1
+                continue
+        taken.add(snapshot_name.lower())
+        ctx.create_plan.append((vm, snapshot_name))
+    unlisted = sum(listing is None for listing in listings.values())
+    console.print(f"[green]✔ Checked existing snapshots in {len(listings) - unlisted} resource groups: "
+                  f"{len(ctx.create_plan)} to create, {counts['reused']} reused, {counts['skipped']} skipped, "
+                  f"{counts['renamed']} renamed.[/green]")
+    if unlisted:
+        console.print(f"[yellow]⚠️ {unlisted} resource groups could not be listed; their names were not checked.[/yellow]")
+
+
+def verify_creation(ctx):
+    # Confirms provisioningState == Succeeded with one listing per resource group per round rather than a show
+    # per snapshot, so creates can be fired with --no-wait and confirmed together at the end
+    pending = {}
+    for snapshot_name, (subscription_id, resource_group, started) in ctx.create_started.items():
+        pending.setdefault(resource_group_key(subscription_id, resource_group), {})[snapshot_name.lower()] = (snapshot_name, started)
+    if not pending:
+        return
+    console = get_console()
+    deadline = time.time() + (ctx.options.get('verify_timeout') or VERIFY_TIMEOUT)
+    states = {}
+    unconfirmed = {}
+
+    ready = 0
+
+    with EventStream("[cyan]Verifying created snapshots...", len(ctx.create_started), stage="verify", console=console):
+        while pending:
+            # A failed listing is retried next round
+            for group, listing in list_groups(list(pending), ctx.max_workers).items():
+                # Time to ready is measured up to this round, so it is exact to within the poll interval
+                polled_at = time.time()
+                for key, (snapshot_name, started) in list(pending[group].items()):
+                    state = (listing.get(key) or (None, None))[1] if listing is not None else None
+                    states[snapshot_name] = state or states.get(snapshot_name)
+                    if state not in SETTLED_STATES:
+                        continue
+                    del pending[group][key]
+                    if state == 'Succeeded':
+                        ready += 1
+                        # Reused snapshots existed before this run and have no time to ready
+                        if started is not None:
+                            ctx.ready_times[snapshot_name] = polled_at - started
+                        emit("ready", snapshot=snapshot_name)
+                    else:
+                        unconfirmed[snapshot_name] = f"provisioningState {state}"
+                        emit("failed", snapshot=snapshot_name)
+                if not pending[group]:
+                    del pending[group]
+            if not pending or ctx.interrupted or time.time() + VERIFY_POLL_INTERVAL > deadline:
+                break
+            if ctx.shutdown:
+                ctx.shutdown.event.wait(VERIFY_POLL_INTERVAL)
+            else:
+                time.sleep(VERIFY_POLL_INTERVAL)
+
+    for names in pending.values():
+        for snapshot_name, _ in names.values():
+            state = states.get(snapshot_name)
+            unconfirmed[snapshot_name] = f"still {state} when verification stopped" if state else "not listed in its resource group"
+    for snapshot_name, reason in unconfirmed.items():
+        subscription_id = ctx.create_started[snapshot_name][0]
+        ctx.created.remove(snapshot_name)
+        ctx.record_create(ctx.subscription_names.get(subscription_id, subscription_id), snapshot_name, None,
+                          f"{snapshot_name}: {reason}")
+
+    console.print(f"[green]✔ {ready} of {len(ctx.create_started)} snapshots ready.[/green]")
+    if ctx.ready_times:
+        times = list(ctx.ready_times.values())
+        console.print(f"[green]Time to ready: p50 {percentile(times, 50):.1f}s, p90 {percentile(times, 90):.1f}s, "
+                      f"p99 {percentile(times, 99):.1f}s, max {max(times):.1f}s[/green]")
+    if unconfirmed:
+        console.print(f"[yellow]⚠️ {len(unconfirmed)} snapshots did not reach Succeeded and are reported as failed.[/yellow]")
+
+
+def creation_report(ctx):
+    summary_file = ctx.options['summary_file']
+    with open(summary_file, "w") as f:
+        f.write("Snapshot Creation Summary\n")
+        f.write("========================\n\n")
+        f.write(f"Total VMs processed: {len(ctx.vms)}\n")
+        f.write(f"Successful snapshots: {len(ctx.created)}\n")
+        f.write(f"Failed snapshots: {len(ctx.create_failures)}\n")
+        if ctx.create_reused or ctx.create_skipped:
+            f.write(f"Existing snapshots reused: {len(ctx.create_reused)}, skipped: {len(ctx.create_skipped)}\n")
+        f.write("\n")
+
+        f.write("Successful snapshots:\n")
+        for snapshot in ctx.created:
+            f.write(f"- {snapshot}{' (existing)' if snapshot in ctx.create_reused else ''}\n")
+
+        if ctx.create_skipped:
+            f.write("\nSkipped VMs:\n")
+            for skipped in ctx.create_skipped:
+                f.write(f"- {skipped}\n")
+
+        f.write("\nFailed snapshots:\n")
+        for snapshot in ctx.create_failures:
+            f.write(f"- {snapshot}\n")
+
+        if ctx.ready_times:
+            times = list(ctx.ready_times.values())
+            f.write("\nTime to ready (seconds):\n")
+            for pct in (50, 90, 99):
+                f.write(f"- p{pct}: {percentile(times, pct):.1f}\n")
+            f.write(f"- max: {max(times):.1f}\n")
+
+        if ctx.copies:
+            f.write(f"\nCopies to {ctx.options['copy_to']}:\n")
+            for job in ctx.copies:
+                f.write(f"- {job.name}: {job.status}{f' ({job.error})' if job.error else ''}\n")
+
+    console = get_console()
+    if ctx.copies:
+        print_copy_summary(ctx.results, ctx.copies, ctx.options['copy_to'])
+    console.print("\nSnapshot creation process completed.")
+    console.print(f"Detailed log: {ctx.options['log_file']}")
+    console.print(f"Summary: {summary_file}")
+
+
+def copy_sources(ctx):
+    # A create run copies the snapshots it created and verified, the copy command its input list
+    if ctx.vms:
+        return [f"/subscriptions/{ctx.create_started[name][0]}/resourceGroups/{ctx.create_started[name][1]}"
+                f"/providers/Microsoft.Compute/snapshots/{name}" for name in ctx.created if name in ctx.create_started]
+    return ctx.snapshot_ids
+
+
+def copy_snapshots(ctx):
+    # CopyStart copies run in Azure; this starts up to --copy-parallel of them, fairest route first,
+    # and follows their completionPercent with one listing per target resource group per round
+    console = get_console()
+    location = ctx.options['copy_to']
+    jobs = plan_copies(copy_sources(ctx), location, ctx.options.get('copy_resource_group'), ctx.details)
+    if not jobs:
+        console.print("[yellow]No snapshots to copy.[/yellow]")
+        return
+    simulate = ctx.options.get('simulate')
+    backend = SimulatedCopies(simulate) if simulate else AzureCopies()
+    ctx.copy_lanes = Lanes()
+
+    def on_done(job):
+        subscription_name = split_snapshot_id(job.target_id, ctx.subscription_names)[0]
+        ctx.record(subscription_name, job.status, job.name, job.error)
+        emit(job.status, subscription=subscription_name, snapshot=job.name)
+
+    with EventStream(f"[cyan]Copying snapshots to {location}...", len(jobs), stage="copy", console=console) as stream:
+        def on_round(stats):
+            copied, copying, queued, rate, eta = stats
+            progress = f", {format_bytes(rate)}/s, ETA {format_duration(eta)}" if rate else ""
+            stream.describe(f"[cyan]Copying to {location}: {copying} running, {queued} queued{progress}")
+
+        ctx.copies = run_copies(jobs, backend, ctx.copy_lanes, ctx.options.get('copy_parallel') or COPIES_IN_FLIGHT,
+                                ctx.max_workers, ctx.shutdown, ctx.options.get('copy_timeout') or COPY_TIMEOUT,
+                                COPY_POLL_INTERVAL, on_done, on_round)
+    copied = sum(job.status == 'copied' for job in ctx.copies)
+    console.print(f"[green]✔ {copied} of {len(jobs)} snapshots copied to {location}.[/green]")
+
+
+def copy_report(ctx):
+    console = get_console()
+    if ctx.copies:
+        print_copy_summary(ctx.results, ctx.copies, ctx.options['copy_to'])
+    if ctx.copy_lanes:
+        # Copy time per route, from the start call until completionPercent reached 100
+        print_lane_latency(ctx.copy_lanes, title="Copy Time by Route", label="Route", minimum=1)
+    if ctx.result_writer:
+        ctx.result_writer.flush()
+        console.print(f"[green]✔ Results written to {ctx.result_writer.filename}[/green]")
+
+
+STAGES = {
+    'revalidate': Stage('revalidate', revalidate),
+    'validate': Stage('validate', validate),
+    'delete': Stage('delete', delete),
+    'optimistic-delete': Stage('delete', optimistic_delete),
+    'relock': Stage('relock', relock, always=True),
+    'report': Stage('report', report, always=True),
+    'validation-report': Stage('report', validation_report, always=True),
+    'save-validation-state': Stage('save-validation-state', persist_validation_state, always=True),
+    'plan-names': Stage('plan-names', plan_names),
+    'create': Stage('create', create),
+    'verify-creation': Stage('verify', verify_creation),
+    'creation-report': Stage('report', creation_report, always=True),
+    'copy': Stage('copy', copy_snapshots),
+    'copy-report': Stage('report', copy_report, always=True),
+}
+
+PIPELINES = {
+    'delete': ['validate', 'delete', 'relock', 'report'],
+    # One delete per snapshot instead of a show and a delete; locks are removed only where a delete hits one
+    'delete-optimistic': ['optimistic-delete', 'relock', 'report'],
+    'validate': ['revalidate', 'validate', 'validation-report', 'save-validation-state'],
+    # 'copy' only runs with --copy-to, once the snapshots it copies are confirmed
+    'create': ['plan-names', 'create', 'verify-creation', 'copy', 'creation-report'],
+    'copy': ['copy', 'copy-report'],
+}
+
+
+def build_pipeline(name, skip=()):
+    return [STAGES[stage] for stage in PIPELINES[name] if stage not in skip]
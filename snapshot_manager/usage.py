@@ -0,0 +1,148 @@
+import datetime
+import json
+import logging
+import os
+import time
+from typing import NamedTuple
+
+from .ids import split_id
+
+# Returned by the same 'az snapshot show' validation already runs, so the details cost no extra call
+DETAILS_FIELDS = 'diskSizeGb:diskSizeGb, sku:sku.name, incremental:incremental, timeCreated:timeCreated, location:location'
+DETAILS_QUERY = f'{{{DETAILS_FIELDS}}}'
+# The same fields for every snapshot of a resource group listing
+DETAILS_LIST_QUERY = f'[].{{id:id, {DETAILS_FIELDS}}}'
+# Pay-as-you-go USD per GB-month of snapshot storage; SNAPSHOT_PRICES='{"Premium_LRS": 0.13}' overrides entries
+PRICE_PER_GB_MONTH = {
+    'Standard_LRS': 0.05,
+    'Standard_ZRS': 0.0625,
+    'Premium_LRS': 0.12,
+    'Premium_ZRS': 0.15,
+}
+DEFAULT_PRICE_PER_GB_MONTH = 0.05
+USAGE_COLUMNS = ['Size GB', 'SKU', 'Incremental', 'Time Created', 'Est. Monthly Cost']
+# Named deletion priorities; anything else given to --priority is evaluated as an expression over PRIORITY_FIELDS
+PRIORITIES = ('size', 'age', 'cost')
+PRIORITY_FIELDS = ('size_gb', 'age_days', 'cost', 'sku', 'incremental', 'name', 'resource_group', 'subscription')
+
+
+def load_prices():
+    prices = dict(PRICE_PER_GB_MONTH)
+    try:
+        prices.update(json.loads(os.environ.get('SNAPSHOT_PRICES') or '{}'))
+    except ValueError as e:
+        logging.warning(f"Ignoring unreadable SNAPSHOT_PRICES: {str(e)}")
+    return prices
+
+
+PRICES = load_prices()
+
+
+class SnapshotDetails(NamedTuple):
+    size_gb: int
+    sku: str
+    incremental: bool
+    time_created: str
+    # Defaulted so details saved before locations were captured still load
+    location: str = None
+
+    @property
+    def monthly_cost(self):
+        # Incremental snapshots are billed on changed blocks only, so for them this is an upper bound
+        return (self.size_gb or 0) * PRICES.get(self.sku, DEFAULT_PRICE_PER_GB_MONTH)
+
+
+def parse_details(payload):
+    # Accepts the DETAILS_QUERY output of az as well as a full ARM resource
+    try:
+        data = json.loads(payload) if isinstance(payload, str) else payload
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    properties = data.get('properties') or data
+    sku = data.get('sku')
+    return SnapshotDetails(
+        properties.get('diskSizeGB') or properties.get('diskSizeGb') or 0,
+        sku.get('name') if isinstance(sku, dict) else sku,
+        bool(properties.get('incremental')),
+        properties.get('timeCreated'),
+        data.get('location'),
+    )
+
+
+def usage_cells(details):
+    if details is None:
+        return ['', '', '', '', '']
+    return [str(details.size_gb), details.sku or '', 'true' if details.incremental else 'false',
+            details.time_created or '', f"{details.monthly_cost:.2f}"]
+
+
+def aggregate_usage(snapshot_ids, details, subscription_names):
+    # {(subscription name, resource group): [snapshots, GB, monthly cost]} over the snapshots with known details
+    usage = {}
+    for snapshot_id in snapshot_ids:
+        snapshot = details.get(snapshot_id)
+        if snapshot is None:
+            continue
+        subscription_id, resource_group, _ = split_id(snapshot_id)
+        totals = usage.setdefault((subscription_names.get(subscription_id, subscription_id), resource_group), [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += snapshot.size_gb or 0
+        totals[2] += snapshot.monthly_cost
+    return usage
+
+
+def usage_by_subscription(usage):
+    totals = {}
+    for (subscription_name, _), (count, size_gb, cost) in usage.items():
+        entry = totals.setdefault(subscription_name, [0, 0, 0.0])
+        entry[0] += count
+        entry[1] += size_gb
+        entry[2] += cost
+    return totals
+
+
+def age_days(time_created, now=None):
+    if not time_created:
+        return 0.0
+    try:
+        created = datetime.datetime.fromisoformat(time_created.replace('Z', '+00:00'))
+    except ValueError:
+        return 0.0
+    return ((now or time.time()) - created.timestamp()) / 86400
+
+
+def priority_fields(snapshot_id, snapshot):
+    subscription_id, resource_group, name = split_id(snapshot_id)
+    return {
+        'size_gb': snapshot.size_gb if snapshot else 0,
+        'age_days': age_days(snapshot.time_created) if snapshot else 0.0,
+        'cost': snapshot.monthly_cost if snapshot else 0.0,
+        'sku': (snapshot.sku or '') if snapshot else '',
+        'incremental': snapshot.incremental if snapshot else False,
+        'name': name,
+        'resource_group': resource_group,
+        'subscription': subscription_id,
+    }
+
+
+def snapshot_priority(expression, details):
+    # Returns a key for the scheduler, higher runs first; $batch chunks rank by their best snapshot
+    if not expression:
+        return None
+    if expression in PRIORITIES:
+        expression = {'size': 'size_gb', 'age': 'age_days', 'cost': 'cost'}[expression]
+    try:
+        code = compile(expression, '<priority>', 'eval')
+        # Checked once up front so a typo fails before any lock is touched
+        eval(code, {'__builtins__': {}}, priority_fields('', None))
+    except Exception as e:
+        raise ValueError(f"Invalid priority expression '{expression}': {str(e)}")
+
+    def score(snapshot_id):
+        return eval(code, {'__builtins__': {}}, priority_fields(snapshot_id, details.get(snapshot_id)))
+
+    def priority(item):
+        return max(score(snapshot_id) for snapshot_id in item) if isinstance(item, tuple) else score(item)
+    return priority
@@ -0,0 +1,131 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from snapshot_manager import arm
+from snapshot_manager.auth import serve_stub_token_endpoint, set_auth_mode
+
+SUBSCRIPTION = '00000000-0000-0000-0000-000000000001'
+SNAPSHOTS = f"/subscriptions/{SUBSCRIPTION}/resourceGroups/rg-a/providers/Microsoft.Compute/snapshots"
+
+
+class FakeArm(BaseHTTPRequestHandler):
+    # Snapshots answer by name: 'gone' with 204, 'missing' with 404, 'slow' and 'broken' with a 202
+    # whose operation succeeds after one InProgress poll or fails
+    polls = {}
+    tokens = set()
+
+    def respond(self, status, content=None, headers=None):
+        body = json.dumps(content).encode() if content is not None else b''
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, method, url):
+        path = url.split('?')[0]
+        name = path.rstrip('/').split('/')[-1]
+        if path.startswith('/operations/'):
+            self.polls[name] = self.polls.get(name, 0) + 1
+            if self.polls[name] == 1:
+                return 200, {'status': 'InProgress'}, {}
+            if name == 'broken':
+                return 200, {'status': 'Failed', 'error': {'code': 'InternalError', 'message': 'Delete broke'}}, {}
+            return 200, {'status': 'Succeeded'}, {}
+        if name == 'missing':
+            return 404, {'error': {'code': 'ResourceNotFound', 'message': f"The Resource '{name}' was not found."}}, {}
+        if method == 'DELETE' and name == 'gone':
+            return 204, None, {}
+        if method == 'DELETE' and name in ('slow', 'broken'):
+            return 202, None, {'Azure-AsyncOperation': f"{arm.ARM_ENDPOINT}/operations/{name}", 'Retry-After': '0'}
+        if method == 'GET' and path.endswith('/snapshots'):
+            if 'page=2' in url:
+                return 200, {'value': [{'id': f"{path}/s3", 'name': 's3', 'properties': {'diskSizeGB': 3}}]}, {}
+            return 200, {'value': [{'id': f"{path}/s{index}", 'name': f"s{index}", 'properties': {'diskSizeGB': index}}
+                                   for index in (1, 2)],
+                         'nextLink': f"{arm.ARM_ENDPOINT}{path}?page=2"}, {}
+        return 200, {'name': name}, {}
+
+    def do_GET(self):
+        self.tokens.add(self.headers.get('Authorization'))
+        self.respond(*self.answer('GET', self.path))
+
+    def do_DELETE(self):
+        self.tokens.add(self.headers.get('Authorization'))
+        self.respond(*self.answer('DELETE', self.path))
+
+    def do_POST(self):
+        self.tokens.add(self.headers.get('Authorization'))
+        requests = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['requests']
+        responses = []
+        for request in requests:
+            status, content, headers = self.answer(request['httpMethod'], request['url'])
+            responses.append({'name': request['name'], 'httpStatusCode': status, 'headers': headers, 'content': content})
+        self.respond(200, {'responses': responses})
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_arm(monkeypatch):
+    tokens = serve_stub_token_endpoint()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), type('FakeArm', (FakeArm,), {'polls': {}, 'tokens': set()}))
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    monkeypatch.setattr(arm, 'ARM_ENDPOINT', f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(arm, 'LRO_POLL_INTERVAL', 0)
+    monkeypatch.setenv('IDENTITY_ENDPOINT', f"http://127.0.0.1:{tokens.server_address[1]}/token")
+    monkeypatch.delenv('IDENTITY_HEADER', raising=False)
+    set_auth_mode('managed-identity')
+    yield server.RequestHandlerClass
+    set_auth_mode('az')
+    for running in (server, tokens):
+        running.shutdown()
+        running.server_close()
+
+
+def test_batch_delete_maps_each_item(fake_arm):
+    names = ['ok', 'missing', 'gone', 'slow', 'broken']
+    results = arm.delete_snapshots([f"{SNAPSHOTS}/{name}" for name in names], no_content=arm.NOTHING_DELETED)
+    ok, missing, gone, slow, broken = results
+    assert ok == '{"name": "ok"}'
+    assert missing.startswith("Error: (ResourceNotFound)")
+    assert gone == arm.NOTHING_DELETED
+    # Long-running deletes are polled until their operation settles
+    assert slow == ''
+    assert broken == "Error: (InternalError) Delete broke"
+    assert fake_arm.polls == {'slow': 2, 'broken': 2}
+    # Every call carried the token the stub endpoint issued
+    assert fake_arm.tokens == {'Bearer stub-token-1'}
+
+
+def test_batch_delete_without_no_content_counts_204_as_success(fake_arm):
+    assert arm.delete_snapshots([f"{SNAPSHOTS}/gone", f"{SNAPSHOTS}/ok"]) == ['', '{"name": "ok"}']
+
+
+def test_single_delete_waits_for_operation(fake_arm):
+    assert arm.delete_snapshot(f"{SNAPSHOTS}/slow") == ''
+    assert arm.delete_snapshot(f"{SNAPSHOTS}/broken") == "Error: (InternalError) Delete broke"
+    assert arm.delete_snapshot(f"{SNAPSHOTS}/gone", no_content=arm.NOTHING_DELETED) == arm.NOTHING_DELETED
+
+
+def test_batch_show_keeps_order(fake_arm):
+    results = arm.show_snapshots([f"{SNAPSHOTS}/a", f"{SNAPSHOTS}/missing", f"{SNAPSHOTS}/b"])
+    assert [json.loads(result)['name'] if not result.startswith('Error:') else 'error' for result in results] == ['a', 'error', 'b']
+
+
+def test_listing_follows_next_link_and_flattens_properties(fake_arm):
+    snapshots = arm.list_snapshots(SUBSCRIPTION, 'rg-a')
+    assert [(snapshot['name'], snapshot['diskSizeGB']) for snapshot in snapshots] == [('s1', 1), ('s2', 2), ('s3', 3)]
+
+
+def test_missing_batch_response_is_an_error(monkeypatch):
+    monkeypatch.setattr(arm, 'arm_request', lambda *args, **kwargs: (200, {}, {'responses': [
+        {'name': '1', 'httpStatusCode': 200, 'content': {'name': 'second'}}]}))
+    first, second = arm.run_batch([('GET', f"{SNAPSHOTS}/first", None), ('GET', f"{SNAPSHOTS}/second", None)])
+    assert first.startswith("Error: (BatchResponseMissing)")
+    assert second == '{"name": "second"}'
@@ -0,0 +1,88 @@
+from snapshot_manager.copies import MAX_NAME_LENGTH, SimulatedCopies, copy_name, plan_copies, run_copies
+from snapshot_manager.scheduler import Lanes
+from snapshot_manager.shutdown import ShutdownSignal
+
+SUBSCRIPTION = '00000000-0000-0000-0000-000000000001'
+
+
+def snapshot_ids(count, resource_group='rg-westus'):
+    return [f"/subscriptions/{SUBSCRIPTION}/resourceGroups/{resource_group}/providers/Microsoft.Compute/snapshots/"
+            f"RH_vm{index}_CHG0001234_20261019120000" for index in range(count)]
+
+
+def copy(jobs, backend, max_in_flight=4, lanes=None, **options):
+    options.setdefault('poll_interval', 0.01)
+    return run_copies(jobs, backend, lanes or Lanes(), max_in_flight, 4, **options)
+
+
+def test_plan_keeps_the_group_and_suffixes_the_region():
+    [job] = plan_copies(snapshot_ids(1), 'eastus2')
+    assert job.target_id.endswith('/resourceGroups/rg-westus/providers/Microsoft.Compute/snapshots/'
+                                  'RH_vm0_CHG0001234_20261019120000_eastus2')
+    assert job.lane.startswith('copy:') and job.lane.endswith('>eastus2')
+    [job] = plan_copies(snapshot_ids(1), 'eastus2', resource_group='rg-copies')
+    assert '/resourceGroups/rg-copies/' in job.target_id
+    assert len(copy_name('x' * 100, 'eastus2')) == MAX_NAME_LENGTH
+
+
+def test_every_copy_finishes():
+    jobs = plan_copies(snapshot_ids(6), 'eastus2')
+    rounds = []
+    done = copy(jobs, SimulatedCopies(mb_per_second=10 ** 7, failure_rate=0), max_in_flight=2, on_round=rounds.append)
+    assert sorted(job.status for job in done) == ['copied'] * 6
+    assert all(job.percent == 100.0 and job.size_bytes for job in done)
+    # (copied, copying, queued, rate, eta) per round, never more than max_in_flight copying
+    assert all(copying <= 2 for _, copying, _, _, _ in rounds)
+    assert rounds[-1][:3] == (6, 0, 0)
+
+
+def test_failed_copies_report_the_copy_error():
+    jobs = plan_copies(snapshot_ids(3), 'eastus2')
+    done = copy(jobs, SimulatedCopies(mb_per_second=10 ** 7, failure_rate=1, seed=1))
+    assert [(job.status, job.error) for job in done] == [('failed', 'Simulated copy failure')] * 3
+
+
+def test_refused_starts_fail_and_the_rest_carry_on():
+    class Refusing(SimulatedCopies):
+        def start(self, job):
+            if job.name.startswith('RH_vm0_'):
+                return "Error: (QuotaExceeded) Too many copies"
+            return super().start(job)
+
+    done = copy(plan_copies(snapshot_ids(3), 'eastus2'), Refusing(mb_per_second=10 ** 7, failure_rate=0))
+    outcomes = {job.name.split('_')[1]: (job.status, job.error) for job in done}
+    assert outcomes == {'vm0': ('failed', '(QuotaExceeded) Too many copies'), 'vm1': ('copied', None),
+                        'vm2': ('copied', None)}
+
+
+def test_lane_caps_limit_copies_per_route():
+    west = plan_copies(snapshot_ids(4), 'eastus2')
+    north = plan_copies(snapshot_ids(4, 'rg-northeurope'), 'eastus2')
+    lanes = Lanes({west[0].lane: 1})
+    peaks = {}
+
+    class Watched(SimulatedCopies):
+        # Starts of a round run together, so the lanes' counts at a start are the round's in-flight copies
+        def start(self, job):
+            peaks[job.lane] = max(peaks.get(job.lane, 0), lanes.in_flight[job.lane])
+            return super().start(job)
+
+    done = copy(west + north, Watched(mb_per_second=10 ** 7, failure_rate=0), max_in_flight=4, lanes=lanes)
+    assert len(done) == 8 and all(job.status == 'copied' for job in done)
+    assert peaks[west[0].lane] == 1
+    assert peaks[north[0].lane] == 3
+
+
+def test_timeout_leaves_running_copies_copying_and_queued_ones_cancelled():
+    jobs = plan_copies(snapshot_ids(3), 'eastus2')
+    done = copy(jobs, SimulatedCopies(mb_per_second=1, failure_rate=0), max_in_flight=2, timeout=0.05)
+    statuses = sorted(job.status for job in done)
+    assert statuses == ['cancelled', 'copying', 'copying']
+    assert all('copy timeout of 0.05s reached' in job.error for job in done)
+
+
+def test_shutdown_before_start_cancels_everything():
+    shutdown = ShutdownSignal()
+    shutdown.event.set()
+    done = copy(plan_copies(snapshot_ids(2), 'eastus2'), SimulatedCopies(), shutdown=shutdown)
+    assert [(job.status, job.error) for job in done] == [('cancelled', 'Not started: shutdown requested')] * 2
@@ -0,0 +1,84 @@
+import csv
+import json
+
+import pytest
+
+from snapshot_manager.export import RESULT_COLUMNS, ResultWriter, read_rows, result_row
+from snapshot_manager.usage import SnapshotDetails
+
+DETAILS = SnapshotDetails(128, 'Standard_LRS', True, '2026-09-01T00:00:00Z')
+
+
+def rows():
+    return [result_row('sub-a', 'deleted', 'snap-1', details=DETAILS),
+            result_row('sub-a', 'non-existent', 'snap-2', 'ResourceNotFound'),
+            result_row(None, 'failed', 'snap-3', 'ScopeLocked')]
+
+
+def test_result_row_layout():
+    deleted, missing, failed = rows()
+    assert deleted[:4] == ['sub-a', 'deleted', 'snap-1', '']
+    assert deleted[4:8] == ['128', 'Standard_LRS', 'true', '2026-09-01T00:00:00Z']
+    # As the v2/v3 scripts wrote it, whatever the underlying error was
+    assert missing[:4] == ['sub-a', 'non-existent', 'snap-2', 'Snapshot not found']
+    assert failed[:4] == ['Unknown', 'failed', 'snap-3', 'ScopeLocked']
+    assert all(len(row) == len(RESULT_COLUMNS) for row in rows())
+
+
+def test_csv_header_is_written_on_open_and_rows_on_flush(tmp_path):
+    path = tmp_path / 'results.csv'
+    with ResultWriter(str(path), flush_rows=2, flush_seconds=None) as writer:
+        assert list(csv.reader(path.open())) == [RESULT_COLUMNS]
+        for row in rows():
+            writer.write(row)
+        # Two rows reached the threshold, the third waits for the next flush
+        assert len(list(csv.reader(path.open()))) == 3
+    assert list(csv.reader(path.open())) == [RESULT_COLUMNS] + rows()
+    assert writer.rows == 3
+
+
+def test_jsonl_records_are_keyed_by_column(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    with ResultWriter(str(path)) as writer:
+        for row in rows():
+            writer.write(row)
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record['Snapshot'] for record in records] == ['snap-1', 'snap-2', 'snap-3']
+    assert records[0]['Size GB'] == '128'
+    assert list(read_rows(str(path), RESULT_COLUMNS)) == rows()
+
+
+def test_save_as_renames_or_converts(tmp_path):
+    writer = ResultWriter(str(tmp_path / 'stream.csv')).open()
+    for row in rows():
+        writer.write(row)
+    writer.save_as(str(tmp_path / 'final.csv'))
+    assert not (tmp_path / 'stream.csv').exists()
+    writer.save_as(str(tmp_path / 'final.jsonl'))
+    assert not (tmp_path / 'final.csv').exists()
+    assert writer.filename == str(tmp_path / 'final.jsonl')
+    assert list(read_rows(writer.filename, RESULT_COLUMNS)) == rows()
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'results.parquet')
+    with ResultWriter(path) as writer:
+        for row in rows():
+            writer.write(row)
+    assert list(read_rows(path, RESULT_COLUMNS)) == rows()
+
+
+def test_parquet_without_pyarrow_explains(tmp_path, monkeypatch):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def no_pyarrow(name, *args, **kwargs):
+        if name.startswith('pyarrow'):
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', no_pyarrow)
+    with pytest.raises(RuntimeError, match='pyarrow is required'):
+        ResultWriter(str(tmp_path / 'results.parquet')).open()
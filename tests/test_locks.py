@@ -0,0 +1,91 @@
+import asyncio
+import json
+import threading
+
+from snapshot_manager import locks
+from snapshot_manager.locks import (ScopeLock, ScopeLockManager, forget_removed_locks, load_removed_locks,
+                                    save_removed_locks)
+
+SUBSCRIPTION = '00000000-0000-0000-0000-000000000001'
+
+
+def lock(name, resource_group='rg-a', resource=None):
+    return ScopeLock(SUBSCRIPTION, name, resource_group=resource_group, resource=resource,
+                     id=f"/subscriptions/{SUBSCRIPTION}/resourceGroups/{resource_group}/providers/"
+                        f"Microsoft.Authorization/locks/{name}")
+
+
+def test_save_merges_without_duplicates(tmp_path):
+    path = str(tmp_path / 'removed.json')
+    save_removed_locks([lock('one'), lock('two')], path)
+    # Same lock with different case is the same ARM lock
+    save_removed_locks([lock('TWO', 'RG-A'), lock('three', 'rg-b')], path)
+    assert [entry.name for entry in load_removed_locks(path)] == ['one', 'two', 'three']
+
+
+def test_forget_keeps_unrestored_and_removes_empty_file(tmp_path):
+    path = tmp_path / 'removed.json'
+    save_removed_locks([lock('one'), lock('two')], str(path))
+    forget_removed_locks([lock('one')], str(path))
+    assert load_removed_locks(str(path)) == [lock('two')]
+    forget_removed_locks([lock('two')], str(path))
+    assert not path.exists()
+    # Nothing to forget from a missing file
+    forget_removed_locks([lock('two')], str(path))
+
+
+def test_concurrent_saves_keep_every_lock(tmp_path):
+    path = str(tmp_path / 'removed.json')
+    threads = [threading.Thread(target=save_removed_locks, args=([lock(f'lock-{index}', f'rg-{index}')], path))
+               for index in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(load_removed_locks(path)) == 20
+    assert not (tmp_path / 'removed.json.tmp').exists()
+
+
+def test_record_state_saves_removed_and_forgets_restored(tmp_path):
+    path = str(tmp_path / 'removed.json')
+    manager = ScopeLockManager(state_file=path)
+    unlisted = ScopeLock(SUBSCRIPTION, 'config-only', resource_group='rg-c')
+    manager.record_state('delete', [(lock('one'), True, ''), (lock('two'), False, ''), (unlisted, True, '')])
+    # Only locks with an ARM ID can be put back, and only the removed ones need to be
+    assert load_removed_locks(path) == [lock('one')]
+    manager.record_state('delete', [(lock('three'), True, '')])
+    manager.record_state('restore', [(lock('one'), True, ''), (lock('three'), False, '')])
+    assert load_removed_locks(path) == [lock('three')]
+
+
+def test_restore_plans_from_state_file(tmp_path, monkeypatch):
+    path = tmp_path / 'removed.json'
+    other = ScopeLock('00000000-0000-0000-0000-000000000002', 'other', resource_group='rg-z', id='/x/locks/other')
+    path.write_text(json.dumps([lock('one')._asdict(), other._asdict()]))
+    applied = {}
+
+    async def apply(self, action, plan):
+        applied[action] = plan
+        return []
+
+    monkeypatch.setattr(ScopeLockManager, 'apply', apply)
+    asyncio.run(ScopeLockManager(state_file=str(path)).run('restore', [SUBSCRIPTION]))
+    assert applied == {'restore': {SUBSCRIPTION: [lock('one')]}}
+
+
+def test_covers_resource_group_and_resource_locks():
+    manager = ScopeLockManager(resource_groups={SUBSCRIPTION: {'rg-a'}})
+    resource = f"/subscriptions/{SUBSCRIPTION}/resourceGroups/RG-A/providers/Microsoft.Compute/disks/d1"
+    assert manager._covers(SUBSCRIPTION, lock('group'))
+    assert manager._covers(SUBSCRIPTION, lock('disk', 'RG-A', resource))
+    assert not manager._covers(SUBSCRIPTION, lock('elsewhere', 'rg-b'))
+    assert not manager._covers(SUBSCRIPTION, ScopeLock(SUBSCRIPTION, 'subscription-wide'))
+
+
+def test_parse_lock_scopes():
+    base = f"/subscriptions/{SUBSCRIPTION}/resourceGroups/rg-a"
+    group = locks.parse_lock(SUBSCRIPTION, {'id': f"{base}/providers/Microsoft.Authorization/locks/keep", 'name': 'keep'})
+    disk = locks.parse_lock(SUBSCRIPTION, {'id': f"{base}/providers/Microsoft.Compute/disks/d1/providers/"
+                                                 f"Microsoft.Authorization/locks/keep", 'name': 'keep'})
+    assert (group.scope, group.resource_group) == ('resource group', 'rg-a')
+    assert (disk.scope, disk.resource_group, disk.resource) == ('resource', 'rg-a', f"{base}/providers/Microsoft.Compute/disks/d1")
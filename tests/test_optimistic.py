@@ -0,0 +1,106 @@
+import pytest
+
+from snapshot_manager import stages
+from snapshot_manager.locks import ScopeLock
+from snapshot_manager.pipeline import RunContext, run_pipeline
+
+SUBSCRIPTION = '00000000-0000-0000-0000-000000000001'
+LOCK = ScopeLock(SUBSCRIPTION, 'keep', resource_group='rg-locked', id=f"/subscriptions/{SUBSCRIPTION}/resourceGroups/"
+                                                                       f"rg-locked/providers/Microsoft.Authorization/locks/keep")
+
+
+def snapshot_id(resource_group, name):
+    return f"/subscriptions/{SUBSCRIPTION}/resourceGroups/{resource_group}/providers/Microsoft.Compute/snapshots/{name}"
+
+
+class FakeAzure:
+    # Snapshots answer their delete by name: 'gone' with a 404 (deleted since the listing), 'busy' with
+    # throttling, 'denied' with a 403, anything in rg-locked with ScopeLocked while LOCK is in place
+    def __init__(self):
+        self.locked = True
+        self.deleted = []
+        self.removed = []
+        self.restored = []
+
+    def run_az_json(self, args):
+        resource_group = args[args.index('--resource-group') + 1]
+        names = {'rg-open': ['ok', 'gone', 'busy', 'denied'], 'rg-locked': ['held'], 'rg-big': ['small', 'large']}
+        sizes = {'small': 10, 'large': 500}
+        return [{'id': snapshot_id(resource_group, name), 'diskSizeGb': sizes.get(name, 64), 'sku': 'Standard_LRS',
+                 'incremental': False, 'timeCreated': '2026-09-01T00:00:00Z', 'location': 'westus'}
+                for name in names[resource_group]]
+
+    def run_az_command(self, args):
+        target = args[args.index('--ids') + 1]
+        name = target.split('/')[-1]
+        if name == 'gone':
+            return f"Error: (ResourceNotFound) The Resource '{target}' was not found."
+        if name == 'busy':
+            return "Error: (TooManyRequests) Too many requests, retry later"
+        if name == 'denied':
+            return "Error: (AuthorizationFailed) The client does not have authorization to perform action"
+        if '/rg-locked/' in target and self.locked:
+            return "Error: (ScopeLocked) The scope is locked"
+        self.deleted.append(name)
+        return ''
+
+    def manager(self, max_concurrency=None, **options):
+        azure = self
+
+        class Manager:
+            async def find_locks(self, subscriptions):
+                return [(subscription, [LOCK], None) for subscription in subscriptions]
+
+            async def remove_locks(self, locks):
+                azure.removed.extend(locks)
+                azure.locked = False
+                return [(lock, True, f"removed {lock.name}") for lock in locks]
+
+            async def restore_locks(self, locks):
+                azure.restored.extend(locks)
+                azure.locked = True
+                return [(lock, True, f"restored {lock.name}") for lock in locks]
+
+        return Manager()
+
+
+@pytest.fixture
+def azure(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    fake = FakeAzure()
+    monkeypatch.setattr(stages, 'auth_mode', lambda: 'az')
+    monkeypatch.setattr(stages, 'run_az_json', fake.run_az_json)
+    monkeypatch.setattr(stages, 'run_az_command', fake.run_az_command)
+    monkeypatch.setattr(stages, 'ScopeLockManager', fake.manager)
+    return fake
+
+
+def run(snapshot_ids, max_workers=2, **options):
+    ctx = RunContext(snapshot_ids, {SUBSCRIPTION: 'sub-a'}, max_workers=max_workers, **options)
+    run_pipeline(ctx, stages.build_pipeline('delete-optimistic'))
+    return ctx
+
+
+def statuses(ctx):
+    return {status: sorted(entry if isinstance(entry, str) else entry[0] for entry in entries)
+            for status, entries in ctx.results['sub-a'].items() if entries}
+
+
+def test_only_deleted_or_locked_snapshots_count_as_existing(azure):
+    names = [('rg-open', 'ok'), ('rg-open', 'gone'), ('rg-open', 'busy'), ('rg-open', 'denied'),
+             ('rg-open', 'ghost'), ('rg-locked', 'held')]
+    ctx = run([snapshot_id(*name) for name in names])
+    assert statuses(ctx) == {'valid': ['held', 'ok'], 'deleted': ['held', 'ok'], 'non-existent': ['ghost', 'gone'],
+                             'error': ['busy', 'denied']}
+    assert sorted(ctx.valid_snapshots) == [snapshot_id('rg-locked', 'held'), snapshot_id('rg-open', 'ok')]
+    # 'ghost' is not in the listing, so no delete was sent for it
+    assert sorted(azure.deleted) == ['held', 'ok']
+    # Only the group that answered ScopeLocked was unlocked, and it was relocked once done
+    assert (azure.removed, azure.restored, ctx.removed_locks) == ([LOCK], [LOCK], [])
+
+
+def test_listing_sizes_drive_priority(azure):
+    # One worker runs the deletes in the order they are dispatched
+    ctx = run([snapshot_id('rg-big', 'small'), snapshot_id('rg-big', 'large')], max_workers=1, priority='size')
+    assert [ctx.details[snapshot_id('rg-big', name)].size_gb for name in ('small', 'large')] == [10, 500]
+    assert azure.deleted == ['large', 'small']
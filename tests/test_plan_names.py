@@ -0,0 +1,80 @@
+import pytest
+
+from snapshot_manager import stages
+from snapshot_manager.pipeline import RunContext
+
+SUBSCRIPTION = '00000000-0000-0000-0000-000000000001'
+CHG = 'CHG0001234'
+TIMESTAMP = '20261019120000'
+
+
+def vm(name, resource_group='rg-a'):
+    return (f"/subscriptions/{SUBSCRIPTION}/resourceGroups/{resource_group}/providers/Microsoft.Compute/"
+            f"virtualMachines/{name}", name)
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    # Existing snapshot names per resource group; a group left out fails to list
+    existing = {}
+
+    def list_provisioning_states(subscription_id, resource_group):
+        if resource_group not in existing:
+            raise RuntimeError("listing failed")
+        return {name.lower(): (name, 'Succeeded') for name in existing[resource_group]}
+
+    monkeypatch.setattr(stages, 'list_provisioning_states', list_provisioning_states)
+    return existing
+
+
+def plan(vms, on_existing=None):
+    ctx = RunContext(subscription_names={SUBSCRIPTION: 'sub-a'}, chg_number=CHG, timestamp=TIMESTAMP,
+                     on_existing=on_existing)
+    ctx.vms = vms
+    stages.plan_names(ctx)
+    return ctx
+
+
+def test_new_names_are_planned(listings):
+    listings['rg-a'] = ['RH_other_CHG0001234_20261001000000']
+    ctx = plan([vm('web1'), vm('web2')])
+    assert ctx.create_plan == [(vm('web1'), f"RH_web1_{CHG}_{TIMESTAMP}"), (vm('web2'), f"RH_web2_{CHG}_{TIMESTAMP}")]
+
+
+def test_reuse_takes_the_newest_existing_snapshot(listings):
+    listings['rg-a'] = ['RH_web1_CHG0001234_20261001000000', 'RH_web1_CHG0001234_20261002000000_2',
+                        # A region copy of the VM's snapshot is not the VM's own
+                        'RH_web1_CHG0001234_20261003000000_eastus2']
+    ctx = plan([vm('web1')])
+    assert ctx.create_plan == []
+    assert ctx.create_reused == ['RH_web1_CHG0001234_20261002000000_2']
+    assert ctx.create_started == {'RH_web1_CHG0001234_20261002000000_2': (SUBSCRIPTION, 'rg-a', None)}
+
+
+def test_skip_reports_the_existing_snapshot(listings):
+    listings['rg-a'] = ['RH_web1_CHG0001234_20261001000000']
+    ctx = plan([vm('web1')], 'skip')
+    assert ctx.create_plan == []
+    assert ctx.create_skipped == ["web1: Existing snapshot RH_web1_CHG0001234_20261001000000"]
+
+
+def test_suffix_avoids_existing_and_planned_names(listings):
+    name = f"RH_web1_{CHG}_{TIMESTAMP}"
+    listings['rg-a'] = [name, f"{name}_2"]
+    ctx = plan([vm('web1'), vm('web1')], 'suffix')
+    assert [snapshot_name for _, snapshot_name in ctx.create_plan] == [f"{name}_3", f"{name}_4"]
+
+
+def test_a_vm_listed_twice_is_planned_once(listings):
+    listings['rg-a'] = []
+    ctx = plan([vm('web1'), vm('web1')])
+    assert ctx.create_plan == [(vm('web1'), f"RH_web1_{CHG}_{TIMESTAMP}")]
+    assert ctx.create_skipped == ["web1: Listed twice in the VM list"]
+
+
+def test_unlisted_groups_fall_back_to_the_create(listings):
+    listings['rg-a'] = [f"RH_web1_{CHG}_{TIMESTAMP}"]
+    ctx = plan([vm('web1', 'rg-b'), vm('web2', 'rg-b')])
+    # Nothing is known about rg-b, so both are planned as they are and the create reports any collision
+    assert [snapshot_name for _, snapshot_name in ctx.create_plan] == [f"RH_web1_{CHG}_{TIMESTAMP}",
+                                                                       f"RH_web2_{CHG}_{TIMESTAMP}"]
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from snapshot_manager.scheduler import Batch, Deadline, Lanes, run_batches
+from snapshot_manager.shutdown import ShutdownSignal
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
+def collect():
+    results = []
+    return results, lambda item, future: results.append((item, future.result()))
+
+
+def test_every_item_runs_and_batches_close_once(executor):
+    results, on_result = collect()
+    closed = []
+    batches = [Batch(key, [f"{key}{index}" for index in range(3)]) for key in 'abc']
+    undispatched, unfinished = run_batches(executor, str.upper, batches, on_result, ShutdownSignal(), 4, 2,
+                                           on_batch_done=lambda batch: closed.append(batch.key))
+    assert (undispatched, unfinished) == ([], [])
+    assert sorted(results) == sorted((item, item.upper()) for batch in batches for item in batch.items)
+    assert sorted(closed) == ['a', 'b', 'c']
+
+
+def test_priority_dispatches_best_item_first():
+    results, on_result = collect()
+    batches = [Batch('a', [1, 5]), Batch('b', [9, 3])]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        run_batches(executor, lambda item: item, batches, on_result, ShutdownSignal(), 1, 2, priority=lambda item: item)
+    assert [item for item, _ in results] == [9, 5, 3, 1]
+
+
+def test_deadline_stops_dispatch_when_items_would_finish_late(executor):
+    results, on_result = collect()
+    deadline = Deadline(time.time() + 0.5, estimate=0.2)
+    batches = [Batch('a', range(20))]
+    undispatched, unfinished = run_batches(executor, lambda item: time.sleep(0.1), batches, on_result, ShutdownSignal(),
+                                           1, 1, deadline=deadline)
+    assert deadline.reached
+    assert 0 < len(results) < 20
+    assert len(results) + len(undispatched) == 20
+    assert unfinished == []
+
+
+def test_callable_reserve_follows_pending_work():
+    pending = [1, 2, 3]
+
+    def reserve():
+        return 5 * len(pending)
+
+    # 15 seconds reserved does not fit in 10, 5 does
+    assert not Deadline(time.time() + 10, reserve, estimate=0).allows_dispatch()
+    del pending[1:]
+    assert Deadline(time.time() + 10, reserve, estimate=0).allows_dispatch()
+
+
+def test_slow_start_hook_does_not_hold_up_other_batches(executor):
+    order = []
+    release = threading.Event()
+
+    def on_start(batch):
+        if batch.key == 'slow':
+            release.wait(5)
+
+    def fn(item):
+        order.append(item)
+        if item == 'fast':
+            release.set()
+        return item
+
+    batches = [Batch('slow', ['locked']), Batch('fast', ['fast'])]
+    run_batches(executor, fn, batches, lambda item, future: None, ShutdownSignal(), 2, 2, on_batch_start=on_start)
+    # The slow batch's item waited for its own hook, the other batch did not
+    assert order == ['fast', 'locked']
+
+
+def test_done_hooks_finish_before_return_and_failures_are_contained(executor):
+    done = []
+
+    def on_done(batch):
+        time.sleep(0.05)
+        if batch.key == 'b':
+            raise RuntimeError("relock failed")
+        done.append(batch.key)
+
+    batches = [Batch(key, [key]) for key in 'abc']
+    run_batches(executor, str.upper, batches, lambda item, future: None, ShutdownSignal(), 3, 3, on_batch_done=on_done)
+    assert sorted(done) == ['a', 'c']
+
+
+def test_shutdown_leaves_everything_undispatched_but_closes_opened_batches(executor):
+    shutdown = ShutdownSignal()
+    shutdown.event.set()
+    closed = []
+    batches = [Batch('a', [1, 2])]
+    undispatched, unfinished = run_batches(executor, str, batches, lambda item, future: None, shutdown, 2, 1,
+                                           on_batch_done=lambda batch: closed.append(batch.key))
+    assert (undispatched, unfinished, closed) == ([1, 2], [], [])
+
+
+def test_lane_caps_hold_while_other_lanes_use_free_workers(executor):
+    lanes = Lanes({'slow': 1}, default_limit=3)
+    peaks = Counter()
+    running = Counter()
+    lock = threading.Lock()
+
+    def fn(item):
+        lane = item[0]
+        with lock:
+            running[lane] += 1
+            peaks[lane] = max(peaks[lane], running[lane])
+        time.sleep(0.02)
+        with lock:
+            running[lane] -= 1
+
+    batches = [Batch(('slow', index), [('slow', index, n) for n in range(3)], lane='slow') for index in range(2)]
+    batches += [Batch(('fast', index), [('fast', index, n) for n in range(3)], lane='fast') for index in range(2)]
+    undispatched, _ = run_batches(executor, fn, batches, lambda item, future: future.result(), ShutdownSignal(), 4, 2,
+                                  lanes=lanes)
+    assert undispatched == []
+    assert peaks == {'slow': 1, 'fast': 3}
+    latency = lanes.latency()
+    assert [latency[lane][0] for lane in ('fast', 'slow')] == [6, 6]
+    assert lanes.in_flight == {'slow': 0, 'fast': 0}
+
+
+def test_max_batches_applies_per_lane(executor):
+    opened = []
+    lock = threading.Lock()
+
+    def on_start(batch):
+        with lock:
+            opened.append(batch.lane)
+
+    def fn(item):
+        time.sleep(0.02)
+
+    batches = [Batch((lane, index), [index], lane=lane) for lane in ('east', 'west') for index in range(3)]
+    run_batches(executor, fn, batches, lambda item, future: None, ShutdownSignal(), 4, 1, on_batch_start=on_start,
+                lanes=Lanes())
+    # One open batch per lane, so the first two opened cover both regions
+    assert sorted(opened[:2]) == ['east', 'west']
+    assert len(opened) == 6